@@ -71,9 +71,35 @@ global ALL_NODES
 All list of all the nodes
 """
 
+NODES = None
+"""
+Node settings of the last file loaded with load_settings_from_file, used by the trees created without node settings
+"""
+
+class NodeSettings:
+    """
+    Lists of the allowed nodes of a behaviors settings file, with the meaning of the module globals above.
+    Environments hold their own, so that trees of different scenarios can be handled side by side.
+    """
+    def __init__(self, file):
+        with open(file) as f:
+            bt_settings = yaml.load(f, Loader=yaml.FullLoader)
+        self.fallback_nodes = bt_settings.get("fallback_nodes") or []
+        self.sequence_nodes = bt_settings.get("sequence_nodes") or []
+        self.control_nodes = (bt_settings.get("control_nodes") or []) + self.fallback_nodes + self.sequence_nodes
+        self.condition_nodes = bt_settings.get("condition_nodes") or []
+        self.action_nodes = bt_settings.get("action_nodes") or []
+        self.atomic_fallback_nodes = bt_settings.get("atomic_fallback_nodes") or []
+        self.atomic_sequence_nodes = bt_settings.get("atomic_sequence_nodes") or []
+        self.up_node = bt_settings.get("up_node") or []
+        self.behavior_nodes = self.action_nodes + self.atomic_fallback_nodes + self.atomic_sequence_nodes
+        self.leaf_nodes = self.condition_nodes + self.behavior_nodes
+        self.all_nodes = self.control_nodes + self.leaf_nodes + self.up_node
+
 def load_settings_from_file(file):
     """
-    Sets the lists of allowed nodes module wide.
+    Sets the lists of allowed nodes module wide, they are used by the trees created without node settings.
+    Returns the node settings
     """
     global FALLBACK_NODES
     global SEQUENCE_NODES
@@ -86,74 +112,21 @@ def load_settings_from_file(file):
     global LEAF_NODES
     global BEHAVIOR_NODES
     global ALL_NODES
-
-    FALLBACK_NODES = []
-    SEQUENCE_NODES = []
-    CONTROL_NODES = []
-    CONDITION_NODES = []
-    ACTION_NODES = []
-    ATOMIC_FALLBACK_NODES = []
-    ATOMIC_SEQUENCE_NODES = []
-    LEAF_NODES = []
-    BEHAVIOR_NODES = []
-    ALL_NODES = []
-
-    with open(file) as f:
-        BT_SETTINGS = yaml.load(f, Loader=yaml.FullLoader)
-    try: 
-        FALLBACK_NODES = BT_SETTINGS["fallback_nodes"]
-        if FALLBACK_NODES is None:
-            FALLBACK_NODES = []
-    except KeyError:
-        pass
-    try: 
-        SEQUENCE_NODES = BT_SETTINGS["sequence_nodes"]
-        if SEQUENCE_NODES is None:
-            SEQUENCE_NODES = []
-    except KeyError:
-        pass
-    try:
-        CONTROL_NODES = BT_SETTINGS["control_nodes"]
-    except KeyError:
-        pass
-    CONTROL_NODES += FALLBACK_NODES
-    CONTROL_NODES += SEQUENCE_NODES
-    ALL_NODES += CONTROL_NODES
-    try:
-        CONDITION_NODES = BT_SETTINGS["condition_nodes"]
-    except KeyError:
-        pass
-    LEAF_NODES += CONDITION_NODES
-    ALL_NODES += CONDITION_NODES
-    try:
-        ACTION_NODES = BT_SETTINGS["action_nodes"]
-    except KeyError:
-        pass
-    BEHAVIOR_NODES += ACTION_NODES
-    ALL_NODES += ACTION_NODES
-    try:
-        ATOMIC_FALLBACK_NODES = BT_SETTINGS["atomic_fallback_nodes"]
-        if ATOMIC_FALLBACK_NODES is None:
-            ATOMIC_FALLBACK_NODES = []
-    except KeyError:
-        pass
-    BEHAVIOR_NODES += ATOMIC_FALLBACK_NODES
-    ALL_NODES += ATOMIC_FALLBACK_NODES
-    try:
-        ATOMIC_SEQUENCE_NODES = BT_SETTINGS["atomic_sequence_nodes"]
-        if ATOMIC_SEQUENCE_NODES is None:
-            ATOMIC_SEQUENCE_NODES = []
-    except KeyError:
-        pass
-    BEHAVIOR_NODES += ATOMIC_SEQUENCE_NODES
-    ALL_NODES += ATOMIC_SEQUENCE_NODES
-    try:
-        UP_NODE = BT_SETTINGS["up_node"]
-    except KeyError:
-        pass
-    ALL_NODES += UP_NODE
-    LEAF_NODES += BEHAVIOR_NODES
-
+    global NODES
+
+    NODES = NodeSettings(file)
+    FALLBACK_NODES = NODES.fallback_nodes
+    SEQUENCE_NODES = NODES.sequence_nodes
+    CONTROL_NODES = NODES.control_nodes
+    CONDITION_NODES = NODES.condition_nodes
+    ACTION_NODES = NODES.action_nodes
+    ATOMIC_FALLBACK_NODES = NODES.atomic_fallback_nodes
+    ATOMIC_SEQUENCE_NODES = NODES.atomic_sequence_nodes
+    UP_NODE = NODES.up_node
+    LEAF_NODES = NODES.leaf_nodes
+    BEHAVIOR_NODES = NODES.behavior_nodes
+    ALL_NODES = NODES.all_nodes
+    return NODES
 
 def get_action_list():
     """
@@ -167,11 +140,14 @@ class BT:
     Class for handling string representations of behavior trees
     """
 
-    def __init__(self, bt):
+    def __init__(self, bt, nodes=None):
         """
-        Creates a bt
+        Creates a bt with the allowed nodes of nodes, by default the ones loaded with load_settings_from_file
         """
         self.bt = bt[:]
+        self.nodes = nodes if nodes is not None else NODES
+        if self.nodes is None:
+            raise Exception("No node settings, pass them or call load_settings_from_file")
 
     def set(self, bt):
         """
@@ -185,36 +161,32 @@ class BT:
         Creates a random bt of the given length
         Tries to follow some of the rules for valid trees to speed up the process
         """
-        global CONTROL_NODES
-        global ACTION_NODES
-        global UP_NODE
-        global BEHAVIOR_NODES
 
         self.bt = []
         while not self.is_valid():
             if length == 1:
-                self.bt = [random.choice(BEHAVIOR_NODES)]
+                self.bt = [random.choice(self.nodes.behavior_nodes)]
             else:
-                self.bt = [random.choice(CONTROL_NODES)]
+                self.bt = [random.choice(self.nodes.control_nodes)]
                 for _ in range(length - 1):
-                    if self.bt[-1] in CONTROL_NODES:
+                    if self.bt[-1] in self.nodes.control_nodes:
                         next = [self.random_node()]
-                        while next in UP_NODE:
+                        while next in self.nodes.up_node:
                             next = [self.random_node()]
                         self.bt += next
                     else:
                         self.bt += [self.random_node()]
 
-                    if self.bt[-1] in ACTION_NODES:
-                        self.bt += [UP_NODE[0]]
+                    if self.bt[-1] in self.nodes.action_nodes:
+                        self.bt += [self.nodes.up_node[0]]
 
                 for _ in range(length - self.length() - 1):
                     # add nodes to match the number of individuals defined in length
                     # this is required when random node gives 'up' nodes
                     # condition nodes make it more likely to be valid
-                    self.bt += [random.choice(CONDITION_NODES)]
+                    self.bt += [random.choice(self.nodes.condition_nodes)]
                 if self.length() < length:
-                    self.bt += [random.choice(BEHAVIOR_NODES)]
+                    self.bt += [random.choice(self.nodes.behavior_nodes)]
                 self.close()
 
         return self.bt
@@ -224,9 +196,6 @@ class BT:
         Checks if bt is a valid behavior tree.
         Checks are somewhat in order of likelihood to fail.
         """
-        global CONTROL_NODES
-        global UP_NODE
-        global ALL_NODES
 
         valid = True
 
@@ -235,19 +204,19 @@ class BT:
             valid = False
 
         # The first element cannot be a leaf if after it there are other elements
-        elif (self.bt[0] not in CONTROL_NODES) and (len(self.bt) != 1):
+        elif (self.bt[0] not in self.nodes.control_nodes) and (len(self.bt) != 1):
             valid = False
 
         else:
             for i in range(len(self.bt) - 1):
                 #'up' directly after a control node
-                if (self.bt[i] in CONTROL_NODES) and (self.bt[i+1] in UP_NODE):
+                if (self.bt[i] in self.nodes.control_nodes) and (self.bt[i+1] in self.nodes.up_node):
                     valid = False
                 #Identical condition nodes directly after one another - waste
-                elif self.bt[i] in CONDITION_NODES and self.bt[i] == self.bt[i+1]:
+                elif self.bt[i] in self.nodes.condition_nodes and self.bt[i] == self.bt[i+1]:
                     valid = False
                 # check for non-BT elements
-                elif self.bt[i] not in ALL_NODES:
+                elif self.bt[i] not in self.nodes.all_nodes:
                     valid = False
 
             if valid:
@@ -256,12 +225,12 @@ class BT:
                 if (depth < 0) or (depth == 0 and len(self.bt) > 1):
                     valid = False
 
-            if valid and self.bt[0] in CONTROL_NODES:
+            if valid and self.bt[0] in self.nodes.control_nodes:
                 fallback_allowed = True
                 sequence_allowed = True
-                if self.bt[0] in FALLBACK_NODES:
+                if self.bt[0] in self.nodes.fallback_nodes:
                     fallback_allowed = False
-                elif self.bt[0] in SEQUENCE_NODES:
+                elif self.bt[0] in self.nodes.sequence_nodes:
                     sequence_allowed = False
                 valid = self.is_subtree_valid(self.bt[1:], fallback_allowed, sequence_allowed)
         return valid
@@ -273,35 +242,29 @@ class BT:
         2. Sequences must not be children of sequences
         3. Last children must not be conditions
         """
-        global CONTROL_NODES
-        global CONDITION_NODES
-        global ACTION_NODES
-        global ATOMIC_FALLBACK_NODES
-        global ATOMIC_SEQUENCE_NODES
-        global UP_NODE
 
         while len(string) > 0:
             node = string.pop(0)
 
-            if node in UP_NODE:
+            if node in self.nodes.up_node:
                 return True
-            elif node in CONDITION_NODES:
-                if len(string) > 0 and string[0] in UP_NODE:
+            elif node in self.nodes.condition_nodes:
+                if len(string) > 0 and string[0] in self.nodes.up_node:
                     return False
-            elif node in ATOMIC_FALLBACK_NODES:
+            elif node in self.nodes.atomic_fallback_nodes:
                 if not fallback_allowed:
                     return False
-            elif node in ATOMIC_SEQUENCE_NODES:
+            elif node in self.nodes.atomic_sequence_nodes:
                 if not sequence_allowed:
                     return False
-            elif node in CONTROL_NODES:
-                if node in FALLBACK_NODES:
+            elif node in self.nodes.control_nodes:
+                if node in self.nodes.fallback_nodes:
                     if fallback_allowed:
                         if not self.is_subtree_valid(string, False, True):
                             return False
                     else:
                         return False
-                elif node in SEQUENCE_NODES:
+                elif node in self.nodes.sequence_nodes:
                     if sequence_allowed:
                         if not self.is_subtree_valid(string, True, False):
                             return False
@@ -317,29 +280,27 @@ class BT:
         """
         Adds missing up nodes at the end, or removes from the end if too many
         """
-        global CONTROL_NODES
-        global UP_NODE
         open_subtrees = 0
 
         #Make sure tree always ends with up node if starts with control node
         if len(self.bt) > 0:
-            if self.bt[0] in CONTROL_NODES and self.bt[len(self.bt)-1] not in UP_NODE:
-                self.bt += UP_NODE
+            if self.bt[0] in self.nodes.control_nodes and self.bt[len(self.bt)-1] not in self.nodes.up_node:
+                self.bt += self.nodes.up_node
 
         for node in self.bt:
-            if node in CONTROL_NODES:
+            if node in self.nodes.control_nodes:
                 open_subtrees += 1
-            elif node in UP_NODE:
+            elif node in self.nodes.up_node:
                 open_subtrees -= 1
 
         if open_subtrees > 0:
             for _ in range(open_subtrees):
-                self.bt += UP_NODE
+                self.bt += self.nodes.up_node
         elif open_subtrees < 0:
             for _ in range(-open_subtrees):
                 #Do not remove the very last node, and only up nodes
                 for j in range(len(self.bt) - 2, 0, -1): # pragma: no branch, we will always find an up
-                    if self.bt[j] in UP_NODE:
+                    if self.bt[j] in self.nodes.up_node:
                         self.bt.pop(j)
                         break
 
@@ -347,16 +308,14 @@ class BT:
         """
         Returns depth of the bt
         """
-        global CONTROL_NODES
-        global UP_NODE
         depth = 0
         max_depth = 0
 
         for i in range(len(self.bt)):
-            if self.bt[i] in CONTROL_NODES:
+            if self.bt[i] in self.nodes.control_nodes:
                 depth += 1
                 max_depth = max(depth, max_depth)
-            elif self.bt[i] in UP_NODE:
+            elif self.bt[i] in self.nodes.up_node:
                 depth -= 1
                 if (depth < 0) or (depth == 0 and i is not len(self.bt) - 1):
                     return -1
@@ -370,10 +329,9 @@ class BT:
         """
         Counts number of nodes in bt. Doesn't count up characters.
         """
-        global UP_NODE
         length = 0
         for node in self.bt:
-            if node not in UP_NODE:
+            if node not in self.nodes.up_node:
                 length += 1
         return length
 
@@ -389,47 +347,39 @@ class BT:
         and even while there are usually more control nodes than up nodes (just one), the
         control nodes are more likely to improve the bt.
         """
-        global CONTROL_NODES
-        global LEAF_NODES
-        global UP_NODE
 
         if random.random() < 0.5:
-            return random.choice(CONTROL_NODES + UP_NODE)
+            return random.choice(self.nodes.control_nodes + self.nodes.up_node)
         else:
             if random.random() < 0.3:
-                return random.choice(CONDITION_NODES)
+                return random.choice(self.nodes.condition_nodes)
             else:
-                return random.choice(ACTION_NODES)
+                return random.choice(self.nodes.action_nodes)
 
     def change_node(self, index, new_node=None):
         """
         Changes node at index
         """
-        global CONTROL_NODES
-        global CONDITION_NODES
-        global BEHAVIOR_NODES
-        global LEAF_NODES
-        global UP_NODE
 
         if new_node is None:
             new_node = self.random_node()
 
         # Change control node to leaf node, remove corresponding up
-        if new_node in LEAF_NODES and self.bt[index] in CONTROL_NODES:
+        if new_node in self.nodes.leaf_nodes and self.bt[index] in self.nodes.control_nodes:
             self.bt.pop(self.find_up_node(index))
             self.bt[index] = new_node
 
         # Change leaf node to control node. Add up and extra condition/behavior node child
-        elif new_node in CONTROL_NODES and self.bt[index] in LEAF_NODES:
+        elif new_node in self.nodes.control_nodes and self.bt[index] in self.nodes.leaf_nodes:
             old_node = self.bt[index]
             self.bt[index] = new_node
-            if old_node in BEHAVIOR_NODES:
-                self.bt.insert(index + 1, random.choice(LEAF_NODES))
+            if old_node in self.nodes.behavior_nodes:
+                self.bt.insert(index + 1, random.choice(self.nodes.leaf_nodes))
                 self.bt.insert(index + 2, old_node)
             else: #CONDITION_NODE
                 self.bt.insert(index + 1, old_node)
-                self.bt.insert(index + 2, random.choice(BEHAVIOR_NODES))
-            self.bt.insert(index + 3, UP_NODE[0])
+                self.bt.insert(index + 2, random.choice(self.nodes.behavior_nodes))
+            self.bt.insert(index + 3, self.nodes.up_node[0])
         else:
             self.bt[index] = new_node
 
@@ -442,75 +392,71 @@ class BT:
         to make sure that they are alternated and avoid
         creating an invalid tree
         """
-        global CONTROL_NODES
-        global LEAF_NODES
-        global BEHAVIOR_NODES
-        global UP_NODE
 
         if new_node is None:
             new_node = self.random_node()
-        if new_node in CONTROL_NODES:
+        if new_node in self.nodes.control_nodes:
             if index == 0:
                 #Adding new control node to encapsulate entire tree
                 self.bt.insert(index, new_node)
-                self.bt.append(UP_NODE[0])
+                self.bt.append(self.nodes.up_node[0])
             else:
                 parent = self.find_parent(index)
                 upper = None
                 lower = None
-                if new_node in FALLBACK_NODES and parent in FALLBACK_NODES:
-                    upper = random.choice(SEQUENCE_NODES)
+                if new_node in self.nodes.fallback_nodes and parent in self.nodes.fallback_nodes:
+                    upper = random.choice(self.nodes.sequence_nodes)
                     lower = new_node
-                elif new_node in SEQUENCE_NODES and parent in SEQUENCE_NODES:
-                    upper = random.choice(FALLBACK_NODES)
+                elif new_node in self.nodes.sequence_nodes and parent in self.nodes.sequence_nodes:
+                    upper = random.choice(self.nodes.fallback_nodes)
                     lower = new_node
                 else:
                     child_control_nodes = self.find_child_control_nodes(index)
-                    if new_node in FALLBACK_NODES and any(self.bt[c] in FALLBACK_NODES for c in child_control_nodes):
+                    if new_node in self.nodes.fallback_nodes and any(self.bt[c] in self.nodes.fallback_nodes for c in child_control_nodes):
                         upper = new_node
-                        lower= random.choice(SEQUENCE_NODES)
-                    elif new_node in SEQUENCE_NODES and any(self.bt[c] in SEQUENCE_NODES for c in child_control_nodes):
+                        lower= random.choice(self.nodes.sequence_nodes)
+                    elif new_node in self.nodes.sequence_nodes and any(self.bt[c] in self.nodes.sequence_nodes for c in child_control_nodes):
                         upper = new_node
-                        lower= random.choice(FALLBACK_NODES)
+                        lower= random.choice(self.nodes.fallback_nodes)
                 if upper is not None:
                     #Requirement issues, must add two new control nodes
                     self.bt.insert(index, upper)
                     if random.random() < 0.5:
                         #Put lower control node on the right, new leaf on left
-                        self.bt.insert(index + 1, random.choice(LEAF_NODES))
+                        self.bt.insert(index + 1, random.choice(self.nodes.leaf_nodes))
                         self.bt.insert(index + 2, lower)
                         up_node_index = self.find_up_node(index + 2)
-                        self.bt.insert(up_node_index, UP_NODE[0])
-                        self.bt.insert(up_node_index + 1, UP_NODE[0])
+                        self.bt.insert(up_node_index, self.nodes.up_node[0])
+                        self.bt.insert(up_node_index + 1, self.nodes.up_node[0])
                     else:
                         #Put lower control node on the left, new leaf on right
                         self.bt.insert(index + 1, lower)
                         up_node_index = self.find_up_node(index + 1)
-                        self.bt.insert(up_node_index, UP_NODE[0])
-                        self.bt.insert(up_node_index + 1, random.choice(BEHAVIOR_NODES))
-                        self.bt.insert(up_node_index + 2, UP_NODE[0])
+                        self.bt.insert(up_node_index, self.nodes.up_node[0])
+                        self.bt.insert(up_node_index + 1, random.choice(self.nodes.behavior_nodes))
+                        self.bt.insert(up_node_index + 2, self.nodes.up_node[0])
                 else:
                     #No requirement issues, can just add control node with remaining
                     #"siblings" as children.
                     self.bt.insert(index, new_node)
                     up_node_index = self.find_up_node(index)
                     if up_node_index == index + 1:
-                        self.bt.insert(index + 1, random.choice(LEAF_NODES))
-                        self.bt.insert(index + 2, random.choice(BEHAVIOR_NODES))
-                        self.bt.insert(index + 3, UP_NODE[0])
+                        self.bt.insert(index + 1, random.choice(self.nodes.leaf_nodes))
+                        self.bt.insert(index + 2, random.choice(self.nodes.behavior_nodes))
+                        self.bt.insert(index + 3, self.nodes.up_node[0])
                     else:
-                        self.bt.insert(up_node_index, UP_NODE[0])
+                        self.bt.insert(up_node_index, self.nodes.up_node[0])
 
-                if self.bt[index - 1] in CONTROL_NODES:
+                if self.bt[index - 1] in self.nodes.control_nodes:
                     #New control node took all children from parent, add one new child 
                     #so parent has at least two
                     if random.random() < 0.5:
                         #To the left
-                        self.bt.insert(index, random.choice(LEAF_NODES))
+                        self.bt.insert(index, random.choice(self.nodes.leaf_nodes))
                     else:
                         #To the right
                         up_node_index = self.find_up_node(index)
-                        self.bt.insert(up_node_index + 1, random.choice(BEHAVIOR_NODES))
+                        self.bt.insert(up_node_index + 1, random.choice(self.nodes.behavior_nodes))
         else:
             self.bt.insert(index, new_node)
 
@@ -518,19 +464,16 @@ class BT:
         """
         Deletes node at index
         """
-        global CONTROL_NODES
-        global LEAF_NODES
-        global UP_NODE
 
-        if self.bt[index] in LEAF_NODES:
+        if self.bt[index] in self.nodes.leaf_nodes:
             # if the leaf is in [..., 'control(', 'leaf', ')', ...] we remove the whole sub-tree
             while index > 0 and index + 1 < len(self.bt) and \
-                    self.bt[index - 1] in CONTROL_NODES and self.bt[index+1] in UP_NODE:
+                    self.bt[index - 1] in self.nodes.control_nodes and self.bt[index+1] in self.nodes.up_node:
                 self.bt.pop(index - 1) #control node
                 self.bt.pop(index) #up node
                 index -= 1 #move index back to leaf node
 
-        elif self.bt[index] in CONTROL_NODES:
+        elif self.bt[index] in self.nodes.control_nodes:
             if delete_children:
                 child_control_nodes = self.find_child_control_nodes(index + 1)
                 if child_control_nodes != []:
@@ -545,8 +488,6 @@ class BT:
         """
         Returns index of the closest parent to the node at input index
         """
-        global CONTROL_NODES
-        global UP_NODE
 
         if index == 0:
             return None
@@ -555,12 +496,12 @@ class BT:
             siblings_left = 0
             while parent > 0:
                 parent -= 1
-                if self.bt[parent] in CONTROL_NODES:
+                if self.bt[parent] in self.nodes.control_nodes:
                     if siblings_left == 0:
                         return parent
                     else:
                         siblings_left -= 1
-                elif self.bt[parent] in UP_NODE:
+                elif self.bt[parent] in self.nodes.up_node:
                     siblings_left += 1
             return None
 
@@ -574,12 +515,12 @@ class BT:
         child = index
         level = 0
         while level >= 0: 
-            if level == 0 and (self.bt[child] in FALLBACK_NODES or self.bt[child] in SEQUENCE_NODES):
+            if level == 0 and (self.bt[child] in self.nodes.fallback_nodes or self.bt[child] in self.nodes.sequence_nodes):
                     children.append(child)
 
-            if self.bt[child] in CONTROL_NODES:
+            if self.bt[child] in self.nodes.control_nodes:
                 level += 1
-            elif self.bt[child] in UP_NODE:
+            elif self.bt[child] in self.nodes.up_node:
                 level -= 1
             child += 1
 
@@ -589,14 +530,12 @@ class BT:
         """
         Returns index of the up node connected to the control node at input index
         """
-        global CONTROL_NODES
-        global UP_NODE
 
-        if self.bt[index] not in CONTROL_NODES:
+        if self.bt[index] not in self.nodes.control_nodes:
             raise Exception('Invalid call. Node at index not a control node')
 
         if index == 0:
-            if self.bt[len(self.bt)-1] in UP_NODE:
+            if self.bt[len(self.bt)-1] in self.nodes.up_node:
                 index = len(self.bt) - 1
             else:
                 raise Exception('Changing invalid BT. Missing up.')
@@ -606,9 +545,9 @@ class BT:
                 index += 1
                 if index == len(self.bt):
                     raise Exception('Changing invalid BT. Missing up.')
-                if self.bt[index] in CONTROL_NODES:
+                if self.bt[index] in self.nodes.control_nodes:
                     level += 1
-                elif self.bt[index] in UP_NODE:
+                elif self.bt[index] in self.nodes.up_node:
                     level -= 1
 
         return index
@@ -619,9 +558,9 @@ class BT:
         """
         subtree = []
 
-        if self.bt[index] in LEAF_NODES:
+        if self.bt[index] in self.nodes.leaf_nodes:
             subtree = [self.bt[index]]
-        elif self.bt[index] in CONTROL_NODES:
+        elif self.bt[index] in self.nodes.control_nodes:
             subtree = self.bt[index : self.find_up_node(index) + 1]
         else:
             subtree = []
@@ -652,4 +591,4 @@ class BT:
         """
         Checks if node at index is root of a subtree
         """
-        return bool(0 <= index < len(self.bt) and self.bt[index] not in UP_NODE)
+        return bool(0 <= index < len(self.bt) and self.bt[index] not in self.nodes.up_node)
@@ -4,10 +4,14 @@ Implementing various py trees behaviors
 """
 import os
 import sys
+import re
 
 import py_trees as pt
 import state_machine as sm
 
+# Behaviors of the numbered pick tables, cubes and random poses of the layout, e.g. move_pick12
+NUMBERED_NODES = re.compile(r'(table|cube|move_pick|move_rand_)(0|[1-9][0-9]*)(_visited\?|_placed\?)?')
+
 def get_node_from_string(string, state_machine_):
     """
     Returns a py trees behavior or composite given the string
@@ -21,16 +25,16 @@ def get_node_from_string(string, state_machine_):
         node = IsTucked(state_machine_)
 
     elif string == "stretch":
-        node = MoveArm(state_machine_, "Stretched")
+        node = MoveArm(state_machine_, sm.Arm.STRETCHED)
 
     elif string == "all_up":
-        node = MoveArm(state_machine_, "Up")
+        node = MoveArm(state_machine_, sm.Arm.UP)
 
     elif string == "all_down":
-        node = MoveArm(state_machine_, "Down")
+        node = MoveArm(state_machine_, sm.Arm.DOWN)
 
     elif string == "tuck":
-        node = MoveArm(state_machine_, "Tucked")
+        node = MoveArm(state_machine_, sm.Arm.TUCKED)
 
     elif string == "up":
         node = MoveHead_Up(state_machine_)
@@ -44,24 +48,6 @@ def get_node_from_string(string, state_machine_):
     elif string == "localise":
         node = Localise(state_machine_)
 
-    elif string == "table0_visited?":
-        node =  Visited(state_machine_, "pick_table0")
-
-    elif string == "table1_visited?":
-        node =  Visited(state_machine_, "pick_table1")
-
-    elif string == "table2_visited?":
-        node =  Visited(state_machine_, "pick_table2")
-
-    elif string == "move_pick0":
-        node = MoveToPose(state_machine_, "pick_table0")
-
-    elif string == "move_pick1":
-        node = MoveToPose(state_machine_, "pick_table1")
-
-    elif string == "move_pick2":
-        node = MoveToPose(state_machine_, "pick_table2")
-
     elif string == "move_pick_s":
         node = MoveToPose_safe(state_machine_, "pick_table0")
 
@@ -80,48 +66,12 @@ def get_node_from_string(string, state_machine_):
     elif string == "move_place_s":
         node = MoveToPose_safe(state_machine_, "place_table")
 
-    elif string == "cube0_placed?":
-        node = Placed(state_machine_, 0)
-
-    elif string == "cube1_placed?":
-        node = Placed(state_machine_, 1)
-
-    elif string == "cube2_placed?":
-        node = Placed(state_machine_, 2)
-
     elif string == "task_done?":
         node = Finished(state_machine_)
 
     elif string == "place":
         node = Place(state_machine_)
 
-    elif string == "move_rand_1":
-        node = MoveToPose(state_machine_, "random1")
-
-    elif string == "move_rand_2":
-        node = MoveToPose(state_machine_, "random2")
-
-    elif string == "move_rand_3":
-        node = MoveToPose(state_machine_, "random3")
-
-    elif string == "move_rand_4":
-        node = MoveToPose(state_machine_, "random4")
-
-    elif string == "move_rand_5":
-        node = MoveToPose(state_machine_, "random5")
-
-    elif string == "move_rand_6":
-        node = MoveToPose(state_machine_, "random6")
-
-    elif string == "move_rand_7":
-        node = MoveToPose(state_machine_, "random7")
-
-    elif string == "move_rand_8":
-        node = MoveToPose(state_machine_, "random8")
-
-    elif string == "move_rand_9":
-        node = MoveToPose(state_machine_, "random9")
-
     elif string == "move_spawn":
         node = MoveToPose(state_machine_, "spawn")
 
@@ -137,9 +87,28 @@ def get_node_from_string(string, state_machine_):
         has_children = True
 
     else:
-        raise Exception("Unexpected character", string)
+        node = get_numbered_node(string, state_machine_)
     return node, has_children
 
+def get_numbered_node(string, state_machine_):
+    """
+    Returns the behavior of a numbered pick table, cube or random pose given the string
+    """
+    match = NUMBERED_NODES.fullmatch(string)
+    if match is None:
+        raise Exception("Unexpected character", string)
+    prefix, number, suffix = match.groups()
+
+    if prefix == "table" and suffix == "_visited?":
+        return Visited(state_machine_, int(number))
+    if prefix == "cube" and suffix == "_placed?":
+        return Placed(state_machine_, int(number))
+    if prefix == "move_pick" and suffix is None:
+        return MoveToPose(state_machine_, "pick_table" + number)
+    if prefix == "move_rand_" and suffix is None and number != "0":
+        return MoveToPose(state_machine_, "random" + number)
+    raise Exception("Unexpected character", string)
+
 class BlockOnTable(pt.behaviour.Behaviour):
     """
     Condition checking if the cube is on table
@@ -149,7 +118,7 @@ class BlockOnTable(pt.behaviour.Behaviour):
         super(BlockOnTable, self).__init__("Block on table?")
 
     def update(self):
-        if self.state_machine.feedback[sm.Feedback.CUBE] == self.state_machine.poses.cube_goal_pose:
+        if self.state_machine.feedback[sm.Feedback.CUBE] == self.state_machine.layout.cube_goal_pose:
             return pt.common.Status.SUCCESS
         return pt.common.Status.FAILURE
 
@@ -199,7 +168,7 @@ class MoveArm(pt.behaviour.Behaviour):
         self.state = None
         self.configuration = configuration
         self.state_machine = state_machine_
-        super(MoveArm, self).__init__("{} arm!".format(configuration))
+        super(MoveArm, self).__init__("{} arm!".format(configuration.name.capitalize()))
 
     def initialise(self):
         if self.state_machine.current[sm.State.ARM] != self.configuration:
@@ -228,7 +197,7 @@ class IsTucked(pt.behaviour.Behaviour):
     def update(self):
         #print("Checking TUCK")
         # you don't want to tuck again if the robot has the cube
-        if self.state_machine.current[sm.State.ARM] == "Tucked":
+        if self.state_machine.current[sm.State.ARM] == sm.Arm.TUCKED:
             return pt.common.Status.SUCCESS
         return pt.common.Status.FAILURE
 
@@ -270,7 +239,7 @@ class PickUp(pt.behaviour.Behaviour):
         super(PickUp, self).__init__("Pick up!")
 
     def initialise(self):
-        if self.state_machine.feedback[sm.State.ARM] != "Pick" and not self.state_machine.current[sm.State.HAS_CUBE]:
+        if not self.state_machine.current[sm.State.HAS_CUBE]:
             self.state = None
 
     def update(self):
@@ -284,13 +253,7 @@ class PickUp(pt.behaviour.Behaviour):
                 self.state = pt.common.Status.SUCCESS
             else:
                 self.state = pt.common.Status.FAILURE
-
-            if self.state_machine.current[sm.State.POSE] == self.state_machine.poses.pick_table0:
-                self.state_machine.current[sm.State.VISITED][0] = True
-            elif self.state_machine.current[sm.State.POSE] == self.state_machine.poses.pick_table1:
-                self.state_machine.current[sm.State.VISITED][1] = True
-            elif self.state_machine.current[sm.State.POSE] == self.state_machine.poses.pick_table2:
-                self.state_machine.current[sm.State.VISITED][2] = True
+            self.state_machine.visit()
 
         return self.state
 
@@ -305,7 +268,7 @@ class Placed(pt.behaviour.Behaviour):
 
     def update(self):
         #print("Checking PLACED")
-        if self.state_machine.feedback[sm.Feedback.CUBE][self.cube_ID] == self.state_machine.poses.cube_goal_pose and not self.state_machine.current[sm.State.HAS_CUBE]:
+        if self.state_machine.cube_on_goal(self.cube_ID) and not self.state_machine.current[sm.State.HAS_CUBE]:
             return pt.common.Status.SUCCESS
         return pt.common.Status.FAILURE
 
@@ -339,18 +302,13 @@ class Visited(pt.behaviour.Behaviour):
     """
     Condition checking if robot has visited a pick table and attempted the picking
     """
-    def __init__(self, state_machine_, pose):
-        self.pose = pose
-        self.pose_idx = None
+    def __init__(self, state_machine_, table):
+        self.table = table
         self.state_machine = state_machine_
-        super(Visited, self).__init__("{} visited?".format(pose))
+        super(Visited, self).__init__("pick_table{} visited?".format(table))
 
     def update(self):
-        if self.pose == "pick_table0": self.pose_idx = 0
-        elif self.pose == "pick_table1": self.pose_idx = 1
-        elif self.pose == "pick_table2": self.pose_idx = 2
-
-        if self.state_machine.current[sm.State.VISITED][self.pose_idx]:
+        if self.state_machine.visited[self.table]:
             return pt.common.Status.SUCCESS
         return pt.common.Status.FAILURE
 
@@ -361,27 +319,11 @@ class MoveToPose(pt.behaviour.Behaviour):
     def __init__(self, state_machine_, pose):
         self.state = None
         self.pose = pose
-        self.sm_pose = []
+        self.sm_pose = state_machine_.named_poses[pose] if state_machine_ is not None else None
         self.state_machine = state_machine_
         super(MoveToPose, self).__init__("To pose {}!".format(pose))
 
     def initialise(self):
-        if self.pose == "pick_table0": self.sm_pose = self.state_machine.poses.pick_table0
-        elif self.pose == "pick_table1": self.sm_pose = self.state_machine.poses.pick_table1
-        elif self.pose == "pick_table2": self.sm_pose = self.state_machine.poses.pick_table2
-        elif self.pose == "place_table": self.sm_pose = self.state_machine.poses.place_table
-        elif self.pose == "random1": self.sm_pose = self.state_machine.poses.random_pose1
-        elif self.pose == "random2": self.sm_pose = self.state_machine.poses.random_pose2
-        elif self.pose == "random3": self.sm_pose = self.state_machine.poses.random_pose3
-        elif self.pose == "random4": self.sm_pose = self.state_machine.poses.random_pose4
-        elif self.pose == "random5": self.sm_pose = self.state_machine.poses.random_pose5
-        elif self.pose == "random6": self.sm_pose = self.state_machine.poses.random_pose6
-        elif self.pose == "random7": self.sm_pose = self.state_machine.poses.random_pose7
-        elif self.pose == "random8": self.sm_pose = self.state_machine.poses.random_pose8
-        elif self.pose == "random9": self.sm_pose = self.state_machine.poses.random_pose9
-        elif self.pose == "origin": self.sm_pose = self.state_machine.poses.origin
-        elif self.pose == "spawn": self.sm_pose = self.state_machine.poses.spawn_pose
-
         if self.state_machine.current[sm.State.POSE] != self.sm_pose:
             self.state = None
 
@@ -405,13 +347,11 @@ class MoveToPose_safe(pt.behaviour.Behaviour):
     def __init__(self, state_machine_, pose):
         self.state = None
         self.pose = pose
-        self.sm_pose = []
+        self.sm_pose = state_machine_.named_poses[pose] if state_machine_ is not None else None
         self.state_machine = state_machine_
         super(MoveToPose_safe, self).__init__("Safely to {}!".format(pose))
 
     def initialise(self):
-        if self.pose == "pick_table0": self.sm_pose = self.state_machine.poses.pick_table0
-        elif self.pose == "place_table": self.sm_pose = self.state_machine.poses.place_table
         if self.state_machine.current[sm.State.POSE] != self.sm_pose:
             self.state = None
 
@@ -438,7 +378,7 @@ class MoveHead_Up(pt.behaviour.Behaviour):
         super(MoveHead_Up, self).__init__("Head up!")
 
     def initialise(self):
-        if not self.state_machine.manipulating and self.state_machine.current[sm.State.HEAD] != 'Up':
+        if not self.state_machine.manipulating and self.state_machine.current[sm.State.HEAD] != sm.Head.UP:
             self.state = None
 
     def update(self):
@@ -462,7 +402,7 @@ class MoveHead_Down(pt.behaviour.Behaviour):
         super(MoveHead_Down, self).__init__("Head down!")
 
     def initialise(self):
-        if not self.state_machine.moving and self.state_machine.current[sm.State.HEAD] != 'Down':
+        if not self.state_machine.moving and self.state_machine.current[sm.State.HEAD] != sm.Head.DOWN:
             self.state = None
 
     def update(self):
@@ -493,6 +433,9 @@ class Finished(pt.behaviour.Behaviour):
 
 
 
+# Behaviors that only check the state machine and never return RUNNING
+CONDITIONS = (BlockOnTable, IsLocalised, IsTucked, NotHaveBlock, HaveBlock, Placed, Visited, Finished)
+
 # Reactive sequence
 class RSequence(pt.composites.Selector):
     """
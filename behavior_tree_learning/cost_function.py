@@ -74,7 +74,7 @@ def compute_cost(state_machine, behavior_tree, ticks, debug=False):
         print("Ticks: " + str(ticks))
         print("Cube pose: " + str(state_machine.feedback[sm.Feedback.CUBE]))
         print("Robot pose: " + str(state_machine.feedback[sm.Feedback.AMCL]))
-        print("State pose: " + str(state_machine.current[sm.State.POSE]))
+        print("State pose: " + str(list(state_machine.robot_pose)))
         print("\n")
         print("Cube distance from goal: " + str(cube_dist))
         print("Contribution: " + str(coeff.cube_dist*cube_dist**2))
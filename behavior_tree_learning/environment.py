@@ -7,60 +7,245 @@ returns nothing but saves a graphical representation of the individual
 """
 import os
 import sys
+import random
+import hashlib
+from copy import copy
+from dataclasses import dataclass, asdict, replace
+from typing import List
+import yaml
 
 import behavior_tree as behavior_tree
-from py_trees_interface import PyTree
+from py_trees_interface import PyTree, TickParameters
 import behaviors as behaviors
 import state_machine as sm
 import cost_function
+import transition_table
+from episode_rng import GlobalRng, EpisodeRng, CommonRng
 
 
+@dataclass
+class Fidelity:
+    """ Data class for a reduced fidelity level of the environment, None keeps the setting of the environment """
+    deterministic: bool = None              #Run the state machine without noise
+    max_ticks: int = None                   #Tick budget of the behavior tree
+    pose_ids: List[int] = None              #Cube spawn poses to run in scenario 2
+
+def load_sm_parameters(settings_path):
+    """
+    Returns the state machine parameters of a settings file: the defaults of SMParameters
+    overridden by the optional state_machine section
+    """
+    with open(settings_path, 'r') as f:
+        settings = yaml.load(f, Loader=yaml.FullLoader)
+    return sm.SMParameters(**(settings.get('state_machine') or {}))
+
+def load_layout(settings_path):
+    """
+    Returns the layout of a settings file: the default layout of the paper
+    overridden by the optional layout section, e.g. with more pick tables and cubes
+    """
+    with open(settings_path, 'r') as f:
+        settings = yaml.load(f, Loader=yaml.FullLoader)
+    return sm.Layout(**(settings.get('layout') or {}))
+
 class Environment:
     """ Class defining the environment in which the individual operates """
 
-    def __init__(self, scenario, deterministic=False, verbose=False):
+    def __init__(self, scenario, deterministic=False, verbose=False, episode_seed=None, common_random_numbers=False,
+                 use_transition_table=False):
         self.scenario = scenario
         self.deterministic = deterministic
         self.verbose = verbose
+        # Run seed of per-episode random streams, see episode_rng. If None, the episodes use the random module
+        self.episode_seed = episode_seed
+        # All genomes share the random streams of an episode index, so they face the same failures
+        self.common_random_numbers = common_random_numbers
+        if common_random_numbers and episode_seed is None:
+            raise ValueError("Common random numbers need an episode seed")
+        # Deterministic episodes run as lookups in a transition table instead of py_trees, with the same fitness
+        self.use_transition_table = use_transition_table
+        self.tick_par = TickParameters()
 
         # Load setting file with the behaviors specifications
         script_dir = os.path.dirname(__file__)
         parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
         file_scenario = 'BT_SCENARIO_' + str(self.scenario) + '.yml'
-        settings_path = os.path.join(parent_dir, file_scenario)
-        behavior_tree.load_settings_from_file(settings_path)
+        self.settings_path = os.path.join(parent_dir, file_scenario)
+        # Allowed nodes of the trees of this environment, passed to the trees instead of module globals.
+        # Also sets the module globals, used by trees created without node settings
+        self.nodes = behavior_tree.load_settings_from_file(self.settings_path)
+
+        self.sm_par = load_sm_parameters(self.settings_path)
+        self.layout = load_layout(self.settings_path)
+        # Cube spawn poses to run in scenario 2
+        self.pose_ids = list(range(len(self.layout.cubes_spawn_pose)))
 
-    def get_fitness(self, string, debug=False):
-        """ Run the simulation and return the fitness """
+        # State machines at the start of an episode, the episodes run on forks of them
+        self.prototypes = {}
+        self.transition_tables = {}
+
+    def __setstate__(self, state):
+        # The module globals of the behaviors settings are not pickled, set them again in another process
+        self.__dict__.update(state)
+        behavior_tree.load_settings_from_file(self.settings_path)
+
+    def fingerprint(self):
+        """
+        Returns a hash of everything the fitness of an individual depends on:
+        scenario, behaviors settings file (with the layout), state machine, cost and tick parameters.
+        Fitness values are only comparable between environments with the same fingerprint.
+        """
+        sm_par = asdict(replace(self.sm_par, deterministic=self.deterministic))
+        sm_par.pop('verbose')
+        with open(self.settings_path, 'r') as f:
+            settings = f.read()
+
+        content = [str(self.scenario), settings, str(sm_par),
+                   str(asdict(cost_function.Coefficients())), str(asdict(self.tick_par))]
+        if self.scenario == 2:
+            content.append(str(self.pose_ids))
+        new_hash = hashlib.md5()
+        new_hash.update('\n'.join(content).encode('utf-8'))
+        return new_hash.hexdigest()
+
+    def reduced(self, fidelity):
+        """
+        Returns a copy of the environment at the given fidelity level.
+        The copy has its own fingerprint, so its fitness values are kept apart
+        """
+        environment = copy(self)
+        if fidelity.deterministic is not None:
+            environment.deterministic = fidelity.deterministic
+        if fidelity.max_ticks is not None:
+            environment.tick_par = copy(self.tick_par)
+            environment.tick_par.max_ticks = fidelity.max_ticks
+        if fidelity.pose_ids is not None:
+            environment.pose_ids = list(fidelity.pose_ids)
+        return environment
+
+    def episode_rngs(self, string, episode):
+        """
+        Returns the random streams of the state machines of episode number episode of string,
+        None for the random module
+        """
+        n_streams = len(self.pose_ids) if self.scenario == 2 else 1
+        if self.episode_seed is None:
+            return [None] * n_streams
+        if self.common_random_numbers:
+            return [CommonRng(self.episode_seed, episode, i) for i in range(n_streams)]
+        return [EpisodeRng(self.episode_seed, string, episode, i) for i in range(n_streams)]
+
+    def prototype(self, pose_id=0):
+        """
+        Returns the state machine at the start of an episode with the given cube spawn pose,
+        built once per setup. The forks of the prototype share its parameters
+        """
+        key = (self.scenario, self.deterministic, self.verbose, pose_id)
+        if key not in self.prototypes:
+            self.prototypes[key] = sm.StateMachine(self.scenario, self.deterministic, self.verbose,
+                                                   pose_id=pose_id, sm_par=self.sm_par, layout=self.layout)
+        return self.prototypes[key]
+
+    def transition_table(self, pose_id=0):
+        """ Returns the transition table of the deterministic episodes with the given cube spawn pose """
+        key = (self.scenario, pose_id)
+        if key not in self.transition_tables:
+            self.transition_tables[key] = transition_table.TransitionTable(self.prototype(pose_id), nodes=self.nodes)
+        return self.transition_tables[key]
+
+    def table_pose_ids(self):
+        """ Returns the cube spawn poses of the transition tables of an evaluation, None without the tables """
+        if not (self.use_transition_table and self.deterministic and not self.verbose):
+            return None
+        return self.pose_ids if self.scenario == 2 else [0]
+
+    def episode_state_machines(self, string, episode=0):
+        """ Returns a new state machine for every episode of a fitness evaluation """
+        # in scenario 2 we run the same BT against the state machine in 3 different setups
+        # every setup features a different spawn pose for the cube
+        pose_ids = self.pose_ids if self.scenario == 2 else [0]
+        state_machines = []
+        for pose_id, rng in zip(pose_ids, self.episode_rngs(string, episode)):
+            state_machine = self.prototype(pose_id).fork()
+            if rng is not None:
+                state_machine.rng = rng
+            state_machines.append(state_machine)
+        return state_machines
+
+    def start_states(self, string, ticks, episode=0):
+        """
+        Runs the first ticks of string and returns the state of every episode as a list of
+        (state machine, executed ticks), e.g. the shared opening of a parent and its offspring.
+        The episodes of get_fitness can then start from forks of these states instead of the spawn.
+        """
+        tick_par = copy(self.tick_par)
+        tick_par.max_ticks = min(ticks, self.tick_par.max_ticks)
+        start = []
+        for state_machine in self.episode_state_machines(string, episode):
+            behavior_tree = PyTree(string[:], behaviors=behaviors, state_machine=state_machine, nodes=self.nodes)
+            start.append((state_machine, behavior_tree.tick_bt(tick_par)))
+        return start
+
+    def tick_episode(self, string, state_machine, start_ticks, pose_id=None):
+        """
+        Runs the tree of string on the state machine and returns the tree and the total number of ticks.
+        With the pose id of a transition table the episode runs as table lookups, then its transitions
+        are replayed on the state machine; returns None if the replay differs from the table
+        """
+        if pose_id is not None:
+            run = transition_table.run_episode(self.transition_table(pose_id), string, self.tick_par)
+            if run is not None:
+                random_state = random.getstate() if state_machine.rng is GlobalRng else None
+                if transition_table.replay(state_machine, run[0]):
+                    return run
+                if random_state is not None:
+                    random.setstate(random_state)
+                return None
+        behavior_tree = PyTree(string[:], behaviors=behaviors, state_machine=state_machine, nodes=self.nodes)
+        return behavior_tree, behavior_tree.tick_bt(self.tick_par, start_ticks)
+
+    def get_fitness(self, string, debug=False, start=None, episode=0):
+        """
+        Run the simulation and return the fitness.
+        If start is given, as returned by start_states, the episodes start from forks of its states.
+        episode is the number of previous episodes of string, it selects the random streams
+        if the environment has an episode seed
+        """
+        pose_ids = None
+        if start is None:
+            start = [(state_machine, 0) for state_machine in self.episode_state_machines(string, episode)]
+            pose_ids = self.table_pose_ids()
+        else:
+            start = [(state_machine.fork(), ticks) for state_machine, ticks in start]
+            for (state_machine, _), rng in zip(start, self.episode_rngs(string, episode)):
+                if rng is not None:
+                    state_machine.rng = rng
+
+        runs = []
+        for i, (state_machine, start_ticks) in enumerate(start):
+            # run the Behavior Tree
+            run = self.tick_episode(string, state_machine, start_ticks, pose_ids[i] if pose_ids else None)
+            if run is None:
+                # the noise changed a discrete outcome of the table, run the episode again with py_trees
+                state_machine = self.episode_state_machines(string, episode)[i]
+                run = self.tick_episode(string, state_machine, 0)
+            runs.append((state_machine,) + run)
 
         if self.scenario == 2:
-            # in this case we run the same BT against the state machine in 3 different setups
-            # every setup features a different spawn pose for the cube
             fitness = 0
             performance = 0
             completed = False
-            for i in range(3):
-                state_machine = sm.StateMachine(self.scenario, self.deterministic, self.verbose, pose_id=i)
-                behavior_tree = PyTree(string[:], behaviors=behaviors, state_machine=state_machine)
-
-                # run the Behavior Tree
-                ticks = behavior_tree.tick_bt()
-
+            for state_machine, behavior_tree, ticks in runs:
                 cost, output = cost_function.compute_cost(state_machine, behavior_tree, ticks, debug=debug)
 
-                fitness += -cost/3.0
+                fitness += -cost/len(runs)
                 performance += int(output)
 
-            if performance == 3:
+            if performance == len(runs):
                 completed = True
 
         else:
-            state_machine = sm.StateMachine(self.scenario, self.deterministic, self.verbose)
-            behavior_tree = PyTree(string[:], behaviors=behaviors, state_machine=state_machine)
-
-            # run the Behavior Tree
-            ticks = behavior_tree.tick_bt()
-
+            state_machine, behavior_tree, ticks = runs[0]
             cost, completed = cost_function.compute_cost(state_machine, behavior_tree, ticks, debug=debug)
             fitness = -cost
 
@@ -68,5 +253,5 @@ class Environment:
 
     def plot_individual(self, path, plot_name, individual):
         """ Saves a graphical representation of the individual """
-        pytree = PyTree(individual[:], behaviors=behaviors)
+        pytree = PyTree(individual[:], behaviors=behaviors, nodes=self.nodes)
         pytree.save_fig(path, name=plot_name)
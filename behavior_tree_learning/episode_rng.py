@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Reproducible random streams for single episodes of the state machine simulator
+"""
+import hashlib
+import random
+import numpy as np
+
+def genome_hash(genome):
+    """ Returns a hash of the genome that is the same in every process """
+    return int.from_bytes(hashlib.md5('\n'.join(genome).encode('utf-8')).digest(), 'little')
+
+class UniformStream:
+    """
+    Counter-based Philox generator keyed by a list of integers.
+    Uniforms are drawn from numpy in blocks and handed out one by one.
+    """
+    def __init__(self, key, block_size=128):
+        self.generator = np.random.Generator(np.random.Philox(np.random.SeedSequence(key)))
+        self.block_size = block_size
+        self.block = []
+        self.index = 0
+
+    def random(self):
+        """ Returns a uniform number in [0, 1) """
+        if self.index >= len(self.block):
+            self.block = self.generator.random(self.block_size).tolist()
+            self.index = 0
+        self.index += 1
+        return self.block[self.index - 1]
+
+    def uniform(self, a, b):
+        """ Returns a uniform number between a and b, as random.uniform """
+        return a + (b - a) * self.random()
+
+class GlobalRng:
+    """ The random module with the interface of the episode streams, the default of the state machine """
+    @staticmethod
+    def random():
+        """ Returns a uniform number in [0, 1) """
+        return random.random()
+
+    @staticmethod
+    def uniform(a, b):
+        """ Returns a uniform number between a and b """
+        return random.uniform(a, b)
+
+    @staticmethod
+    def transition(_transition):
+        """ Returns the uniform number deciding the outcome of a transition """
+        return random.random()
+
+class EpisodeRng(UniformStream):
+    """
+    Random stream of one episode, used by the state machine in place of the random module.
+    The stream is keyed by the run seed, a hash of the genome, the episode index and
+    the stream index (e.g. the cube spawn pose in scenario 2), so an episode draws
+    the same numbers in any process and in any evaluation order.
+    """
+    def __init__(self, seed, genome, episode, stream=0, block_size=128):
+        super().__init__([seed, genome_hash(genome), episode, stream], block_size)
+
+    def transition(self, _transition):
+        """ Returns the uniform number deciding the outcome of a transition """
+        return self.random()
+
+class CommonRng(UniformStream):
+    """
+    Common random numbers: the streams do not depend on the genome, so all genomes see
+    the same sampled failures in the same episode. Every kind of transition has its own
+    stream, so the n-th localisation of any genome gets the same number whatever else
+    it did before. Noise is drawn from a separate stream.
+    """
+    def __init__(self, seed, episode, stream=0, block_size=128):
+        self.key = [seed, episode, stream]
+        super().__init__(self.key + [0, 1], block_size)
+        self.transitions = {}
+
+    def transition(self, transition):
+        """ Returns the next uniform number of the stream of the kind of transition """
+        stream = self.transitions.get(transition)
+        if stream is None:
+            stream = UniformStream(self.key + [int(transition) + 1, 1], self.block_size)
+            self.transitions[transition] = stream
+        return stream.random()
@@ -1,22 +1,33 @@
 #!/usr/bin/env python3
-# pylint: disable=global-at-module-level, too-many-instance-attributes
+# pylint: disable=too-many-instance-attributes
 """
 A genetic programming algorithm with many possible settings
 """
+import math
 import random
+import time
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import contextmanager
 from enum import Enum, auto
-from dataclasses import dataclass
-from statistics import mean
+from dataclasses import dataclass, field
 import numpy as np
 
 from hash_table import HashTable
+from genome_archive import GenomeArchive
+from hall_of_fame import HallOfFame
+from surrogate import Surrogate
 import logplot as logplot
 
 #Below are imports that can be changed to run agpinst different environments etc.
 import gp_bt_interface as gp_interface
 
-global COMPLETED
-global INDIVIDUAL
+#Held while a run has its random number generator states swapped in, see GpEngine.rng.
+#Re-entrant so that a run can step another one, e.g. from a migration function
+RNG_LOCK = threading.RLock()
+#Environment of a worker process of a pipelined run
+WORKER_ENVIRONMENT = None
 
 class SelectionMethods(Enum):
     """ Enum class for selection methods """
@@ -47,7 +58,28 @@ class GpParameters:
     plot: bool = True                                      #Plot fitness
     n_generations: int = 100                               #Number of generations
     hash_table_size: int = 100000                          #Size of hash table
-    rerun_fitness: int = 1                                 #0-run only once, 1-according to prob, 2-always
+    fitness_reservoir: int = 0                             #Number of raw fitness samples kept per hash table entry
+    reuse_cache: bool = False                              #Warm start from the fitness cache of runs with same environment fingerprint,
+                                                           #off so that runs do not depend on previous ones
+    archive: bool = False                                  #Keep a compressed archive of every evaluated genome
+    archive_interval: int = 10                             #Generations between saves of the archive, 0 to save it only at the end
+    hall_of_fame_size: int = 0                             #Number of best genomes of the whole run to keep, 0 to disable
+    checkpoint_interval: int = 0                           #Generations between checkpoints of the complete run state, 0 to disable
+    max_episodes: int = 0                                  #Stop when this number of episodes has been run, 0 to disable
+    max_time: float = 0                                    #Stop after this wall clock time in seconds, 0 to disable
+    plateau_generations: int = 0                           #Stop when best fitness has not improved for this many generations, 0 to disable
+    plateau_tolerance: float = 0.0                         #Improvements of best fitness up to this are not counted
+    completed_grace: int = -1                              #Generations to continue after an individual completed the task, -1 to disable
+    rerun_fitness: int = 1                                 #0-run only once, 1-according to prob, 2-always, 3-racing
+    racing_confidence: float = 1.96                        #Width of the racing confidence intervals in standard errors
+    racing_max_episodes: int = 10                          #Maximum number of episodes per individual when racing
+    racing_tolerance: float = 0.5                          #Confidence intervals narrower than this are not raced further
+    screening: list = field(default_factory=list)          #Fidelity levels of the environment screening offspring, cheapest first
+    f_promoted: float = 0.5                                #Fraction of offspring promoted to the next fidelity level
+    f_surrogate: float = 0                                 #Fraction of offspring simulated after ranking by a surrogate model, 0 to disable
+    surrogate_refit: int = 5                               #Generations between refits of the surrogate model
+    surrogate_ridge: float = 1.0                           #Regularization of the surrogate ridge regression
+    pipeline_workers: int = 0                              #Worker processes for pipelined generations, 0 for sequential generations
     verbose: bool = False                                  #Extra prints
     log_name: str = '1'                                    #Name of log for folder and file handling
     fig_best: bool = True                                  #Save final best individual as figure
@@ -60,9 +92,9 @@ def set_seeds(seed):
     random.seed(seed)
     np.random.seed(seed)
 
-def create_population(population_size, genome_length):
+def create_population(population_size, genome_length, nodes=None):
     """
-    Creates an initial random population
+    Creates an initial random population, nodes are the node settings of the environment
     """
     new_population = []
     max_attempts = 100
@@ -72,7 +104,7 @@ def create_population(population_size, genome_length):
         attempts = 0
 
         while attempts < max_attempts:
-            individual = gp_interface.random_genome(genome_length)
+            individual = gp_interface.random_genome(genome_length, nodes)
             if individual != [] and individual not in new_population:
                 new_population.append(individual)
                 break
@@ -80,7 +112,7 @@ def create_population(population_size, genome_length):
 
     return new_population
 
-def mutation(population, parents, gp_par):
+def mutation(population, parents, gp_par, nodes=None):
     """
     Generate offspring by mutating a gene
     """
@@ -94,7 +126,7 @@ def mutation(population, parents, gp_par):
             while attempts < max_attempts:
                 mutated_individual = gp_interface.mutate_gene(population[parent], \
                                                               gp_par.mutation_p_add, \
-                                                              gp_par.mutation_p_delete)
+                                                              gp_par.mutation_p_delete, nodes)
                 if mutated_individual != [] and (gp_par.allow_identical or mutated_individual not in population):
                     mutated_population.append(mutated_individual)
                     break
@@ -102,7 +134,7 @@ def mutation(population, parents, gp_par):
 
     return mutated_population
 
-def crossover(population, parents, gp_par):
+def crossover(population, parents, gp_par, nodes=None):
     """
     Generates offspring by crossovers
     """
@@ -121,7 +153,7 @@ def crossover(population, parents, gp_par):
             crossover_parents = random.sample(range(len(unused_parents)), 2)
             parent1 = unused_parents[int(crossover_parents[0])]
             parent2 = unused_parents[int(crossover_parents[1])]
-            offspring1, offspring2 = gp_interface.crossover_genome(population[parent1], population[parent2])
+            offspring1, offspring2 = gp_interface.crossover_genome(population[parent1], population[parent2], nodes)
 
             if offspring1 != [] and offspring2 != [] and \
                 (gp_par.allow_identical or (offspring1 not in population and offspring2 not in population)):
@@ -138,7 +170,7 @@ def crossover(population, parents, gp_par):
         if attempts == max_attempts and len(unused_parents) > 0 and \
             gp_par.n_offspring_mutation <= 1 and gp_par.n_offspring_crossover <= 1:
             #Fill up with mutation in case we can't find enough good crossovers
-            crossover_offspring += mutation(population, unused_parents, gp_par)
+            crossover_offspring += mutation(population, unused_parents, gp_par, nodes)
 
     return crossover_offspring
 
@@ -151,29 +183,132 @@ def rerun_probability(n_runs):
     else:
         return 1 / n_runs**2
 
-def get_fitness(individual, hash_table, environment, rerun=0):
+def needs_episode(entry, rerun):
     """
-    Gets fitness from hash table if possible, otherwise gets it from simulation
-    rerun = 0 means never rerun
-    rerun = 1 means rerun with diminishing probability
-    rerun = 2 means rerun always
+    Returns True if an individual with the given hash table entry must run an episode
     """
-    global COMPLETED
-    global INDIVIDUAL
+    return entry is None or rerun == 2 or (rerun == 1 and random.random() < rerun_probability(entry.count))
 
-    values = hash_table.find(individual)
+def run_episode(environment, individual, entry):
+    """
+    Runs one episode of individual, returns fitness and completion.
+    Environments with per-episode random streams get the number of previous episodes in entry
+    """
+    if getattr(environment, 'episode_seed', None) is None:
+        return environment.get_fitness(individual)
+    return environment.get_fitness(individual, episode=0 if entry is None else entry.count)
 
-    if values is None or rerun == 2 or (rerun == 1 and random.random() < rerun_probability(len(values))):
-        fitness, done = environment.get_fitness(individual)
-        hash_table.insert(individual, fitness)
-        if done:
-            INDIVIDUAL = individual
-            COMPLETED = True
+def init_worker(environment):
+    """ Initializes a worker process of a pipelined run """
+    global WORKER_ENVIRONMENT
+    WORKER_ENVIRONMENT = environment
 
-        if values is None:
-            values = [fitness]
+def evaluate_episode(individual, seed, entry):
+    """
+    Runs one episode of individual in a worker process, seeded so that the result
+    does not depend on which worker runs it. Returns fitness, completion and wall time
+    """
+    set_seeds(seed)
+    start_time = time.perf_counter()
+    fitness, done = run_episode(WORKER_ENVIRONMENT, individual, entry)
+    return fitness, done, time.perf_counter() - start_time
 
-    return mean(values)
+def get_fitness(individual, hash_table, environment, rerun=0, engine=None):
+    """
+    Gets fitness from hash table if possible, otherwise gets it from simulation
+    rerun = 0 means never rerun
+    rerun = 1 means rerun with diminishing probability
+    rerun = 2 means rerun always
+    rerun = 3 means never rerun here, reruns are scheduled by race
+    If the individual completes the task, it is recorded in engine
+    """
+    entry = hash_table.find(individual)
+
+    if needs_episode(entry, rerun):
+        start_time = time.perf_counter()
+        fitness, done = run_episode(environment, individual, entry)
+        entry = hash_table.insert(individual, fitness, time.perf_counter() - start_time)
+        if done and engine is not None:
+            engine.individual = individual
+            engine.completed = True
+
+    return entry.mean
+
+def screen(offspring, hash_table, environments, gp_par):
+    """
+    Multi-fidelity screening of offspring.
+    Offspring are evaluated once at each level in environments, cheapest first, and only the
+    f_promoted best of a level go on to the next one and finally to full fidelity evaluation.
+    Fitness values are stored under the fingerprint of each level.
+    Returns the promoted offspring in their original order.
+    """
+    for environment in environments:
+        namespace = environment.fingerprint()
+        fitness = []
+        for individual in offspring:
+            entry = hash_table.peek(individual, namespace)
+            if entry is None:
+                start_time = time.perf_counter()
+                value, _ = run_episode(environment, individual, entry)
+                entry = hash_table.insert(individual, value, time.perf_counter() - start_time, namespace)
+            fitness.append(entry.mean)
+        promoted = largest(fitness, math.ceil(gp_par.f_promoted * len(offspring)))
+        offspring = [offspring[i] for i in sorted(promoted.tolist())]
+    return offspring
+
+def race(candidates, fitness, n_survivors, hash_table, environment, gp_par, engine=None):
+    """
+    Confidence bound racing of the candidates for survival.
+    The cutoff lies between the n_survivors best and the others. Candidates whose confidence
+    interval on the mean fitness contains the cutoff get one more episode, and this repeats
+    until no interval contains the cutoff or those that do have racing_max_episodes episodes
+    or are narrower than racing_tolerance.
+    Individuals with a single episode use the pooled variance of the candidates, if no candidate
+    has two episodes the two closest to the cutoff run a second one to estimate it.
+    Candidates missing from the hash table are not raced.
+    Returns the updated fitness list and the number of extra episodes.
+    """
+    fitness = fitness[:]
+    if len(candidates) <= n_survivors or n_survivors <= 0:
+        return fitness, 0
+
+    indices = {}
+    for i, individual in enumerate(candidates):
+        indices.setdefault(tuple(individual), []).append(i)
+
+    n_episodes = 0
+    while True:
+        sorted_fitness = sorted(fitness, reverse=True)
+        cutoff = (sorted_fitness[n_survivors - 1] + sorted_fitness[n_survivors]) / 2
+
+        #Candidates only evaluated at a screening fidelity have no entry and are not raced
+        entries = {key: hash_table.peek(list(key)) for key in indices}
+        entries = {key: entry for key, entry in entries.items() if entry is not None}
+        sampled = [entry for entry in entries.values() if entry.count >= 2]
+
+        racing = []
+        if not sampled:
+            #No variance estimate yet, the two candidates closest to the cutoff get a second episode
+            for key in sorted(entries, key=lambda key: abs(entries[key].mean - cutoff))[:2]:
+                if entries[key].count < gp_par.racing_max_episodes:
+                    racing.append(key)
+        else:
+            pooled_variance = sum(entry.variance for entry in sampled) / len(sampled)
+            for key, entry in entries.items():
+                if entry.count >= gp_par.racing_max_episodes:
+                    continue
+                variance = entry.variance if entry.count >= 2 else pooled_variance
+                half_width = gp_par.racing_confidence * math.sqrt(variance / entry.count)
+                if abs(entry.mean - cutoff) < half_width and half_width > gp_par.racing_tolerance:
+                    racing.append(key)
+        if not racing:
+            return fitness, n_episodes
+
+        for key in racing:
+            mean = get_fitness(list(key), hash_table, environment, rerun=2, engine=engine)
+            for i in indices[key]:
+                fitness[i] = mean
+        n_episodes += len(racing)
 
 def crossover_parent_selection(population, fitness, gp_par):
     """
@@ -186,29 +321,22 @@ def crossover_parent_selection(population, fitness, gp_par):
 
 def mutation_parent_selection(population, fitness, crossover_parents, crossover_offspring, gp_par):
     """
-    Select parents for crossover
+    Select parents for mutation
     Input fitness contains fitness for crossover offspring after fitness for the rest of the population
     Input population does not contain crossover offspring
     Returns indices of parents.
     """
-    mutable_population = population[:]
-    mutable_fitness = fitness[:]
-
+    n_mutable = len(population)
     if not gp_par.mutate_co_parents:
-        crossover_parents.sort(reverse=True)
-        for i in crossover_parents:
-            mutable_population.pop(i)
-            mutable_fitness.pop(i)
+        n_mutable -= len(crossover_parents)
     if gp_par.mutate_co_offspring:
-        mutable_population += crossover_offspring
-    else:
-        mutable_fitness = mutable_fitness[:len(population)]
+        n_mutable += len(crossover_offspring)
 
     n_parents_mutation = int(round(gp_par.f_mutation * gp_par.n_population))
     if n_parents_mutation <= 0:
         return []
 
-    return selection(range(len(mutable_population)), fitness, n_parents_mutation, gp_par.parent_selection)
+    return selection(range(n_mutable), fitness[:n_mutable], n_parents_mutation, gp_par.parent_selection)
 
 def survivor_selection(population, fitness, crossover_offspring, mutated_offspring, gp_par):
     """
@@ -235,12 +363,13 @@ def survivor_selection(population, fitness, crossover_offspring, mutated_offspri
     n_elites = int(round(gp_par.f_elites * gp_par.n_population))
     if n_elites > 0:
         elites = elite_selection(range(len(selectable)), selectable_fitness, n_elites)
-        elites.sort(reverse=True)
+        is_elite = np.zeros(len(selectable), dtype=bool)
+        is_elite[elites] = True
         for i in elites:
             survivors.append(selectable[i])
             survivor_fitness.append(selectable_fitness[i])
-            selectable.pop(i)
-            selectable_fitness.pop(i)
+        selectable = [x for x, elite in zip(selectable, is_elite) if not elite]
+        selectable_fitness = [x for x, elite in zip(selectable_fitness, is_elite) if not elite]
 
     n_to_select = gp_par.n_population - len(survivors)
     selected = selection(range(len(selectable)), selectable_fitness, n_to_select, gp_par.survivor_selection)
@@ -262,7 +391,7 @@ def selection(population, fitness, n_selected, selection_method):
     elif selection_method == SelectionMethods.RANK:
         selected = rank_selection(population, fitness, n_selected)
     elif selection_method == SelectionMethods.RANDOM:
-        selected = random.sample(population, n_selected)
+        selected = random_selection(population, n_selected)
     elif selection_method == SelectionMethods.ALL:
         selected = population
     else:
@@ -270,40 +399,53 @@ def selection(population, fitness, n_selected, selection_method):
 
     return selected
 
+def largest(values, n):
+    """
+    Returns the indices of the n largest values in decreasing order,
+    ties are broken by lowest index
+    """
+    values = np.asarray(values, dtype=float)
+    if n <= 0:
+        return np.zeros(0, dtype=int)
+    if n < len(values):
+        indices = np.argpartition(-values, n - 1)[:n]
+    else:
+        indices = np.arange(len(values))
+    return indices[np.lexsort((indices, -values[indices]))]
+
 def elite_selection(population, fitness, n_elites):
     """
     Elite selection from population
     """
-    sorted_population = sorted(zip(fitness, population), reverse=True)
-
-    return [x for _, x in sorted_population[:n_elites]]
+    return [population[i] for i in largest(fitness[:len(population)], n_elites).tolist()]
 
 def tournament_selection(population, fitness, n_winners):
     """
     Tournament selection.
+    The shuffled population is split into n_winners brackets of equal size,
+    padded with dummies that lose every match, and the best of each bracket wins.
     """
+    n_population = len(population)
+    if n_winners <= 0:
+        return []
+    if n_winners >= n_population:
+        return [population[i] for i in np.random.permutation(n_population).tolist()]
+
     tournament_size = n_winners
-    while tournament_size < len(population):
+    while tournament_size < n_population:
         tournament_size *= 2
 
-    tournament_population = list(zip(fitness, population))
-    random.shuffle(tournament_population)
-
-    for i in range(tournament_size - len(population)):
-        #Add dummies to make sure we have a full tournament
-        tournament_population.insert(i * 2, (-float("inf"), []))
-
-    winner_fitness, winners = [list(x) for x in zip(*tournament_population)]
-    while len(winners) > n_winners:
-        for i in range(0, int(len(winners) / 2)):
-            if winner_fitness[i] < winner_fitness[i+1]:
-                winner_fitness.pop(i)
-                winners.pop(i)
-            else:
-                winner_fitness.pop(i + 1)
-                winners.pop(i + 1)
+    #Dummies take the second place of the first matches so that no bracket is only dummies
+    brackets = np.full(tournament_size, -1)
+    is_real = np.ones(tournament_size, dtype=bool)
+    is_real[1:2 * (tournament_size - n_population):2] = False
+    brackets[is_real] = np.random.permutation(n_population)
+    brackets = brackets.reshape(n_winners, -1)
 
-    return winners
+    bracket_fitness = np.asarray(fitness[:n_population], dtype=float)[brackets]
+    bracket_fitness[brackets < 0] = -np.inf
+    winners = brackets[np.arange(n_winners), np.argmax(bracket_fitness, axis=1)]
+    return [population[i] for i in winners.tolist()]
 
 def rank_selection(population, fitness, n_selected):
     """
@@ -312,12 +454,29 @@ def rank_selection(population, fitness, n_selected):
     such that the highest ranked individual get n_ranks as weight
     and the lowest ranked individual gets 1. The weights are then scaled so
     that they sum to 1.
+    Sampling without replacement draws all individuals at once by giving
+    each one the key log(u) / weight and taking the largest keys.
     """
-    sorted_population = sorted(zip(fitness, population), reverse=True)
-    _, sorted_indices = [list(x) for x in zip(*sorted_population)]
-    n_ranks = len(sorted_indices)
-    p = np.linspace(2 / (n_ranks + 1), 2 / (n_ranks * (n_ranks + 1)), n_ranks)
-    return list(np.random.choice(sorted_indices, size=n_selected, replace=False, p=p))
+    n_ranks = len(population)
+    if n_selected > n_ranks:
+        raise ValueError("Cannot select more individuals than the population size")
+    sorted_indices = largest(fitness[:n_ranks], n_ranks)
+    weights = np.arange(n_ranks, 0, -1)
+    with np.errstate(divide='ignore'):
+        keys = np.log(np.random.random(n_ranks)) / weights
+    return [population[i] for i in sorted_indices[largest(keys, n_selected)].tolist()]
+
+def random_selection(population, n_selected):
+    """
+    Uniform random selection without replacement
+    """
+    return [population[i] for i in np.random.choice(len(population), n_selected, replace=False).tolist()]
+
+def best_individual(population, fitness):
+    """
+    Returns the individual with the highest fitness, the first one on ties
+    """
+    return population[int(np.argmax(fitness))]
 
 def print_population(population, fitness, generation):
     """
@@ -333,115 +492,518 @@ def print_population(population, fitness, generation):
 
 
 
-def run(environment, gp_par, hotstart=False, hotstart_population=None, baseline=None):
+def stopping_criterion(gp_par, generation, best_fitness, n_episodes, run_time, completed_generation):
     """
-    Runs the genetic algorithm
+    Returns the reason for stopping the run after generation, None if it should go on
     """
-    global COMPLETED
-    global INDIVIDUAL
-    COMPLETED = False
-    INDIVIDUAL = None
-
-    hash_table = HashTable(gp_par.hash_table_size, gp_par.log_name)
-
-    if hotstart:
-        population = hotstart_population.copy()
-        hash_table.load()
-    else:
-        population = create_population(gp_par.n_population, gp_par.ind_start_length)
-        logplot.clear_logs(gp_par.log_name)
-
-    if baseline is not None:
-        population[0] = baseline
-
-    #log_video_path = '/home/matteo/Documents/behavior-tree-learning/logs/log_' + str(gp_par.log_name) + '/BTs_for_' + str(gp_par.log_name)
-
-    fitness = []
-    best_fitness = []
-    n_episodes = []
-    for individual in population:
-        fitness.append(get_fitness(individual, hash_table, environment, rerun=0))
-
-    best_fitness.append(max(fitness))
-    n_episodes.append(hash_table.n_values)
+    if gp_par.max_episodes > 0 and n_episodes[-1] >= gp_par.max_episodes:
+        return "Episode budget reached"
+    if gp_par.max_time > 0 and run_time >= gp_par.max_time:
+        return "Time budget reached"
+    if gp_par.plateau_generations > 0 and len(best_fitness) > gp_par.plateau_generations and \
+       best_fitness[-1] - best_fitness[-1 - gp_par.plateau_generations] <= gp_par.plateau_tolerance:
+        return "Best fitness has not improved for " + str(gp_par.plateau_generations) + " generations"
+    if gp_par.completed_grace >= 0 and completed_generation is not None and \
+       generation - completed_generation >= gp_par.completed_grace:
+        return "Task completed"
+    return None
 
-    if gp_par.verbose:
-        print_population(population, fitness, 0)
-
-    print("Generation: ", 0, " Best fitness: ", best_fitness)
-
-    # for video purpose
-    """
-    with open(log_video_path, "w") as f:
-        f.writelines("Initial Generation:\n")
-        f.writelines(str(population))
-    f.close()
-    """
-
-    logplot.log_fitness(gp_par.log_name, fitness)
-    logplot.log_population(gp_par.log_name, population)
-
-    for generation in range(1, gp_par.n_generations):
-        if baseline is not None and not baseline in population:
-            population.append(baseline) #Make sure we are always able to source from baseline
+@dataclass
+class GenerationState:
+    """ Data class for the state of a run at the end of a generation """
+    generation: int
+    population: list
+    fitness: list
+    best_fitness: float
+    best_individual: list
+    n_episodes: int
+    completed: bool
+
+class GpEngine:
+    """
+    Genetic programming run advancing one generation at a time.
+    All mutable state of the run lives in the instance, including its random number generator
+    states which are swapped in for every generation, so several engines can be interleaved
+    in one process or thread and each follows the trajectory it would have on its own.
+    Between generations callers can read the state, change gp_par or the population, or stop the run.
+    migration is an optional function called at the end of every generation as
+    migration(generation, population, fitness, hash_table, environment, engine) and returning
+    the new population and fitness, e.g. to exchange individuals with other islands
+    checkpoint is a state saved by a previous run to continue from, see resume
+    The worker processes of a pipelined run are stopped by finish, or by close when the run is
+    abandoned, e.g. using the engine as a context manager.
+    """
+    def __init__(self, environment, gp_par, hotstart=False, hotstart_population=None, \
+                 baseline=None, migration=None, checkpoint=None):
+        self.environment = environment
+        # Allowed nodes of the genomes, environments without node settings use the module wide ones
+        self.nodes = getattr(environment, 'nodes', None)
+        self.gp_par = gp_par
+        self.baseline = baseline
+        self.migration = migration
+        self.completed = False
+        self.individual = None
+        self.completed_generation = None
+        self.stop_reason = None
+        self.result = None
+        self.random_state = random.getstate()
+        self.numpy_state = np.random.get_state()
+        # Random number generator states of the caller while the ones of the run are swapped in
+        self.outer_state = None
+        with self.rng():
+            self.setup(hotstart, hotstart_population, checkpoint)
+
+    @contextmanager
+    def rng(self):
+        """ Swaps in the random number generator states of the run """
+        if self.outer_state is not None:
+            #Already swapped in further up the stack
+            yield
+            return
+        with RNG_LOCK:
+            self.outer_state = (random.getstate(), np.random.get_state())
+            random.setstate(self.random_state)
+            np.random.set_state(self.numpy_state)
+            try:
+                yield
+            finally:
+                self.random_state = random.getstate()
+                self.numpy_state = np.random.get_state()
+                random.setstate(self.outer_state[0])
+                np.random.set_state(self.outer_state[1])
+                self.outer_state = None
+
+    @contextmanager
+    def released(self):
+        """
+        Swaps the random number generator states of the caller back in and lets engines of other threads run,
+        for waits that draw no random numbers
+        """
+        self.random_state = random.getstate()
+        self.numpy_state = np.random.get_state()
+        random.setstate(self.outer_state[0])
+        np.random.set_state(self.outer_state[1])
+        RNG_LOCK.release()
+        try:
+            yield
+        finally:
+            RNG_LOCK.acquire()
+            self.outer_state = (random.getstate(), np.random.get_state())
+            random.setstate(self.random_state)
+            np.random.set_state(self.numpy_state)
+
+    def setup(self, hotstart, hotstart_population, checkpoint):
+        """
+        Creates the hash table, archive, hall of fame and surrogate of the run
+        and restores the state of checkpoint if given
+        """
+        gp_par = self.gp_par
+        self.start_time = time.perf_counter()
+        namespace = self.environment.fingerprint() if hasattr(self.environment, 'fingerprint') else ''
+
+        if checkpoint is not None:
+            self.hash_table = pickle.loads(checkpoint['hash_table'])
+            logplot.truncate_text_logs(gp_par.log_name, checkpoint['log_sizes'])
+        else:
+            self.hash_table = HashTable(gp_par.hash_table_size, gp_par.log_name, gp_par.fitness_reservoir, namespace)
+            if hotstart:
+                self.population = hotstart_population.copy()
+                self.hash_table.load()
+            else:
+                self.population = create_population(gp_par.n_population, gp_par.ind_start_length, self.nodes)
+                logplot.clear_logs(gp_par.log_name)
+                if gp_par.reuse_cache:
+                    self.hash_table.load_cache()
+
+        self.screening = [self.environment.reduced(fidelity) for fidelity in gp_par.screening]
+
+        self.executor = None
+        self.writer = None
+        #Evaluations submitted to the workers and not collected yet
+        self.futures = set()
+        if gp_par.pipeline_workers > 0:
+            self.executor = ProcessPoolExecutor(gp_par.pipeline_workers, initializer=init_worker, \
+                                                initargs=(self.environment,))
+            self.writer = logplot.BackgroundWriter()
+
+        #The entries already in the table, e.g. of a loaded cache, are replayed to new listeners,
+        #those restored from a checkpoint have already seen them
+        self.archive = None
+        if gp_par.archive:
+            restored = checkpoint is not None and checkpoint['archive'] is not None
+            self.archive = checkpoint['archive'] if restored else GenomeArchive()
+            self.hash_table.add_listener(self.archive.hash_table_listener, replay=not restored)
+
+        self.hall_of_fame = None
+        if gp_par.hall_of_fame_size > 0:
+            restored = checkpoint is not None and checkpoint['hall_of_fame'] is not None
+            self.hall_of_fame = checkpoint['hall_of_fame'] if restored else HallOfFame(gp_par.hall_of_fame_size)
+            self.hash_table.add_listener(self.hall_of_fame.hash_table_listener, replay=not restored)
+
+        self.surrogate = None
+        self.surrogate_stats = []
+        if gp_par.f_surrogate > 0:
+            restored = checkpoint is not None and checkpoint['surrogate'] is not None
+            if restored:
+                self.surrogate = checkpoint['surrogate']
+                self.surrogate_stats = checkpoint['surrogate_stats']
+            else:
+                self.surrogate = Surrogate(ridge=gp_par.surrogate_ridge)
+            self.hash_table.add_listener(self.surrogate.hash_table_listener, replay=not restored)
+
+        if checkpoint is not None:
+            self.generation = checkpoint['generation']
+            self.population = checkpoint['population']
+            self.fitness = checkpoint['fitness']
+            self.best_fitness = checkpoint['best_fitness']
+            self.n_episodes = checkpoint['n_episodes']
+            self.cache_stats = checkpoint['cache_stats']
+            self.completed = checkpoint['completed']
+            self.individual = checkpoint['individual']
+            self.start_time -= checkpoint['run_time']
+            self.completed_generation = checkpoint['completed_generation']
+            self.stop_reason = checkpoint.get('stop_reason')
+            random.setstate(checkpoint['random_state'])
+            np.random.set_state(checkpoint['numpy_state'])
+            print("Resuming from generation: ", checkpoint['generation'])
+        else:
+            self.generation = -1
+            if self.baseline is not None:
+                self.population[0] = self.baseline
+            self.fitness = []
+            self.best_fitness = []
+            self.n_episodes = []
+            self.cache_stats = []
+
+    def get_fitness(self, individual, rerun):
+        """ Gets the fitness of individual, recording whether it completed the task """
+        return get_fitness(individual, self.hash_table, self.environment, rerun, engine=self)
+
+    def get_fitness_batch(self, individuals, rerun):
+        """
+        Gets the fitness of all individuals. In a pipelined run, all the needed episodes
+        are dispatched to the workers at once, see submit_batch
+        """
+        if self.executor is None:
+            return [self.get_fitness(individual, rerun) for individual in individuals]
+        return self.collect_batch(individuals, self.submit_batch(individuals, rerun))
 
-        if generation > 1:
-            fitness = []
-            for individual in population:
-                fitness.append(get_fitness(individual, hash_table, environment, gp_par.rerun_fitness))
+    def submit_batch(self, individuals, rerun, pending=None):
+        """
+        Dispatches the episodes needed by individuals to the workers of a pipelined run,
+        each one with a seed drawn from the run generator, and returns the pending evaluations.
+        Individuals already in pending, e.g. of an earlier call, are not dispatched again
+        """
+        if pending is None:
+            pending = ({}, [])
+        entries, futures = pending
+        to_evaluate = []
+        for individual in individuals:
+            key = tuple(individual)
+            if key not in entries:
+                entries[key] = self.hash_table.find(individual)
+                if needs_episode(entries[key], rerun):
+                    to_evaluate.append(individual)
+        for individual in to_evaluate:
+            futures.append((individual, self.executor.submit(evaluate_episode, individual, random.getrandbits(32), \
+                                                             entries[tuple(individual)])))
+            self.futures.add(futures[-1][1])
+        return pending
+
+    def collect_batch(self, individuals, pending):
+        """ Waits for the pending evaluations of submit_batch and returns the fitness of individuals """
+        entries, futures = pending
+        if futures:
+            with self.released():
+                wait([future for _, future in futures])
+        for individual, future in futures:
+            fitness, done, eval_time = future.result()
+            self.futures.discard(future)
+            entries[tuple(individual)] = self.hash_table.insert(individual, fitness, eval_time)
+            if done:
+                self.individual = individual
+                self.completed = True
+        futures.clear()
+        return [entries[tuple(individual)].mean for individual in individuals]
+
+    def log(self, function, *args):
+        """ Calls a log function, in the background writer of a pipelined run """
+        if self.writer is None:
+            function(*args)
+        else:
+            self.writer.submit(function, *args)
+
+    def done(self):
+        """ Returns True when the run has no generations left """
+        if self.generation < 0:
+            return False
+        return self.stop_reason is not None or self.generation >= self.gp_par.n_generations - 1
+
+    def stop(self, reason="Stopped by caller"):
+        """ Stops the run at the end of the current generation """
+        self.stop_reason = reason
+
+    def step(self):
+        """
+        Runs the next generation, the initial one on the first call.
+        Returns its GenerationState, None if the run is done
+        """
+        if self.done():
+            return None
+        with self.rng():
+            if self.generation < 0:
+                self.initial_generation()
+            else:
+                self.next_generation()
+        return self.state()
 
+    def generations(self):
+        """
+        Generator running the generations one by one and yielding their GenerationState.
+        Logs are written when the run is done
+        """
+        while not self.done():
+            yield self.step()
+        self.finish()
+
+    def state(self):
+        """ Returns the GenerationState of the last generation """
+        return GenerationState(self.generation, self.population[:], self.fitness[:], self.best_fitness[-1], \
+                               best_individual(self.population, self.fitness), self.n_episodes[-1], self.completed)
+
+    def initial_generation(self):
+        """ Evaluates the initial population """
+        gp_par = self.gp_par
+        self.generation = 0
+        self.hash_table.new_generation()
+        self.fitness = self.get_fitness_batch(self.population, rerun=0)
+
+        self.best_fitness.append(max(self.fitness))
+        self.n_episodes.append(self.hash_table.n_values)
+        self.cache_stats.append(self.hash_table.generation_stats())
+
+        if gp_par.verbose:
+            print_population(self.population, self.fitness, 0)
+
+        print("Generation: ", 0, " Best fitness: ", self.best_fitness)
+
+        self.log(logplot.log_fitness, gp_par.log_name, self.fitness[:])
+        self.log(logplot.log_population, gp_par.log_name, self.population[:])
+        if self.completed:
+            self.completed_generation = 0
+        #The initial population can already use up a budget
+        self.check_stopping(time.perf_counter() - self.start_time)
+
+    def check_stopping(self, run_time):
+        """ Stops the run at the end of the current generation if a stopping criterion is met """
+        reason = stopping_criterion(self.gp_par, self.generation, self.best_fitness, self.n_episodes, \
+                                    run_time, self.completed_generation)
+        if reason is not None:
+            print("Stopping at generation ", self.generation, ": ", reason)
+            self.stop(reason)
+
+    def offspring(self, population, fitness, evaluate_crossover):
+        """
+        Creates the crossover and mutation offspring of the population.
+        If evaluate_crossover, crossover offspring are evaluated before mutation and their fitness
+        is appended to fitness. Returns crossover offspring, mutation offspring and fitness
+        """
+        gp_par = self.gp_par
         co_parents = crossover_parent_selection(population, fitness, gp_par)
-        co_offspring = crossover(population, co_parents, gp_par)
-        #print("Offspring:" + str(co_offspring))
-        for offspring in co_offspring:
-            fitness.append(get_fitness(offspring, hash_table, environment, gp_par.rerun_fitness))
+        co_offspring = crossover(population, co_parents, gp_par, self.nodes)
+        if self.surrogate is not None:
+            co_offspring = self.surrogate.select(co_offspring, self.hash_table, gp_par.f_surrogate)
+        co_offspring = screen(co_offspring, self.hash_table, self.screening, gp_par)
+        if evaluate_crossover:
+            fitness = fitness + self.get_fitness_batch(co_offspring, gp_par.rerun_fitness)
 
         mutation_parents = mutation_parent_selection(population, fitness, co_parents, co_offspring, gp_par)
-        #print("Mutation Parents:" + str(mutation_parents))
-        mutated_offspring = mutation(population + co_offspring, mutation_parents, gp_par)
-        for offspring in mutated_offspring:
-            fitness.append(get_fitness(offspring, hash_table, environment, gp_par.rerun_fitness))
-
-        population, fitness = survivor_selection(population, fitness, co_offspring, mutated_offspring, gp_par)
-
-        best_fitness.append(max(fitness))
-        n_episodes.append(hash_table.n_values)
+        mutated_offspring = mutation(population + co_offspring, mutation_parents, gp_par, self.nodes)
+        if self.surrogate is not None:
+            mutated_offspring = self.surrogate.select(mutated_offspring, self.hash_table, gp_par.f_surrogate)
+        mutated_offspring = screen(mutated_offspring, self.hash_table, self.screening, gp_par)
+        return co_offspring, mutated_offspring, fitness
+
+    def next_generation(self):
+        """ Runs one generation of selection, crossover, mutation and survivor selection """
+        gp_par = self.gp_par
+        hash_table = self.hash_table
+        self.generation += 1
+        generation = self.generation
+        population = self.population
+        fitness = self.fitness
+
+        hash_table.new_generation()
+        if self.surrogate is not None and generation % gp_par.surrogate_refit == 0:
+            self.surrogate.fit()
+        if self.baseline is not None and not self.baseline in population:
+            population.append(self.baseline) #Make sure we are always able to source from baseline
+
+        if self.executor is None:
+            if generation > 1:
+                fitness = self.get_fitness_batch(population, gp_par.rerun_fitness)
+            co_offspring, mutated_offspring, fitness = self.offspring(population, fitness, True)
+            fitness = fitness + self.get_fitness_batch(mutated_offspring, gp_par.rerun_fitness)
+        else:
+            #The reruns of the population are dispatched first, the workers run them while the offspring
+            #are created, and screened, from the fitness of the previous generation.
+            #Crossover offspring are evaluated before mutation only if they may be mutated
+            pending = self.submit_batch(population, gp_par.rerun_fitness) if generation > 1 else None
+            co_offspring, mutated_offspring, _ = self.offspring(population, fitness, gp_par.mutate_co_offspring)
+            if generation == 1:
+                fitness = fitness + self.get_fitness_batch(co_offspring + mutated_offspring, gp_par.rerun_fitness)
+            else:
+                self.submit_batch(co_offspring + mutated_offspring, gp_par.rerun_fitness, pending)
+                fitness = self.collect_batch(population + co_offspring + mutated_offspring, pending)
 
-        best_individual = selection(population, fitness, 1, SelectionMethods.ELITISM)[0]
+        if gp_par.rerun_fitness == 3:
+            fitness, n_racing = race(population + co_offspring + mutated_offspring, fitness, \
+                                     gp_par.n_population, hash_table, self.environment, gp_par, self)
+            if gp_par.verbose:
+                print("Racing episodes: ", n_racing)
 
-        logplot.log_fitness(gp_par.log_name, fitness)
-        logplot.log_population(gp_par.log_name, population)
+        population, fitness = survivor_selection(population, fitness, co_offspring, mutated_offspring, gp_par)
 
-        # for video purpose
+        if self.migration is not None:
+            population, fitness = self.migration(generation, population, fitness, hash_table, self.environment, self)
+        self.population = population
+        self.fitness = fitness
+
+        self.best_fitness.append(max(fitness))
+        self.n_episodes.append(hash_table.n_values)
+        self.cache_stats.append(hash_table.generation_stats())
+        if self.surrogate is not None:
+            self.surrogate_stats.append(self.surrogate.generation_stats())
+
+        best = best_individual(population, fitness)
+
+        self.log(logplot.log_fitness, gp_par.log_name, fitness[:])
+        self.log(logplot.log_population, gp_par.log_name, population[:])
+        if self.hall_of_fame is not None:
+            self.log(logplot.log_hall_of_fame, gp_par.log_name, self.hall_of_fame.best())
+        if self.archive is not None and gp_par.archive_interval > 0 and generation % gp_par.archive_interval == 0:
+            #Saved in this thread, the archive changes with the next evaluations
+            logplot.log_archive(gp_par.log_name, self.archive)
+
+        print("Generation: ", generation, "Best fitness: ", self.best_fitness[generation])
+        print("Best individual: " + str(best))
+        print("Completed? " + str(self.completed))
+        if gp_par.verbose:
+            print("Episodes: ", self.n_episodes[generation], " Cache: ", self.cache_stats[generation])
+            if self.surrogate is not None:
+                print("Surrogate: ", self.surrogate_stats[-1])
+
+        if self.completed and self.completed_generation is None:
+            self.completed_generation = generation
+        run_time = time.perf_counter() - self.start_time
+
+        #Checked before the checkpoint, a run resumed from its stopping generation stops as well
+        self.check_stopping(run_time)
+
+        if gp_par.checkpoint_interval > 0 and generation % gp_par.checkpoint_interval == 0:
+            if self.writer is not None:
+                self.writer.flush()
+            logplot.log_checkpoint(gp_par.log_name, self.checkpoint_state(run_time))
+
+    def checkpoint_state(self, run_time):
         """
-        if max(fitness) > best_fitness[-2]:
-            with open(log_video_path, "a") as f:
-                f.writelines("\nGeneration: " + str(generation) + "\n")
-                f.writelines(str(max(fitness)) + ", " + str(best_individual))
-            f.close()
+        Returns the complete state of the run at the end of the current generation,
+        including random number generator states. Must be called with the run states swapped in
         """
-
-        #print_population(population, fitness, generation)
-        #print(INDIVIDUAL)
-
-        print("Generation: ", generation, "Best fitness: ", best_fitness[generation])
-        print("Best individual: " + str(best_individual))
-        print("Completed? " + str(COMPLETED))
-
-
-    hash_table.write_table()
-    best_individual = selection(population, fitness, 1, SelectionMethods.ELITISM)[0]
-    logplot.log_best_individual(gp_par.log_name, best_individual)
-    logplot.log_best_fitness(gp_par.log_name, best_fitness)
-    logplot.log_n_episodes(gp_par.log_name, n_episodes)
-    logplot.log_settings(gp_par.log_name, gp_par)
-
-    if gp_par.plot:
-        logplot.plot_fitness(gp_par.log_name, best_fitness, n_episodes)
-    if gp_par.fig_best:
-        environment.plot_individual(logplot.get_log_folder(gp_par.log_name), 'best individual', selection(population, fitness, 1, SelectionMethods.ELITISM)[0])
-    if gp_par.fig_last_gen:
-        for i in range(gp_par.n_population):
-            environment.plot_individual(logplot.get_log_folder(gp_par.log_name), 'individual_' + str(i), population[i])
-
-    return population, fitness, best_fitness, best_individual
+        listeners = self.hash_table.listeners
+        self.hash_table.listeners = [] #Restored from the archive, hall of fame and surrogate when resuming
+        state = {'generation': self.generation,
+                 'population': self.population,
+                 'fitness': self.fitness,
+                 'best_fitness': self.best_fitness,
+                 'n_episodes': self.n_episodes,
+                 'cache_stats': self.cache_stats,
+                 'hash_table': pickle.dumps(self.hash_table),
+                 'archive': self.archive,
+                 'hall_of_fame': self.hall_of_fame,
+                 'surrogate': self.surrogate,
+                 'surrogate_stats': self.surrogate_stats,
+                 'completed': self.completed,
+                 'individual': self.individual,
+                 'run_time': run_time,
+                 'completed_generation': self.completed_generation,
+                 'stop_reason': self.stop_reason,
+                 'random_state': random.getstate(),
+                 'numpy_state': np.random.get_state(),
+                 'log_sizes': logplot.get_text_log_sizes(self.gp_par.log_name)}
+        self.hash_table.listeners = listeners
+        return state
+
+    def finish(self):
+        """
+        Writes the logs and plots of the run.
+        Returns population, fitness, best fitness log and best individual
+        """
+        if self.result is not None:
+            return self.result
+        gp_par = self.gp_par
+        environment = self.environment
+        self.close()
+
+        self.hash_table.write_table()
+        if gp_par.reuse_cache:
+            self.hash_table.write_cache()
+        best = best_individual(self.population, self.fitness)
+        logplot.log_best_individual(gp_par.log_name, best)
+        logplot.log_best_fitness(gp_par.log_name, self.best_fitness)
+        logplot.log_n_episodes(gp_par.log_name, self.n_episodes)
+        logplot.log_cache_stats(gp_par.log_name, self.cache_stats)
+        if self.archive is not None:
+            logplot.log_archive(gp_par.log_name, self.archive)
+        if self.surrogate is not None:
+            logplot.log_surrogate_stats(gp_par.log_name, self.surrogate_stats)
+        logplot.log_settings(gp_par.log_name, gp_par)
+
+        if gp_par.plot:
+            logplot.plot_fitness(gp_par.log_name, self.best_fitness, self.n_episodes)
+        if gp_par.fig_best:
+            environment.plot_individual(logplot.get_log_folder(gp_par.log_name), 'best individual', best)
+        if gp_par.fig_last_gen:
+            for i in range(gp_par.n_population):
+                environment.plot_individual(logplot.get_log_folder(gp_par.log_name), 'individual_' + str(i), \
+                                            self.population[i])
+
+        self.result = (self.population, self.fitness, self.best_fitness, best)
+        return self.result
+
+    def close(self):
+        """ Stops the worker processes and the background writer of a pipelined run """
+        if self.executor is not None:
+            #Evaluations not started yet are dropped instead of waited for
+            for future in self.futures:
+                future.cancel()
+            self.futures.clear()
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.writer is not None:
+            writer = self.writer
+            self.writer = None
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def resume(environment, gp_par, baseline=None, migration=None):
+    """
+    Resumes the run logged as gp_par.log_name from its last checkpoint.
+    The resumed run continues exactly as if it had never been interrupted
+    """
+    return run(environment, gp_par, baseline=baseline, migration=migration, \
+               checkpoint=logplot.get_checkpoint(gp_par.log_name))
+
+def run(environment, gp_par, hotstart=False, hotstart_population=None, baseline=None, migration=None, checkpoint=None):
+    """
+    Runs the genetic algorithm, see GpEngine
+    """
+    with GpEngine(environment, gp_par, hotstart, hotstart_population, baseline, migration, checkpoint) as engine:
+        for _ in engine.generations():
+            pass
+        return engine.finish()
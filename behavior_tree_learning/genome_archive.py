@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Compressed archive of every evaluated genome
+"""
+import heapq
+from array import array
+
+from hash_table import FitnessStats
+
+class GenomeArchive:
+    """
+    Subtree DAG over interned genes holding every evaluated genome and its fitness statistics.
+    Subtrees are hash-consed, so subtrees shared between genomes (e.g. parents and offspring)
+    are stored only once and a mutation only adds the nodes on the path to the mutated gene.
+    All nodes, the node index and the statistics live in flat typed arrays,
+    there is no Python object per genome or per node.
+    """
+    def __init__(self):
+        self.genes = []                     # gene id -> gene string
+        self.gene_ids = {}                  # gene string -> gene id
+        self.leaves = []                    # gene id -> leaf node of the gene, -1 if not created yet
+        self.code = array('i')              # node -> gene id * 2 + 1 if never closed, -1 for the top level of a genome
+        self.first = array('i')             # node -> offset of its children in self.children
+        self.n_children = array('i')        # node -> number of children
+        self.children = array('i')          # children of all nodes
+        self.slot = array('i')              # node -> index in the statistics arrays, -1 if not a genome
+        self.index = array('i', [-1]) * 1024  # open addressing table of nodes
+        self.node = array('i')              # statistics index -> node of the genome
+        self.count = array('i')
+        self.mean = array('d')
+        self.m2 = array('d')
+        self.min = array('d')
+        self.max = array('d')
+        self.n_values = 0
+
+    def __len__(self):
+        return len(self.node)
+
+    def __contains__(self, genome):
+        return self.find_node(genome) is not None
+
+    def lookup(self, code, children, insert):
+        """
+        Returns the node with the given code and list of children,
+        None if there is none and insert is False
+        """
+        mask = len(self.index) - 1
+        i = hash((code, *children)) & mask
+        n_children = len(children)
+        while self.index[i] >= 0:
+            node = self.index[i]
+            if self.code[node] == code and self.n_children[node] == n_children and \
+               self.children[self.first[node]:self.first[node] + n_children].tolist() == children:
+                return node
+            i = (i + 1) & mask
+        if not insert:
+            return None
+
+        node = len(self.code)
+        self.code.append(code)
+        self.first.append(len(self.children))
+        self.n_children.append(n_children)
+        self.children.extend(children)
+        self.slot.append(-1)
+        self.index[i] = node
+        if 2 * len(self.code) > len(self.index):
+            self.grow_index()
+        return node
+
+    def grow_index(self):
+        """ Doubles the size of the node index """
+        self.index = array('i', [-1]) * (2 * len(self.index))
+        mask = len(self.index) - 1
+        for node, code in enumerate(self.code):
+            i = hash((code, *self.children[self.first[node]:self.first[node] + self.n_children[node]])) & mask
+            while self.index[i] >= 0:
+                i = (i + 1) & mask
+            self.index[i] = node
+
+    def encode(self, genome, insert):
+        """
+        Returns the node of genome, None if not in the archive and insert is False.
+        Genes ending with '(' open a subtree that is closed by the next ')' at the same level,
+        a ')' with no open subtree is kept as a leaf so that every list of genes round trips.
+        """
+        stack = [[]]
+        codes = [-1]
+        for gene in genome:
+            if gene == ')' and len(stack) > 1:
+                node = self.lookup(codes.pop(), stack.pop(), insert)
+                if node is None:
+                    return None
+                stack[-1].append(node)
+                continue
+
+            index = self.gene_ids.get(gene)
+            if index is None:
+                if not insert:
+                    return None
+                index = len(self.genes)
+                self.genes.append(gene)
+                self.gene_ids[gene] = index
+                self.leaves.append(-1)
+            if gene.endswith('('):
+                stack.append([])
+                codes.append(index * 2)
+            else:
+                node = self.leaves[index]
+                if node < 0:
+                    node = self.lookup(index * 2, [], insert)
+                    if node is None:
+                        return None
+                    self.leaves[index] = node
+                stack[-1].append(node)
+
+        while len(stack) > 1:
+            #Subtrees that are never closed
+            node = self.lookup(codes.pop() + 1, stack.pop(), insert)
+            if node is None:
+                return None
+            stack[-1].append(node)
+        return self.lookup(-1, stack[0], insert)
+
+    def find_node(self, genome):
+        """ Returns the node of genome or None if it has not been archived """
+        node = self.encode(genome, False)
+        if node is None or self.slot[node] < 0:
+            return None
+        return node
+
+    def add_slot(self, genome):
+        """ Returns the statistics index of genome, added with no values if not archived """
+        node = self.encode(genome, True)
+        i = self.slot[node]
+        if i < 0:
+            i = len(self.node)
+            self.slot[node] = i
+            self.node.append(node)
+            self.count.append(0)
+            self.mean.append(0.0)
+            self.m2.append(0.0)
+            self.min.append(float('inf'))
+            self.max.append(-float('inf'))
+        return i
+
+    def insert(self, genome, value):
+        """
+        Adds a fitness value of genome to the archive
+        """
+        i = self.add_slot(genome)
+
+        #Welford's update, as in FitnessStats
+        self.count[i] += 1
+        delta = value - self.mean[i]
+        self.mean[i] += delta / self.count[i]
+        self.m2[i] += delta * (value - self.mean[i])
+        self.min[i] = min(self.min[i], value)
+        self.max[i] = max(self.max[i], value)
+        self.n_values += 1
+
+    def merge(self, genome, stats):
+        """
+        Adds the fitness statistics of several values of genome to the archive, as FitnessStats.merge
+        """
+        if stats.count == 0:
+            return
+        i = self.add_slot(genome)
+        count = self.count[i] + stats.count
+        delta = stats.mean - self.mean[i]
+        self.mean[i] += delta * stats.count / count
+        self.m2[i] += stats.m2 + delta**2 * self.count[i] * stats.count / count
+        self.count[i] = count
+        self.min[i] = min(self.min[i], stats.min)
+        self.max[i] = max(self.max[i], stats.max)
+        self.n_values += stats.count
+
+    def find(self, genome):
+        """
+        Returns the fitness statistics of genome or None if it has not been archived
+        """
+        node = self.find_node(genome)
+        if node is None:
+            return None
+        return self.stats(self.slot[node])
+
+    def stats(self, i):
+        """ Returns the statistics at index i as FitnessStats """
+        stats = FitnessStats()
+        stats.count = self.count[i]
+        stats.mean = self.mean[i]
+        stats.m2 = self.m2[i]
+        stats.min = self.min[i]
+        stats.max = self.max[i]
+        return stats
+
+    def genome(self, node, genome=None):
+        """ Reconstructs the genome of the given node """
+        if genome is None:
+            genome = []
+        code = self.code[node]
+        if code >= 0:
+            genome.append(self.genes[code >> 1])
+        for i in range(self.first[node], self.first[node] + self.n_children[node]):
+            self.genome(self.children[i], genome)
+        if code >= 0 and not code & 1 and self.genes[code >> 1].endswith('('):
+            genome.append(')')
+        return genome
+
+    def best(self, k=1):
+        """
+        Returns the k genomes with highest mean fitness as a list of (mean fitness, genome)
+        """
+        best = heapq.nlargest(k, range(len(self.node)), key=self.mean.__getitem__)
+        return [(self.mean[i], self.genome(self.node[i])) for i in best]
+
+    def n_nodes(self):
+        """ Returns the number of dag nodes """
+        return len(self.code)
+
+    def hash_table_listener(self, key, value, _entry):
+        """ Listener for HashTable.add_listener archiving every inserted fitness value """
+        if isinstance(value, FitnessStats):
+            self.merge(key, value)
+        else:
+            self.insert(key, value)
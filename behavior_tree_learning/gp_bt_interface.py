@@ -5,14 +5,14 @@ Provides an interface between a GP algorithm and behavior tree functions
 import random
 import behavior_tree as behavior_tree
 
-def random_genome(length):
+def random_genome(length, nodes=None):
     """
-    Returns a random genome
+    Returns a random genome made of the allowed nodes of nodes, see behavior_tree.BT
     """
-    bt = behavior_tree.BT([])
+    bt = behavior_tree.BT([], nodes)
     return bt.random(length)
 
-def mutate_gene(genome, p_add, p_delete):
+def mutate_gene(genome, p_add, p_delete, nodes=None):
     """
     Mutate only a single gene.
     """
@@ -23,7 +23,7 @@ def mutate_gene(genome, p_add, p_delete):
     if p_add + p_delete > 1:
         raise Exception("Sum of the mutation probabilities must be less than 1.")
 
-    mutated_individual = behavior_tree.BT([])
+    mutated_individual = behavior_tree.BT([], nodes)
     max_attempts = 100
     attempts = 0
     while (not mutated_individual.is_valid() or mutated_individual.bt == genome) and attempts < max_attempts:
@@ -48,18 +48,18 @@ def mutate_gene(genome, p_add, p_delete):
         attempts += 1
 
     if attempts >= max_attempts and (not mutated_individual.is_valid() or mutated_individual.bt == genome):
-        mutated_individual = behavior_tree.BT([])
+        mutated_individual = behavior_tree.BT([], nodes)
 
     return mutated_individual.bt
 
-def crossover_genome(genome1, genome2):
+def crossover_genome(genome1, genome2, nodes=None):
     """
     Do crossover between genomes at random points
     """
-    bt1 = behavior_tree.BT(genome1)
-    bt2 = behavior_tree.BT(genome2)
-    offspring1 = behavior_tree.BT([])
-    offspring2 = behavior_tree.BT([])
+    bt1 = behavior_tree.BT(genome1, nodes)
+    bt2 = behavior_tree.BT(genome2, nodes)
+    offspring1 = behavior_tree.BT([], nodes)
+    offspring2 = behavior_tree.BT([], nodes)
 
     if bt1.is_valid() and bt2.is_valid():
         max_attempts = 100
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Hall of fame of the best genomes of a whole run
+"""
+import heapq
+
+class HallOfFame:
+    """
+    Bounded collection of the best genomes seen during a run.
+    A min-heap on fitness keeps the worst member on top, so that an update costs O(log k).
+    Updating a member pushes a new heap entry, the outdated one is skipped when it reaches the top.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.heap = []              # (fitness, counter, genome)
+        self.members = {}           # genome -> (fitness, counter) of its valid heap entry
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, genome):
+        return tuple(genome) in self.members
+
+    def push(self, key, fitness):
+        """ Pushes a valid heap entry for key """
+        self.counter += 1
+        self.members[key] = (fitness, self.counter)
+        heapq.heappush(self.heap, (fitness, self.counter, key))
+        if len(self.heap) > 2 * self.size + 16:
+            #Too many outdated entries, rebuild the heap from the members
+            self.heap = [(f, c, k) for k, (f, c) in self.members.items()]
+            heapq.heapify(self.heap)
+
+    def pop_outdated(self):
+        """ Removes outdated entries from the top of the heap """
+        while self.heap and self.members.get(self.heap[0][2]) != self.heap[0][:2]:
+            heapq.heappop(self.heap)
+
+    def worst(self):
+        """ Returns the lowest fitness in the hall of fame """
+        self.pop_outdated()
+        return self.heap[0][0]
+
+    def update(self, genome, fitness):
+        """
+        Updates the hall of fame with the (possibly new) fitness of genome
+        """
+        if self.size <= 0:
+            return
+        key = tuple(genome)
+        if key in self.members:
+            if self.members[key][0] != fitness:
+                self.push(key, fitness)
+        elif len(self.members) < self.size:
+            self.push(key, fitness)
+        elif fitness > self.worst():
+            del self.members[heapq.heappop(self.heap)[2]]
+            self.push(key, fitness)
+
+    def best(self, n=None):
+        """
+        Returns the n best genomes, all if n is None, as a list of (fitness, genome)
+        sorted by decreasing fitness
+        """
+        best = sorted(((f, c, k) for k, (f, c) in self.members.items()), key=lambda x: (-x[0], x[1]))
+        return [(f, list(k)) for f, _, k in best[:n]]
+
+    def genomes(self, n=None):
+        """ Returns the n best genomes, e.g. for reseeding a population """
+        return [genome for _, genome in self.best(n)]
+
+    def hash_table_listener(self, key, _value, entry):
+        """ Listener for HashTable.add_listener feeding the hall of fame with every evaluation """
+        self.update(key, entry.mean)
@@ -3,24 +3,162 @@
 """
 Hash table with linked list for entries with same hash
 """
+import os
 import hashlib
 import ast
+import math
+import random
+from dataclasses import dataclass, asdict
 
 import logplot as logplot
 
+@dataclass
+class CacheCounters:
+    """ Data class for the accounting of fitness lookups and evaluations """
+    lookups: int = 0                # Calls to find, i.e. fitness evaluations that may hit the cache
+    hits: int = 0                   # Lookups that found an entry
+    misses: int = 0                 # Lookups that did not find an entry
+    reruns: int = 0                 # Inserts to an entry that already had values
+    inserts: int = 0                # Inserted fitness values, i.e. evaluated episodes
+    eval_time: float = 0.0          # Total wall time of the evaluations [s]
+
+    def __sub__(self, other):
+        return CacheCounters(*[x - y for x, y in zip(asdict(self).values(), asdict(other).values())])
+
+class FitnessStats:
+    """
+    Constant-size running statistics of the fitness samples of one genome.
+    Mean and variance are updated with Welford's method, an optional
+    bounded reservoir keeps a uniform sample of the raw values.
+    """
+    def __init__(self, reservoir_size=0):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float('inf')
+        self.max = -float('inf')
+        self.reservoir_size = reservoir_size
+        self.samples = []
+
+    def __eq__(self, other):
+        if not isinstance(other, FitnessStats):
+            return False
+        return self.count == other.count and self.mean == other.mean and self.m2 == other.m2 and \
+               self.min == other.min and self.max == other.max and self.samples == other.samples
+
+    def add(self, value, rng=random):
+        """
+        Adds a fitness sample
+        rng is only used for reservoir sampling once the reservoir is full
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        if len(self.samples) < self.reservoir_size:
+            self.samples.append(value)
+        elif self.reservoir_size > 0:
+            index = rng.randrange(self.count)
+            if index < self.reservoir_size:
+                self.samples[index] = value
+
+    def merge(self, other, rng=random):
+        """
+        Merges the statistics of another set of samples into these ones
+        (pairwise combination of Chan et al.)
+        rng is only used for merging the reservoirs once they do not fit in one
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean
+            self.m2 = other.m2
+            self.min = other.min
+            self.max = other.max
+            self.samples = other.samples[:]
+            if len(self.samples) > self.reservoir_size:
+                self.samples = rng.sample(self.samples, self.reservoir_size)
+            return
+        self.samples = self.merge_samples(other, rng)
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def merge_samples(self, other, rng):
+        """
+        Returns a uniform sample of the values of both reservoirs. The number of samples taken from each one
+        is drawn as if the slots were filled one by one from all the values, without replacement
+        """
+        if len(self.samples) + len(other.samples) <= self.reservoir_size:
+            return self.samples + other.samples
+        own_count = self.count
+        other_count = other.count
+        n_own = 0
+        for _ in range(self.reservoir_size):
+            if rng.random() * (own_count + other_count) < own_count:
+                own_count -= 1
+                n_own += 1
+            else:
+                other_count -= 1
+        #A reservoir can hold fewer samples than drawn, e.g. one of a cache written with a smaller
+        #reservoir size, the other one then fills the remaining slots
+        n_own = min(n_own, len(self.samples))
+        n_other = min(self.reservoir_size - n_own, len(other.samples))
+        n_own = min(self.reservoir_size - n_other, len(self.samples))
+        return rng.sample(self.samples, n_own) + rng.sample(other.samples, n_other)
+
+    @property
+    def variance(self):
+        """ Sample variance of the fitness values """
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """ Sample standard deviation of the fitness values """
+        return math.sqrt(self.variance)
+
+    def as_dict(self):
+        """ Returns the statistics as a dictionary of plain values """
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2,
+                'min': self.min, 'max': self.max, 'samples': self.samples}
+
+    @classmethod
+    def from_dict(cls, values, reservoir_size=0):
+        """ Creates statistics from a dictionary written by as_dict """
+        stats = cls(reservoir_size)
+        stats.count = values['count']
+        stats.mean = values['mean']
+        stats.m2 = values['m2']
+        stats.min = values['min']
+        stats.max = values['max']
+        stats.samples = values['samples'][:reservoir_size]
+        return stats
+
 class Node:
     """
     Node data structure - essentially a LinkedList node
+    The namespace tags the configuration the value was computed with
     """
-    def __init__(self, key, value):
+    def __init__(self, key, value, namespace=''):
         self.key = key
-        self.value = [value]
+        self.value = value
+        self.namespace = namespace
         self.next = None
 
     def __eq__(self, other):
         if not isinstance(other, Node):
             return False
-        equal = self.key == other.key and self.value == other.value
+        equal = self.key == other.key and self.value == other.value and self.namespace == other.namespace
         if equal:
             if self.next is not None or other.next is not None:
                 if self.next is None or other.next is None:
@@ -33,14 +171,25 @@ class HashTable:
     """
     Main hash table class
     """
-    def __init__(self, size=100000, log_name='1'):
+    def __init__(self, size=100000, log_name='1', reservoir_size=0, namespace=''):
         """
         Initialize hash table to fixed size
+        reservoir_size is the number of raw fitness samples kept per entry
+        namespace is the fingerprint of the environment, only entries with
+        the same namespace are found
         """
         self.size = size
         self.buckets = [None]*self.size
         self.n_values = 0
         self.log_name = log_name
+        self.reservoir_size = reservoir_size
+        self.namespace = namespace
+        self.n_entries = 0
+        self.counters = CacheCounters()
+        self.generation_start = CacheCounters()
+        self.listeners = []
+        #Separate generator so that reservoir sampling does not disturb the seeded global one
+        self.rng = random.Random(0)
 
     def __eq__(self, other):
         if not isinstance(other, HashTable):
@@ -66,69 +215,197 @@ class HashTable:
         hashcode = int(hashcode, 16)
         return hashcode % self.size
 
-    def insert(self, key, value):
+    def insert(self, key, value, eval_time=0.0, namespace=None):
         """
         Insert a key - value pair to the hashtable
         Input:  key - string
-                value - anything
+                value - fitness value
+                eval_time - wall time spent computing value
+                namespace - namespace of the entry, e.g. of a lower fidelity environment,
+                            the table namespace if None
+        Output: running statistics stored under "key"
+        """
+        if namespace is None:
+            namespace = self.namespace
+        node = self.get_node(key, namespace)
+        if node.value.count > 0:
+            self.counters.reruns += 1
+        node.value.add(value, self.rng)
+        self.n_values += 1
+        self.counters.inserts += 1
+        self.counters.eval_time += eval_time
+        if namespace == self.namespace:
+            for listener in self.listeners:
+                listener(key, value, node.value)
+        return node.value
+
+    def add_listener(self, listener, replay=True):
+        """
+        Adds a function called as listener(key, value, entry) after every insert
+        in the table namespace. value is the fitness of the inserted episode, or the FitnessStats
+        of several episodes merged at once by insert_stats.
+        If replay, the entries already in the table namespace are passed to the listener
+        as merged statistics, e.g. those of a loaded cache
+        """
+        self.listeners.append(listener)
+        if replay:
+            for key, entry in self.items():
+                listener(key, entry, entry)
+
+    def get_node(self, key, namespace):
+        """
+        Returns the node of key, appending an empty one to the bucket if not found
         """
         index = self.hash(key)
         node = self.buckets[index]
         if node is None:
-            self.buckets[index] = Node(key, value)
+            node = Node(key, FitnessStats(self.reservoir_size), namespace)
+            self.buckets[index] = node
+            self.n_entries += 1
         else:
-            done = False
-            while not done:
-                if node.key == key:
-                    node.value.append(value)
-                    done = True
-                elif node.next is None:
-                    node.next = Node(key, value)
-                    done = True
-                else:
-                    node = node.next
-        self.n_values += 1
+            while node.key != key or node.namespace != namespace:
+                if node.next is None:
+                    node.next = Node(key, FitnessStats(self.reservoir_size), namespace)
+                    self.n_entries += 1
+                node = node.next
+        return node
 
-    def find(self, key):
+    def find(self, key, namespace=None):
         """
         Find a data value based on key
         Input:  key - string
-        Output: value stored under "key" or None if not found
+                namespace - namespace of the entry, the table namespace if None
+        Output: running statistics stored under "key" or None if not found
+        """
+        entry = self.peek(key, namespace)
+        self.counters.lookups += 1
+        if entry is None:
+            self.counters.misses += 1
+        else:
+            self.counters.hits += 1
+        return entry
+
+    def peek(self, key, namespace=None):
         """
+        Same as find, but not counted as a lookup in the cache statistics,
+        for queries of the algorithm that do not stand for a fitness evaluation
+        """
+        if namespace is None:
+            namespace = self.namespace
         index = self.hash(key)
         node = self.buckets[index]
-        while node is not None and node.key != key:
+        while node is not None and (node.key != key or node.namespace != namespace):
             node = node.next
+        return None if node is None else node.value
 
-        if node is None:
-            return None
-        return node.value
+    def new_generation(self):
+        """
+        Starts the accounting of a new generation
+        """
+        self.generation_start = CacheCounters(**asdict(self.counters))
+
+    def generation_stats(self):
+        """
+        Returns the counters accumulated since the last call to new_generation
+        together with the mean evaluation time and the number of entries
+        """
+        stats = asdict(self.counters - self.generation_start)
+        stats['mean_eval_time'] = stats['eval_time'] / stats['inserts'] if stats['inserts'] > 0 else 0.0
+        stats['n_entries'] = self.n_entries
+        return stats
 
-    def load(self):
+    def load(self, path=None):
         """
         Loads hash table information.
+        Entries logged without namespace are kept under the empty namespace.
         """
-        with open(logplot.get_log_folder(self.log_name) + '/hash_log.txt', 'r') as f:
+        if path is None:
+            path = logplot.get_log_folder(self.log_name) + '/hash_log.txt'
+        with open(path, 'r') as f:
             lines = f.read().splitlines()
 
             for i in range(0, len(lines)):
                 individual = lines[i]
                 individual = individual[5:].split(", value: ")
                 key = ast.literal_eval(individual[0])
-                individual = individual[1].split(", count: ")
-                values = individual[0][1:-1].split(", ") #Remove brackets and split multiples
-                for value in values:
-                    self.insert(key, float(value))
+                individual = individual[1].rsplit(", namespace: ", 1)
+                namespace = individual[1] if len(individual) > 1 else ''
+                individual = individual[0].rsplit(", count: ", 1)
+                if individual[0].startswith('{'):
+                    stats = FitnessStats.from_dict(ast.literal_eval(individual[0]), self.reservoir_size)
+                else:
+                    #Old format with the full list of values
+                    stats = FitnessStats(self.reservoir_size)
+                    values = individual[0][1:-1].split(", ") #Remove brackets and split multiples
+                    for value in values:
+                        stats.add(float(value), self.rng)
+                self.insert_stats(key, stats, namespace)
+
+    def load_cache(self):
+        """
+        Warm starts the table from the fitness cache shared by all runs
+        with the same namespace. Cached values do not count as episodes of this run.
+        """
+        path = logplot.get_cache_file(self.namespace)
+        if self.namespace == '' or not os.path.isfile(path):
+            return
+        n_values = self.n_values
+        self.load(path)
+        self.n_values = n_values
+
+    def write_cache(self):
+        """
+        Writes the entries of the table namespace to the shared fitness cache
+        """
+        if self.namespace == '':
+            return
+        if not os.path.isdir(logplot.get_cache_folder()):
+            logplot.make_directory(logplot.get_cache_folder())
+        path = logplot.get_cache_file(self.namespace)
+        #Write to a temporary file first so that concurrent runs never read a partial cache
+        self.write_table(path + '.' + str(os.getpid()), self.namespace)
+        os.replace(path + '.' + str(os.getpid()), path)
+
+    def insert_stats(self, key, stats, namespace=None):
+        """
+        Merges previously computed statistics into the entry for key
+        """
+        if namespace is None:
+            namespace = self.namespace
+        node = self.get_node(key, namespace)
+        node.value.merge(stats, self.rng)
+        self.n_values += stats.count
+        if namespace == self.namespace and stats.count > 0:
+            for listener in self.listeners:
+                listener(key, stats, node.value)
+
+    def items(self, namespace=None):
+        """
+        Iterates over (key, running statistics) of the entries of namespace,
+        the table namespace if None
+        """
+        if namespace is None:
+            namespace = self.namespace
+        for node in filter(lambda x: x is not None, self.buckets):
+            while node is not None:
+                if node.namespace == namespace:
+                    yield node.key, node.value
+                node = node.next
 
-    def write_table(self):
+    def write_table(self, path=None, namespace=None):
         """
         Writes table contents to a file
+        If namespace is given, only entries of that namespace are written
         """
-        with open(logplot.get_log_folder(self.log_name) + '/hash_log.txt', "w") as f:
+        if path is None:
+            path = logplot.get_log_folder(self.log_name) + '/hash_log.txt'
+        with open(path, "w") as f:
             for node in filter(lambda x: x is not None, self.buckets):
                 while node is not None:
-                    f.writelines("key: " + str(node.key) + \
-                                 ", value: " + str(node.value) + \
-                                 ", count: " + str(len(node.value)) + "\n")
+                    if namespace is None or node.namespace == namespace:
+                        f.writelines("key: " + str(node.key) + \
+                                     ", value: " + str(node.value.as_dict()) + \
+                                     ", count: " + str(node.value.count) + \
+                                     ", namespace: " + node.namespace + "\n")
                     node = node.next
         f.close()
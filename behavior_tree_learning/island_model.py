@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Island model for the genetic programming algorithm.
+Several populations evolve in separate processes and periodically exchange their elites.
+"""
+import queue
+import multiprocessing
+from copy import copy
+from enum import Enum, auto
+from dataclasses import dataclass
+
+import genetic_programming as gp
+
+class Topology(Enum):
+    """ Enum class for migration topologies """
+    RING = auto()                   # Island i sends its elites to island i + 1
+    FULLY_CONNECTED = auto()        # Every island sends its elites to all the others
+
+@dataclass
+class IslandParameters:
+    """ Data class for parameters for the island model """
+    n_islands: int = 4                          #Number of islands, i.e. of worker processes
+    migration_interval: int = 10                #Generations between migrations
+    n_migrants: int = 2                         #Number of elites sent to every neighbour at each migration
+    topology: Topology = Topology.RING          #Which islands exchange elites
+    migration_timeout: float = 600              #Seconds an island waits for the elites of another one before going on
+
+def destinations(island, island_par):
+    """
+    Returns the indices of the islands receiving the elites of island
+    """
+    if island_par.n_islands <= 1:
+        return []
+    if island_par.topology == Topology.RING:
+        return [(island + 1) % island_par.n_islands]
+    if island_par.topology == Topology.FULLY_CONNECTED:
+        return [i for i in range(island_par.n_islands) if i != island]
+    raise Exception('Invalid topology')
+
+class Migration:
+    """
+    Migration function for genetic_programming.run exchanging elites through queues.
+    Migrations are synchronous, every island waits for the elites of all its sources.
+    Messages are (source, generation, elites), early ones are kept until their migration.
+    An island that stops sends (source, None, None) so that its destinations stop waiting for it,
+    and a source that sends nothing for island_par.migration_timeout seconds is skipped.
+    """
+    def __init__(self, island, island_par, inbox, outboxes, sources, last_generation, rerun):
+        self.island = island
+        self.island_par = island_par
+        self.inbox = inbox
+        self.outboxes = outboxes
+        self.sources = set(sources)
+        self.last_generation = last_generation
+        self.rerun = rerun
+        self.pending = {}               # (source, generation) -> elites received early
+
+    def __call__(self, generation, population, fitness, hash_table, environment, engine=None):
+        if generation % self.island_par.migration_interval != 0 or generation >= self.last_generation:
+            return population, fitness
+
+        elites = gp.elite_selection(range(len(population)), fitness, self.island_par.n_migrants)
+        for outbox in self.outboxes:
+            outbox.put((self.island, generation, [population[i] for i in elites]))
+
+        immigrants = []
+        for migrants in self.receive(generation):
+            for individual in migrants:
+                if individual not in population and individual not in immigrants:
+                    immigrants.append(individual)
+
+        #Immigrants replace the worst individuals
+        population = population[:]
+        fitness = fitness[:]
+        worst = sorted(range(len(population)), key=fitness.__getitem__)
+        for i, individual in zip(worst, immigrants):
+            population[i] = individual
+            fitness[i] = gp.get_fitness(individual, hash_table, environment, self.rerun, engine)
+        return population, fitness
+
+    def receive(self, generation):
+        """
+        Returns the elites of the sources still running for the migration of generation
+        """
+        received = []
+        waiting = set(self.sources)
+        for source in list(waiting):
+            if (source, generation) in self.pending:
+                received.append(self.pending.pop((source, generation)))
+                waiting.remove(source)
+        while waiting:
+            try:
+                source, source_generation, elites = self.inbox.get(timeout=self.island_par.migration_timeout)
+            except queue.Empty:
+                print("Island ", self.island, ": no elites from islands ", sorted(waiting), ", migrating without them")
+                break
+            if source_generation is None:
+                self.sources.discard(source)
+                waiting.discard(source)
+            elif source_generation == generation and source in waiting:
+                received.append(elites)
+                waiting.remove(source)
+            elif source_generation > generation:
+                self.pending[(source, source_generation)] = elites
+        return received
+
+    def close(self):
+        """ Tells the destinations that this island has stopped """
+        for outbox in self.outboxes:
+            outbox.put((self.island, None, None))
+
+def island_worker(island, environment, gp_par, seed, migration, results):
+    """
+    Evolves one island in its own process
+    """
+    try:
+        gp.set_seeds(seed)
+        results.put((island, gp.run(environment, gp_par, migration=migration)))
+    finally:
+        migration.close()
+
+def run_islands(environment, gp_pars, seeds, island_par):
+    """
+    Runs the island model.
+    gp_pars is a list with the GpParameters of each island, or a single GpParameters
+    used by all islands with the island index appended to the log name.
+    seeds is the list of random seeds of the islands.
+    Returns the results of genetic_programming.run for every island.
+    Raises RuntimeError, after stopping the other islands, if an island fails
+    """
+    if isinstance(gp_pars, gp.GpParameters):
+        single = gp_pars
+        gp_pars = []
+        for i in range(island_par.n_islands):
+            gp_pars.append(copy(single))
+            gp_pars[i].log_name = single.log_name + '_island' + str(i)
+    if len(gp_pars) != island_par.n_islands or len(seeds) != island_par.n_islands:
+        raise ValueError("One set of parameters and one seed per island is needed")
+
+    #No migration at the last generation, nobody would receive the elites.
+    #Islands stopping earlier, e.g. on a stopping criterion, tell the others when they exit
+    last_generation = min(gp_par.n_generations for gp_par in gp_pars)
+
+    inboxes = [multiprocessing.Queue() for _ in range(island_par.n_islands)]
+    sources = [[] for _ in range(island_par.n_islands)]
+    for i in range(island_par.n_islands):
+        for j in destinations(i, island_par):
+            sources[j].append(i)
+    results = multiprocessing.Queue()
+
+    workers = []
+    for i in range(island_par.n_islands):
+        migration = Migration(i, island_par, inboxes[i], [inboxes[j] for j in destinations(i, island_par)],
+                              sources[i], last_generation, gp_pars[i].rerun_fitness)
+        worker = multiprocessing.Process(target=island_worker,
+                                         args=(i, environment, gp_pars[i], seeds[i], migration, results))
+        worker.start()
+        workers.append(worker)
+
+    island_results = [None] * island_par.n_islands
+    n_results = 0
+    while n_results < island_par.n_islands:
+        try:
+            island, result = results.get(timeout=1.0)
+        except queue.Empty:
+            #A worker that exits normally has put its result, which is still on its way
+            failed = [i for i, worker in enumerate(workers) if worker.exitcode not in (None, 0)]
+            if failed:
+                for worker in workers:
+                    worker.terminate()
+                    worker.join()
+                raise RuntimeError("Island " + str(failed[0]) + " failed with exit code " + \
+                                   str(workers[failed[0]].exitcode))
+            continue
+        island_results[island] = result
+        n_results += 1
+
+    #Islands may have sent elites to islands that had already stopped. Nobody reads them any more,
+    #so the queues are emptied for the senders to flush them and exit
+    while any(worker.is_alive() for worker in workers):
+        for inbox in inboxes:
+            try:
+                while True:
+                    inbox.get_nowait()
+            except queue.Empty:
+                pass
+        for worker in workers:
+            worker.join(timeout=0.1)
+
+    return island_results
@@ -12,6 +12,8 @@ sys.path.insert(1, parent_dir)
 
 import shutil
 import pickle
+import queue
+import threading
 from dataclasses import dataclass
 import numpy as np
 import matplotlib.pyplot as plt
@@ -49,6 +51,14 @@ def get_log_folder(log_name):
     """ Returns log folder as string """
     return parent_dir + '/logs/log_' + log_name
 
+def get_cache_folder():
+    """ Returns the folder of the fitness caches shared between runs """
+    return parent_dir + '/logs/cache'
+
+def get_cache_file(namespace):
+    """ Returns the fitness cache file of the given namespace """
+    return get_cache_folder() + '/hash_log_' + namespace + '.txt'
+
 def clear_logs(log_name):
     """ Clears previous log folders of same same """
 
@@ -64,6 +74,49 @@ def clear_logs(log_name):
     open(fitness_log_path, "x")
     open(population_log_path, "x")
 
+class BackgroundWriter:
+    """
+    Calls log functions in a background thread, in the order they are submitted,
+    so that writing logs stays off the critical path of a run
+    """
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        """ Runs the submitted log functions until closed """
+        while True:
+            function, args = self.queue.get()
+            try:
+                if function is None:
+                    break
+                function(*args)
+            except Exception as error: # pylint: disable=broad-except
+                if self.error is None:
+                    self.error = error
+            finally:
+                self.queue.task_done()
+
+    def submit(self, function, *args):
+        """ Schedules function(*args), the arguments must not be modified afterwards """
+        self.queue.put((function, args))
+
+    def flush(self):
+        """ Waits until all submitted functions have run, raising the first error if any """
+        self.queue.join()
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def close(self):
+        """ Flushes and stops the background thread """
+        self.flush()
+        self.queue.put((None, None))
+        self.thread.join()
+
 def log_best_individual(log_name, best_individual):
     """ Saves the best individual """
     with open_file(get_log_folder(log_name) + '/best_individual.pickle', 'wb') as f:
@@ -84,6 +137,47 @@ def log_n_episodes(log_name, n_episodes):
     with open_file(get_log_folder(log_name) + '/n_episodes_log.pickle', 'wb') as f:
         pickle.dump(n_episodes, f)
 
+def log_cache_stats(log_name, cache_stats):
+    """ Logs the fitness lookup and evaluation counters of each generation """
+    with open_file(get_log_folder(log_name) + '/cache_stats_log.pickle', 'wb') as f:
+        pickle.dump(cache_stats, f)
+
+def log_surrogate_stats(log_name, surrogate_stats):
+    """ Saves the per generation surrogate statistics as a list of dicts """
+    with open_file(get_log_folder(log_name) + '/surrogate_log.pickle', 'wb') as f:
+        pickle.dump(surrogate_stats, f)
+
+def log_archive(log_name, archive):
+    """ Saves the archive of all evaluated genomes """
+    with open_file(get_log_folder(log_name) + '/archive.pickle', 'wb') as f:
+        pickle.dump(archive, f)
+
+def log_hall_of_fame(log_name, hall_of_fame):
+    """ Saves the best genomes of the run as a list of (fitness, genome) """
+    with open_file(get_log_folder(log_name) + '/hall_of_fame.pickle', 'wb') as f:
+        pickle.dump(hall_of_fame, f)
+
+def log_checkpoint(log_name, checkpoint):
+    """
+    Saves the complete state of a run.
+    Written to a temporary file first so that an interrupted write never corrupts the last checkpoint
+    """
+    path = get_log_folder(log_name) + '/checkpoint.pickle'
+    with open_file(path + '.tmp', 'wb') as f:
+        pickle.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+def get_text_log_sizes(log_name):
+    """ Returns the sizes of the text logs that are appended to every generation """
+    log_folder = get_log_folder(log_name)
+    return {name: os.path.getsize(log_folder + '/' + name) for name in ['fitness_log.txt', 'population_log.txt']}
+
+def truncate_text_logs(log_name, sizes):
+    """ Truncates the text logs to the given sizes, dropping generations logged after a checkpoint """
+    for name, size in sizes.items():
+        with open_file(get_log_folder(log_name) + '/' + name, 'r+') as f:
+            f.truncate(size)
+
 def log_population(log_name, population):
     """ Logs full population of the generation"""
     with open_file(get_log_folder(log_name) + '/population_log.txt', 'a') as f:
@@ -107,6 +201,36 @@ def get_n_episodes(log_name):
         n_episodes = pickle.load(f)
     return n_episodes
 
+def get_cache_stats(log_name):
+    """ Gets the list of fitness lookup and evaluation counters from the given log """
+    with open_file(get_log_folder(log_name) + '/cache_stats_log.pickle', 'rb') as f:
+        cache_stats = pickle.load(f)
+    return cache_stats
+
+def get_surrogate_stats(log_name):
+    """ Gets the per generation surrogate statistics from the given log """
+    with open_file(get_log_folder(log_name) + '/surrogate_log.pickle', 'rb') as f:
+        surrogate_stats = pickle.load(f)
+    return surrogate_stats
+
+def get_archive(log_name):
+    """ Gets the archive of all evaluated genomes from the given log """
+    with open_file(get_log_folder(log_name) + '/archive.pickle', 'rb') as f:
+        archive = pickle.load(f)
+    return archive
+
+def get_hall_of_fame(log_name):
+    """ Gets the best genomes of the run from the given log as a list of (fitness, genome) """
+    with open_file(get_log_folder(log_name) + '/hall_of_fame.pickle', 'rb') as f:
+        hall_of_fame = pickle.load(f)
+    return hall_of_fame
+
+def get_checkpoint(log_name):
+    """ Gets the last checkpoint of the given log """
+    with open_file(get_log_folder(log_name) + '/checkpoint.pickle', 'rb') as f:
+        checkpoint = pickle.load(f)
+    return checkpoint
+
 def get_last_line(file_name):
     """ Returns the last line of the given file """
     with open_file(file_name, 'rb') as f:
@@ -178,24 +302,22 @@ def plot_learning_curves(logs, parameters):
 
         n_episodes.append(get_n_episodes(log_name))
 
-    fitness = np.array(fitness)
-    n_episodes = np.array(n_episodes)
-
+    #Runs may stop early, so the logs can have different lengths
     n_logs = len(logs)
-    startx = np.max(n_episodes[:, 0])
-    endx = np.min(n_episodes[:, -1])
+    startx = max(episodes[0] for episodes in n_episodes)
+    endx = min(episodes[-1] for episodes in n_episodes)
     if parameters.extrapolate_y:
         x = np.arange(startx, parameters.x_max + 1)
     else:
         x = np.arange(startx, endx + 1)
     y = np.zeros((len(x), n_logs))
     for i in range(0, n_logs):
-        f = interpolate.interp1d(n_episodes[i, :], fitness[i, :], bounds_error=False)
+        f = interpolate.interp1d(n_episodes[i], fitness[i], bounds_error=False)
         y[:, i] = f(x)
         if parameters.extrapolate_y:
-            n_extrapolated = int(parameters.x_max - n_episodes[i, -1])
+            n_extrapolated = int(parameters.x_max - n_episodes[i][-1])
             if n_extrapolated > 0:
-                left = y[:n_episodes[i, -1] - n_episodes[i, 0] + 1, i]
+                left = y[:n_episodes[i][-1] - startx + 1, i]
                 y[:, i] = np.concatenate((left, np.full(n_extrapolated, left[-1])))
         if parameters.plot_ind:
             plt.plot(x, y[:, i], color=parameters.ind_color, linestyle='dashed', linewidth=1)
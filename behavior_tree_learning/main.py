@@ -50,6 +50,7 @@ def run_simulation():
     gp_par.allow_identical = False
     gp_par.plot = True
     gp_par.n_generations = 8000
+    gp_par.max_episodes = 400000
     gp_par.verbose = False
     gp_par.fig_last_gen = False
 
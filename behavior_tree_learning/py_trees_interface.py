@@ -4,21 +4,30 @@ Interfaces to py_trees from behavior tree strings
 """
 import os
 import sys
+from dataclasses import dataclass
 
 sys.path.insert(1, '/home/matteo/Documents/py_trees')
 import py_trees as pt
 
 import behavior_tree as behavior_tree
 
+@dataclass
+class TickParameters:
+    """ Data class for the limits of the BT execution """
+    max_ticks: int = 60                     # Maximum number of ticks of an episode
+    max_fails: int = 5                      # Number of root failures after which the episode stops
+    requested_successes: int = 2            # Number of consecutive root successes after which the episode stops
+
 class PyTree(pt.trees.BehaviourTree):
     """
     A class containing a behavior tree. Inherits from the py tree BehaviorTree class.
     """
-    def __init__(self, string, behaviors, state_machine=None, root=None):
+    def __init__(self, string, behaviors, state_machine=None, root=None, nodes=None):
+        self.nodes = nodes
         if root is not None:
             self.root = root
             string = self.get_bt_from_root()
-        self.bt = behavior_tree.BT(string)
+        self.bt = behavior_tree.BT(string, nodes)
         self.depth = self.bt.depth()
         self.length = self.bt.length()
         self.state_machine = state_machine
@@ -62,7 +71,7 @@ class PyTree(pt.trees.BehaviourTree):
                     bt.insert(i + 1, ')')
             prev_leading_spaces = leading_spaces
 
-        bt_obj = behavior_tree.BT(bt)
+        bt_obj = behavior_tree.BT(bt, self.nodes)
         bt_obj.close()
         return bt_obj.bt
 
@@ -88,15 +97,19 @@ class PyTree(pt.trees.BehaviourTree):
         #This return is only reached if there are too few up nodes
         return node
 
-    def tick_bt(self):
+    def tick_bt(self, tick_par=None, ticks=0):
         """
-        Function executing the behavior tree
+        Function executing the behavior tree.
+        ticks is the number of ticks already executed on the state machine,
+        e.g. by another tree when the state machine was forked from a shared episode,
+        they count towards max_ticks. Returns the total number of ticks
         """
-        max_ticks = 60
-        ticks = 0
-        max_fails = 5
+        if tick_par is None:
+            tick_par = TickParameters()
+        max_ticks = tick_par.max_ticks
+        max_fails = tick_par.max_fails
         fails = 0
-        requested_successes = 2
+        requested_successes = tick_par.requested_successes
         successes = 0
         #self.root.status is not pt.common.Status.SUCCESS and \
         while (self.root.status is not pt.common.Status.FAILURE or fails < max_fails) and \
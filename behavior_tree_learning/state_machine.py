@@ -3,11 +3,13 @@
 """
 State Machine Simulator
 """
-import random
 import math
+from array import array
 from enum import IntEnum
-from dataclasses import dataclass, field
-from typing import List
+from dataclasses import dataclass, field, replace
+from typing import Dict, List
+
+from episode_rng import GlobalRng
 
 class State(IntEnum):
     """
@@ -19,7 +21,61 @@ class State(IntEnum):
     POSE = 3
     HAS_CUBE = 4
     CUBE_ID = 5
-    VISITED = 6
+
+class Head(IntEnum):
+    """
+    Configurations of the robot head
+    """
+    DOWN = 0
+    UP = 1
+
+class Arm(IntEnum):
+    """
+    Configurations of the robot arm
+    """
+    STRETCHED = 0
+    TUCKED = 1
+    PICK = 2
+    PLACE = 3
+    UP = 4
+    DOWN = 5
+
+class Pose(IntEnum):
+    """
+    Poses of the default layout, indices in StateMachine.pose_coordinates.
+    The ids of any layout are in the same order: spawn, pick tables, place table, random poses, origin
+    """
+    HALF_WAY = -1               # robot stopped during a failed navigation, see StateMachine.robot_pose
+    SPAWN = 0
+    PICK_TABLE0 = 1
+    PICK_TABLE1 = 2
+    PICK_TABLE2 = 3
+    PLACE_TABLE = 4
+    RANDOM1 = 5
+    RANDOM2 = 6
+    RANDOM3 = 7
+    RANDOM4 = 8
+    RANDOM5 = 9
+    RANDOM6 = 10
+    RANDOM7 = 11
+    RANDOM8 = 12
+    RANDOM9 = 13
+    ORIGIN = 14
+
+# Orientation of the robot at the poses not in Layout.angles
+DEFAULT_ANGLE = (1, 0)
+
+# A cube can be picked if it is closer to the robot than this
+PICK_RANGE = 0.8
+
+class Transition(IntEnum):
+    """
+    Transitions with random outcomes, they have separate streams of common random numbers
+    """
+    LOCALISE = 0
+    MOVE = 1
+    PICK = 2
+    PLACE = 3
 
 class Feedback(IntEnum):
     """
@@ -36,35 +92,35 @@ class Feedback(IntEnum):
     ELAPSED_TIME = 8            # total time elapsed since the beginning of the simulation
     FAILURE_PB = 9              # sum of the probabilities of failure of the BT
 
+# Feedback values stored as float arrays, the others are floats
+VECTOR_FEEDBACK = (Feedback.AMCL, Feedback.CUBE, Feedback.CUBE_DISTANCE, Feedback.MIN_CUBE_DISTANCE,
+                   Feedback.ROBOT_CUBE_DISTANCE, Feedback.MIN_RC_DISTANCE)
+
 @dataclass
-class Poses:
+class Layout:
     """
-    Data class for parameters for the environment poses.
-    Note that the poses are pre-defined because there is a one-to-one
+    Data class for the poses of the environment, robot poses are 2D and cube poses 3D.
+    The default is the layout of the paper: the poses are pre-defined because there is a one-to-one
     correspondance with the simulation environment in Gazebo (see paper)
     """
-    spawn_pose: List[float] = field(default_factory=list)                # Spawn position of the robot
-    pick_table0: List[float] = field(default_factory=list)               # Position the robot has to reach to pick the cube 0
-    pick_table1: List[float] = field(default_factory=list)               # Position the robot has to reach to pick the cube 1
-    pick_table2: List[float] = field(default_factory=list)               # Position the robot has to reach to pick the cube 2
-    place_table: List[float] = field(default_factory=list)               # Position the robot has to reach to place the cube
-    random_pose1: List[float] = field(default_factory=list)              # First random position attainable by the robot
-    random_pose2: List[float] = field(default_factory=list)              # Second random position attainable by the robot
-    random_pose3: List[float] = field(default_factory=list)              # Third random position attainable by the robot
-    random_pose4: List[float] = field(default_factory=list)              # Fourth random position attainable by the robot
-    random_pose5: List[float] = field(default_factory=list)              # Fifth random position attainable by the robot
-    random_pose6: List[float] = field(default_factory=list)              # Sixth random position attainable by the robot
-    random_pose7: List[float] = field(default_factory=list)              # Seventh random position attainable by the robot
-    random_pose8: List[float] = field(default_factory=list)              # Eight random position attainable by the robot
-    random_pose9: List[float] = field(default_factory=list)              # Ninth random position attainable by the robot
-    origin: List[float] = field(default_factory=list)                    # World frame
-    half_way: List[float] = field(default_factory=list)                  # Pose half way between pick and place tables
-    amcl_init_pose: List[float] = field(default_factory=list)            # Initial estimated position of the robot (before localization)
-    cubes_spawn_pose: List[float] = field(default_factory=list)          # List of the spawn poses for the cubes
-    cube0_spawn_pose: List[float] = field(default_factory=list)          # Spawn position of the cube 0
-    cube1_spawn_pose: List[float] = field(default_factory=list)          # Spawn position of the cube 1
-    cube2_spawn_pose: List[float] = field(default_factory=list)          # Spawn position of the cube 2
-    cube_goal_pose: List[float] = field(default_factory=list)            # Goal position of the cube
+    spawn_pose: List[float] = field(default_factory=lambda: [2.40, -11.0])                                  # Spawn position of the robot
+    pick_tables: List[List[float]] = field(default_factory=lambda: [[-1.148, -6.1], [-2.32, -10.52], [-0.54, -0.545]]) # Positions the robot has to reach to pick the cubes
+    place_table: List[float] = field(default_factory=lambda: [2.6009, -1.7615])                             # Position the robot has to reach to place the cubes
+    random_poses: List[List[float]] = field(default_factory=lambda: [[-2.0, -9.0], [-4.0, -9.0], [2.0, 7.0], [-4.0, 0.0], [-3.0, -5.0], [3.0, -10.0], [-4.0, -12.0], [-3.0, -2.0], [4.0, 1.0]]) # Random positions attainable by the robot, numbered from 1
+    origin: List[float] = field(default_factory=lambda: [0.0, 0.0])                                         # World frame
+    amcl_init_pose: List[float] = field(default_factory=lambda: [-0.03343, -0.0321])                        # Initial estimated position of the robot (before localization)
+    cubes_spawn_pose: List[List[float]] = field(default_factory=lambda: [[-1.13053, -6.65365, 0.8625], [-2.32, -11.07, 0.865], [-1.086, -0.545, 0.866]]) # Spawn positions of the cubes
+    cube_goal_pose: List[float] = field(default_factory=lambda: [3.1509, -1.7615, 0.8625])                 # Goal position of the cubes
+    angles: Dict[str, List[float]] = field(default_factory=lambda: {'spawn': [0, 1], 'pick_table0': [0, -1], 'pick_table1': [0, -1], 'pick_table2': [-1, 0]}) # Orientation of the robot at the poses, DEFAULT_ANGLE if missing
+
+    def pose_names(self):
+        """ Returns the names of the poses in the order of their ids """
+        return ['spawn'] + ['pick_table' + str(i) for i in range(len(self.pick_tables))] + ['place_table'] + \
+               ['random' + str(i + 1) for i in range(len(self.random_poses))] + ['origin']
+
+    def pose_coordinates(self):
+        """ Returns the coordinates of the poses in the order of their ids """
+        return tuple(tuple(pose) for pose in [self.spawn_pose] + self.pick_tables + [self.place_table] + self.random_poses + [self.origin])
 
 @dataclass
 class SMParameters:
@@ -79,133 +135,232 @@ class SMParameters:
     lost_probability: float = 0.1                          # Probability of loosing the localization during motion (Pose transition)
     verbose: bool = False                                  # Extra prints
 
+# StateMachine attributes that are not part of the simulation state, shared by forks
+SHARED_SLOTS = ('sm_par', 'layout', 'cubes', 'velocity', 'cube_goal', 'rng', 'named_poses', 'pose_coordinates', 'angles',
+                'place_pose', 'place_distances', 'initial_spawn', 'near_cubes')
+
 class StateMachine:
     """
-    Class for handling the State Machine Simulator
+    Class for handling the State Machine Simulator.
+    The discrete state is a small integer array indexed by State: LOCALISED and HAS_CUBE are 0 or 1,
+    HEAD, ARM and POSE hold Head, Arm and pose id values and CUBE_ID is -1 when no cube is held.
+    The vector feedback values are float arrays, the poses of all cubes are stored in one
+    array of 3 coordinates per cube. Sets of cubes are bitmasks.
     """
-    def __init__(self, scenario, deterministic=False, verbose=False, pose_id=0):
+    __slots__ = SHARED_SLOTS + ('cubes_spawn', 'spawn_follows', 'current', 'visited', 'robot_pose', 'feedback', 'manipulating',
+                                'moving', 'moved_cubes', 'robot_moved', 'displaced')
+
+    def __init__(self, scenario, deterministic=False, verbose=False, pose_id=0, rng=None, sm_par=None, layout=None):
 
-        self.sm_par = SMParameters()
+        # Source of all random draws, e.g. an episode_rng.EpisodeRng, the random module if None
+        self.rng = GlobalRng if rng is None else rng
+
+        self.sm_par = SMParameters() if sm_par is None else replace(sm_par)
         self.sm_par.deterministic = deterministic
         self.sm_par.verbose = verbose
 
-        self.poses = Poses()
-        self.poses.cubes_spawn_pose = [[-1.13053, -6.65365, 0.8625], [-2.32, -11.07, 0.865], [-1.086, -0.545, 0.866]]
-
-        # Create simulation scenario
-        self.cubes = 1
+        self.layout = Layout() if layout is None else layout
 
+        # Create simulation scenario: the first cube, the cube at pose_id or all the cubes of the layout
         if scenario == 1:
-            self.poses.cubes_spawn_pose = [self.poses.cubes_spawn_pose[0]]
-            self.poses.cube0_spawn_pose += self.poses.cubes_spawn_pose[0]
+            cubes_spawn_pose = self.layout.cubes_spawn_pose[:1]
         elif scenario == 2:
-            self.poses.cube0_spawn_pose += self.poses.cubes_spawn_pose[pose_id]
-            self.poses.cubes_spawn_pose = [self.poses.cube0_spawn_pose]
+            cubes_spawn_pose = [self.layout.cubes_spawn_pose[pose_id]]
         elif scenario == 3:
-            self.cubes = 3
-            self.poses.cube0_spawn_pose += self.poses.cubes_spawn_pose[0]
-            self.poses.cube1_spawn_pose += self.poses.cubes_spawn_pose[1]
-            self.poses.cube2_spawn_pose += self.poses.cubes_spawn_pose[2]
+            cubes_spawn_pose = self.layout.cubes_spawn_pose
         else:
             raise Exception('Simulation scenario not supported.')
+        self.cubes = len(cubes_spawn_pose)
 
-        # robot related (2D)
-        self.poses.spawn_pose += [2.40, -11.0]
-        self.poses.pick_table0 += [-1.148, -6.1]
-        self.poses.pick_table1 += [-2.32, -10.52]
-        self.poses.pick_table2 += [-0.54, -0.545]
-        self.poses.place_table += [2.6009, -1.7615]
-        self.poses.random_pose1 += [-2.0, -9.0]
-        self.poses.random_pose2 += [-4.0, -9.0]
-        self.poses.random_pose3 += [2.0, 7.0]
-        self.poses.random_pose4 += [-4.0, 0.0]
-        self.poses.random_pose5 += [-3.0, -5.0]
-        self.poses.random_pose6 += [3.0, -10.0]
-        self.poses.random_pose7 += [-4.0, -12.0]
-        self.poses.random_pose8 += [-3.0, -2.0]
-        self.poses.random_pose9 += [4.0, 1.0]
-        self.poses.origin += [0.0, 0.0]
-        self.poses.amcl_init_pose += [-0.03343, -0.0321]
+        # robot related (2D), indexed by pose id
+        self.named_poses = {name: i for i, name in enumerate(self.layout.pose_names())}
+        self.pose_coordinates = self.layout.pose_coordinates()
+        self.angles = tuple(tuple(self.layout.angles.get(name, DEFAULT_ANGLE)) for name in self.layout.pose_names())
+        self.place_pose = self.named_poses['place_table']
+        self.place_distances = tuple(distance(pose, self.layout.place_table) for pose in self.pose_coordinates)
 
         # cube related (3D)
-        self.poses.cube_goal_pose += [3.1509, -1.7615, 0.8625]
+        self.cube_goal = array('d', self.layout.cube_goal_pose)
 
         #robot velocity
         self.velocity = 0.3
 
-        self.current = [None]*(len(State))
-        self.current[State.LOCALISED] = False
-        self.current[State.HEAD] = "Down"
-        self.current[State.ARM] = "Stretched"
-        self.current[State.POSE] = self.poses.spawn_pose
-        self.current[State.HAS_CUBE] = False
-        self.current[State.CUBE_ID] = None
-        self.current[State.VISITED] = [False, False, False]
+        # Spawn poses of the cubes in this episode. The spawn pose of the cubes in spawn_follows
+        # is moved together with the cube, so that they respawn where they were last held.
+        # This holds at the start and after a cube is lost by moving the arm.
+        self.initial_spawn = array('d', [x for pose in cubes_spawn_pose for x in pose])
+        self.cubes_spawn = self.initial_spawn[:]
+        self.spawn_follows = (1 << self.cubes) - 1
+
+        # Proximity index: for every pose, the cubes in pick range when they are at their initial spawn pose.
+        # The cubes that can be in pick range of the robot are these and the displaced ones
+        self.near_cubes = tuple(sum(1 << i for i in range(self.cubes) if self.spawn_distance(i, pose) < PICK_RANGE)
+                                for pose in self.pose_coordinates)
+        self.displaced = 0
+
+        self.current = array('i', [0]*len(State))
+        self.current[State.HEAD] = Head.DOWN
+        self.current[State.ARM] = Arm.STRETCHED
+        self.current[State.POSE] = Pose.SPAWN
+        self.current[State.CUBE_ID] = -1
+        # pick tables where picking has been attempted
+        self.visited = bytearray(len(self.layout.pick_tables))
+        self.robot_pose = array('d', self.layout.spawn_pose)
 
         self.feedback = [None]*(len(Feedback))
-        self.feedback[Feedback.AMCL] = list(self.poses.amcl_init_pose)
-        self.feedback[Feedback.CUBE] = list(self.poses.cubes_spawn_pose)
-        self.feedback[Feedback.CUBE_DISTANCE] = [None]*self.cubes
-        self.feedback[Feedback.ROBOT_CUBE_DISTANCE] = [None]*self.cubes
+        self.feedback[Feedback.AMCL] = array('d', self.layout.amcl_init_pose)
+        self.feedback[Feedback.CUBE] = array('d', self.cubes_spawn)
+        self.feedback[Feedback.CUBE_DISTANCE] = array('d', [0.0])*self.cubes
+        self.feedback[Feedback.ROBOT_CUBE_DISTANCE] = array('d', [0.0])*self.cubes
 
         # Populate feedback lists with the values
         for i in range(self.cubes):
-            self.feedback[Feedback.CUBE_DISTANCE][i] = distance(self.poses.cubes_spawn_pose[i], self.poses.cube_goal_pose)
-            self.feedback[Feedback.ROBOT_CUBE_DISTANCE][i] = distance(self.poses.cubes_spawn_pose[i][0:2], self.poses.spawn_pose)
+            self.feedback[Feedback.CUBE_DISTANCE][i] = distance(cubes_spawn_pose[i], self.layout.cube_goal_pose)
+            self.feedback[Feedback.ROBOT_CUBE_DISTANCE][i] = distance(cubes_spawn_pose[i][0:2], self.layout.spawn_pose)
 
-        self.feedback[Feedback.MIN_CUBE_DISTANCE] = list(self.feedback[Feedback.CUBE_DISTANCE])
-        self.feedback[Feedback.MIN_RC_DISTANCE] = list(self.feedback[Feedback.ROBOT_CUBE_DISTANCE])
-        self.feedback[Feedback.ROBOT_DISTANCE] = distance(self.poses.spawn_pose, self.poses.place_table)
-        self.feedback[Feedback.LOCALIZATION_ERROR] = distance(self.poses.amcl_init_pose, self.poses.spawn_pose)
+        self.feedback[Feedback.MIN_CUBE_DISTANCE] = array('d', self.feedback[Feedback.CUBE_DISTANCE])
+        self.feedback[Feedback.MIN_RC_DISTANCE] = array('d', self.feedback[Feedback.ROBOT_CUBE_DISTANCE])
+        self.feedback[Feedback.ROBOT_DISTANCE] = self.place_distances[Pose.SPAWN]
+        self.feedback[Feedback.LOCALIZATION_ERROR] = distance(self.layout.amcl_init_pose, self.layout.spawn_pose)
         self.feedback[Feedback.ELAPSED_TIME] = 0.0
         self.feedback[Feedback.FAILURE_PB] = 0.0
 
         self.manipulating = False
         self.moving = False
 
+        # Changes since the last update_feedback: bitmask of the moved cubes and robot motion
+        self.moved_cubes = 0
+        self.robot_moved = False
+
+    def spawn_distance(self, cube_id, pose):
+        """ Distance of the robot at pose from the initial spawn pose of the cube, as in the feedback """
+        x, y = self.initial_spawn[3*cube_id:3*cube_id + 2]
+        return math.sqrt((pose[0] - x)**2 + (pose[1] - y)**2)
+
+    def snapshot(self):
+        """
+        Returns a copy of the simulation state, the scenario and the parameters are not included
+        """
+        feedback = list(self.feedback)
+        for i in VECTOR_FEEDBACK:
+            feedback[i] = feedback[i][:]
+        return (self.current[:], self.visited[:], self.robot_pose[:], self.cubes_spawn[:], self.spawn_follows,
+                self.displaced, feedback, self.manipulating, self.moving)
+
+    def restore(self, snapshot):
+        """
+        Restores a state returned by snapshot, the same snapshot can be restored several times.
+        Snapshots are taken between transitions, when the feedback is up to date
+        """
+        current, visited, robot_pose, cubes_spawn, self.spawn_follows, self.displaced, feedback, \
+            self.manipulating, self.moving = snapshot
+        self.moved_cubes = 0
+        self.robot_moved = False
+        self.current = current[:]
+        self.visited = visited[:]
+        self.robot_pose = robot_pose[:]
+        self.cubes_spawn = cubes_spawn[:]
+        self.feedback = list(feedback)
+        for i in VECTOR_FEEDBACK:
+            self.feedback[i] = feedback[i][:]
+
+    def fork(self):
+        """
+        Returns a new state machine in the current state, sharing the scenario and the parameters.
+        Episodes can then branch from a shared state instead of restarting from the spawn
+        """
+        state_machine = StateMachine.__new__(StateMachine)
+        for name in SHARED_SLOTS:
+            setattr(state_machine, name, getattr(self, name))
+        state_machine.restore(self.snapshot())
+        return state_machine
+
+    def cube_on_goal(self, cube_id):
+        """ State wheter the cube is exactly on the goal pose """
+        return self.feedback[Feedback.CUBE][3*cube_id:3*cube_id + 3] == self.cube_goal
+
+    def respawn_cube(self, cube_id, follow=False):
+        """ Puts the cube back at its spawn pose """
+        spawn = self.cubes_spawn[3*cube_id:3*cube_id + 3]
+        self.feedback[Feedback.CUBE][3*cube_id:3*cube_id + 3] = spawn
+        self.moved_cubes |= 1 << cube_id
+        if spawn == self.initial_spawn[3*cube_id:3*cube_id + 3]:
+            self.displaced &= ~(1 << cube_id)
+        else:
+            self.displaced |= 1 << cube_id
+        if follow:
+            self.spawn_follows |= 1 << cube_id
+        else:
+            self.spawn_follows &= ~(1 << cube_id)
+
+    def amcl_near_pose(self):
+        """ AMCL estimate with a small error around the robot pose """
+        noise = [self.rng.random()*0.1, self.rng.random()*0.1]
+        self.feedback[Feedback.AMCL][0] = self.robot_pose[0] + noise[0]
+        self.feedback[Feedback.AMCL][1] = self.robot_pose[1] + noise[1]
+
     def update_feedback(self):
         """ Update the Feedback state """
+        feedback = self.feedback
         # Update AMCL
         if self.current[State.LOCALISED]:
-            self.feedback[Feedback.AMCL] = list(map(lambda x,y:x+y, self.current[State.POSE], [random.random()*0.1, random.random()*0.1]))
+            self.amcl_near_pose()
         else:
             # big error around last known pose
-            self.feedback[Feedback.AMCL] = list(map(lambda x,y:x+y, self.feedback[Feedback.AMCL], [random.uniform(1.5, 2.5), random.uniform(1.5, 2.5)]))
-
-        self.feedback[Feedback.LOCALIZATION_ERROR] = distance(self.feedback[Feedback.AMCL], self.current[State.POSE])
-
-        angle = [0, 0]
-        if self.current[State.POSE] == self.poses.spawn_pose:
-            angle = [0, 1]
-        elif self.current[State.POSE] == self.poses.pick_table0 or self.current[State.POSE] == self.poses.pick_table1:
-            angle = [0, -1]
-        elif self.current[State.POSE] == self.poses.pick_table2:
-            angle = [-1, 0]
-        elif self.current[State.POSE] == self.poses.place_table:
-            angle = [1, 0]
-        else:
-            angle = [1, 0]
+            noise = [self.rng.uniform(1.5, 2.5), self.rng.uniform(1.5, 2.5)]
+            feedback[Feedback.AMCL][0] += noise[0]
+            feedback[Feedback.AMCL][1] += noise[1]
 
-        if self.current[State.HAS_CUBE] and self.current[State.CUBE_ID] is not None:
+        feedback[Feedback.LOCALIZATION_ERROR] = distance(feedback[Feedback.AMCL], self.robot_pose)
+
+        pose = self.current[State.POSE]
+        cubes = feedback[Feedback.CUBE]
+        cube_id = self.current[State.CUBE_ID]
+        if self.current[State.HAS_CUBE] and cube_id >= 0:
+            angle = self.angles[pose] if pose != Pose.HALF_WAY else DEFAULT_ANGLE
             # x coordinate + 50cm (accounting to the robot in picking pose)
-            self.feedback[Feedback.CUBE][self.current[State.CUBE_ID]][0] = float(self.current[State.POSE][0] + 0.3*angle[0]) + random.uniform(-0.1, 0.1)
+            cubes[3*cube_id] = float(self.robot_pose[0] + 0.3*angle[0]) + self.rng.uniform(-0.1, 0.1)
             # y coordinate + 50cm (accounting to the robot in picking pose)
-            self.feedback[Feedback.CUBE][self.current[State.CUBE_ID]][1] = float(self.current[State.POSE][1] + 0.3*angle[1]) + random.uniform(-0.1, 0.1)
+            cubes[3*cube_id + 1] = float(self.robot_pose[1] + 0.3*angle[1]) + self.rng.uniform(-0.1, 0.1)
             # z coordinate
-            self.feedback[Feedback.CUBE][self.current[State.CUBE_ID]][2] = float(random.uniform(1.3, 1.4))
-
+            cubes[3*cube_id + 2] = float(self.rng.uniform(1.3, 1.4))
+            if self.spawn_follows >> cube_id & 1:
+                self.cubes_spawn[3*cube_id:3*cube_id + 3] = cubes[3*cube_id:3*cube_id + 3]
+
+            self.moved_cubes |= 1 << cube_id
+            self.displaced |= 1 << cube_id
+
+        # Only the distances of moved cubes, or of all cubes if the robot moved, can change
+        # same operations as distance, with the goal and robot coordinates unpacked once
+        goal_x, goal_y, goal_z = self.cube_goal
+        robot_x, robot_y = self.robot_pose
+        cube_distance = feedback[Feedback.CUBE_DISTANCE]
+        min_cube_distance = feedback[Feedback.MIN_CUBE_DISTANCE]
+        robot_cube_distance = feedback[Feedback.ROBOT_CUBE_DISTANCE]
+        min_rc_distance = feedback[Feedback.MIN_RC_DISTANCE]
         for i in range(self.cubes):
-            self.feedback[Feedback.CUBE_DISTANCE][i] = distance(self.feedback[Feedback.CUBE][i], self.poses.cube_goal_pose)
-            # update min distance (cube from goal)
-            if self.feedback[Feedback.CUBE_DISTANCE][i] < self.feedback[Feedback.MIN_CUBE_DISTANCE][i]:
-                self.feedback[Feedback.MIN_CUBE_DISTANCE][i] = float(self.feedback[Feedback.CUBE_DISTANCE][i])
-
-            self.feedback[Feedback.ROBOT_CUBE_DISTANCE][i] = distance(self.current[State.POSE], self.feedback[Feedback.CUBE][i][0:2])
+            cube_moved = self.moved_cubes >> i & 1
+            if not cube_moved and not self.robot_moved:
+                continue
+            x, y, z = cubes[3*i:3*i + 3]
+            if cube_moved:
+                cube_distance[i] = math.sqrt((x - goal_x)**2 + (y - goal_y)**2 + (z - goal_z)**2)
+                # update min distance (cube from goal)
+                if cube_distance[i] < min_cube_distance[i]:
+                    min_cube_distance[i] = cube_distance[i]
+
+            robot_cube_distance[i] = math.sqrt((robot_x - x)**2 + (robot_y - y)**2)
             # update min distance (robot from cube)
-            if self.feedback[Feedback.ROBOT_CUBE_DISTANCE][i] < self.feedback[Feedback.MIN_RC_DISTANCE][i]:
-                self.feedback[Feedback.MIN_RC_DISTANCE][i] = float(self.feedback[Feedback.ROBOT_CUBE_DISTANCE][i])
+            if robot_cube_distance[i] < min_rc_distance[i]:
+                min_rc_distance[i] = robot_cube_distance[i]
 
-        self.feedback[Feedback.ROBOT_DISTANCE] = distance(self.current[State.POSE], self.poses.place_table)
+        if self.robot_moved:
+            if pose == Pose.HALF_WAY:
+                feedback[Feedback.ROBOT_DISTANCE] = distance(self.robot_pose, self.layout.place_table)
+            else:
+                feedback[Feedback.ROBOT_DISTANCE] = self.place_distances[pose]
+        self.moved_cubes = 0
+        self.robot_moved = False
 
     ##############################################
     #               LOCALIZATION                 #
@@ -214,7 +369,7 @@ class StateMachine:
     def localise_robot(self):
         """ Transition that allows to localize the robot """
 
-        p_success = random.random()
+        p_success = self.rng.transition(Transition.LOCALISE)
         if self.sm_par.deterministic:
             p_success = 1.0
 
@@ -232,26 +387,37 @@ class StateMachine:
         self.update_feedback()
         #print("LOC +7s")
         self.feedback[Feedback.ELAPSED_TIME] += 7.0
-        return self.current[State.LOCALISED]
+        return bool(self.current[State.LOCALISED])
 
     ##############################################
     #                NAVIGATION                  #
     ##############################################
 
-    def pose_half_way(self, pose, past_pose):
-        return [(pose[0] + past_pose[0])/2, (pose[1] + past_pose[1])/2]
+    def stop_half_way(self, pose, past_pose):
+        """ The robot stops half way between its estimated past pose and the pose """
+        x, y = self.pose_coordinates[pose]
+        self.current[State.POSE] = Pose.HALF_WAY
+        self.robot_pose[0] = (x + past_pose[0])/2
+        self.robot_pose[1] = (y + past_pose[1])/2
+        self.robot_moved = True
+
+    def drop_cube(self):
+        """ The held cube falls and respawns """
+        self.current[State.HAS_CUBE] = False
+        self.respawn_cube(self.current[State.CUBE_ID])
+        self.current[State.CUBE_ID] = -1
 
     def ready_to_move(self):
         """ State wheter the robot is ready to move """
-        return (self.current[State.LOCALISED:State.POSE] == [True, "Up", "Tucked"]) or \
-               (self.current[State.LOCALISED:State.POSE] == [True, "Up", "Pick"])
+        return self.current[State.LOCALISED] == 1 and self.current[State.HEAD] == Head.UP and \
+               self.current[State.ARM] in (Arm.TUCKED, Arm.PICK)
 
     def move_to(self, pose, safe=False):
-        """ Transition that allows to move the robot to a specific pose """
+        """ Transition that allows to move the robot to a specific pose, given as a pose id """
 
         success = False
-        past_pose = list(self.feedback[Feedback.AMCL])
-        p_success = random.random()
+        past_pose = self.feedback[Feedback.AMCL][:]
+        p_success = self.rng.transition(Transition.MOVE)
         if self.sm_par.deterministic or safe:
             p_success = 1.0
 
@@ -270,30 +436,26 @@ class StateMachine:
                 # CASE1: localisation lost during motion and cube dropped
                 # the robot loses localization halfway, so let's put that on the current and feedback
                 # then the update function will let the error grow
-                self.current[State.POSE] = list(self.pose_half_way(pose, past_pose))
-                self.feedback[Feedback.AMCL] = list(map(lambda x,y:x+y, self.current[State.POSE], [random.random()*0.1, random.random()*0.1]))
+                self.stop_half_way(pose, past_pose)
+                self.amcl_near_pose()
                 self.current[State.LOCALISED] = False
-                self.current[State.HAS_CUBE] = False
-                self.feedback[Feedback.CUBE][self.current[State.CUBE_ID]] = list(self.poses.cubes_spawn_pose[self.current[State.CUBE_ID]])
-                self.current[State.CUBE_ID] = None
+                self.drop_cube()
                 self.feedback[Feedback.FAILURE_PB] += drop*self.sm_par.lost_probability
                 if self.sm_par.verbose:
                     print("ERROR: cube dropped AND localisation lost!")
             elif p_success - (drop*self.sm_par.lost_probability) <\
                  (1.0 - self.sm_par.lost_probability)*drop :
                 # CASE2: cube dropped but localization ok
-                self.current[State.POSE] = list(self.pose_half_way(pose, past_pose))
-                self.current[State.HAS_CUBE] = False
-                self.feedback[Feedback.CUBE][self.current[State.CUBE_ID]] = list(self.poses.cubes_spawn_pose[self.current[State.CUBE_ID]])
-                self.current[State.CUBE_ID] = None
+                self.stop_half_way(pose, past_pose)
+                self.drop_cube()
                 self.feedback[Feedback.FAILURE_PB] += (1.0 - self.sm_par.lost_probability)*drop
                 if self.sm_par.verbose:
                     print("ERROR: cube lost during motion!")
             elif p_success - drop <\
                  self.sm_par.lost_probability*(1.0 - drop) :
                 # CASE3: localization lost
-                self.current[State.POSE] = list(self.pose_half_way(pose, past_pose))
-                self.feedback[Feedback.AMCL] = list(map(lambda x,y:x+y, self.current[State.POSE], [random.random()*0.1, random.random()*0.1]))
+                self.stop_half_way(pose, past_pose)
+                self.amcl_near_pose()
                 self.current[State.LOCALISED] = False
                 self.feedback[Feedback.FAILURE_PB] += self.sm_par.lost_probability*(1.0 - drop)
                 if self.sm_par.verbose:
@@ -302,15 +464,17 @@ class StateMachine:
                 # CASE4: all good!
                 success = True
                 self.current[State.POSE] = pose
-                self.feedback[Feedback.AMCL] = list(map(lambda x,y:x+y, self.current[State.POSE], [random.random()*0.1, random.random()*0.1]))
+                self.robot_pose[0], self.robot_pose[1] = self.pose_coordinates[pose]
+                self.robot_moved = True
+                self.amcl_near_pose()
                 if self.sm_par.verbose:
-                    print("Robot at pose " + str(pose))
+                    print("Robot at pose " + str(self.pose_coordinates[pose]))
         else:
             if self.sm_par.verbose:
                 print("Robot not ready to move.")
 
         # if safe, take a 15m longer path, but there is no failure probability
-        navigated_dist = distance(self.current[State.POSE], past_pose) + 15.0*int(safe)
+        navigated_dist = distance(self.robot_pose, past_pose) + 15.0*int(safe)
         self.feedback[Feedback.ELAPSED_TIME] += navigated_dist/self.velocity
         #print("MOVE +" + str(navigated_dist/self.velocity) + "s")
 
@@ -322,54 +486,71 @@ class StateMachine:
     ##############################################
 
     def move_arm(self, configuration):
-        """ Handle the tucking of the robot arm """
+        """ Handle the tucking of the robot arm, configuration is an Arm """
 
         success = True
         self.current[State.ARM] = configuration
         if self.sm_par.verbose:
-            print("Robot arm in {} configuration".format(configuration))
+            print("Robot arm in {} configuration".format(Arm(configuration).name))
 
         #print("TUCK +3s")
         self.feedback[Feedback.ELAPSED_TIME] += 3.0
         if self.current[State.HAS_CUBE]:
             if self.sm_par.verbose:
                 print("Cube lost, respawning at pick table.")
-            self.feedback[Feedback.CUBE][int(self.current[State.CUBE_ID])] = self.poses.cubes_spawn_pose[int(self.current[State.CUBE_ID])]
+            self.respawn_cube(self.current[State.CUBE_ID], follow=True)
             self.current[State.HAS_CUBE] = False
-            self.current[State.CUBE_ID] = None
+            self.current[State.CUBE_ID] = -1
 
         self.update_feedback()
         return success
 
     def ready_to_pick(self):
         """ State wheter the robot is ready to pick """
-        return self.current[State.LOCALISED:State.HAS_CUBE] == [True, "Down", "Tucked", self.poses.pick_table0] or\
-               self.current[State.LOCALISED:State.HAS_CUBE] == [True, "Down", "Tucked", self.poses.pick_table1] or\
-               self.current[State.LOCALISED:State.HAS_CUBE] == [True, "Down", "Tucked", self.poses.pick_table2] or\
-               self.current[State.LOCALISED:State.HAS_CUBE] == [True, "Down", "Tucked", self.poses.place_table]
+        return self.current[State.LOCALISED] == 1 and self.current[State.HEAD] == Head.DOWN and \
+               self.current[State.ARM] == Arm.TUCKED and \
+               Pose.SPAWN < self.current[State.POSE] <= self.place_pose
+
+    def nearest_cube(self):
+        """
+        Returns the cube closest to the robot within pick range, the lowest id among equally close cubes,
+        or -1 if there is none. Only the cubes of the proximity index of the robot pose are checked
+        """
+        robot_cube_distance = self.feedback[Feedback.ROBOT_CUBE_DISTANCE]
+        candidates = self.near_cubes[self.current[State.POSE]] | self.displaced
+        nearest = -1
+        nearest_distance = PICK_RANGE
+        while candidates:
+            lowest = candidates & -candidates
+            cube_id = lowest.bit_length() - 1
+            candidates ^= lowest
+            if robot_cube_distance[cube_id] < nearest_distance:
+                nearest = cube_id
+                nearest_distance = robot_cube_distance[cube_id]
+        return nearest
 
     def pick(self):
         """ Pick the cube """
 
         success = False
-        p_success = random.random()
+        p_success = self.rng.transition(Transition.PICK)
         if self.sm_par.deterministic:
             p_success = 1.0
 
-        if self.ready_to_pick() and min(self.feedback[Feedback.ROBOT_CUBE_DISTANCE]) < 0.8:
+        cube_id = self.nearest_cube() if self.ready_to_pick() else -1
+        if cube_id >= 0:
             # this means that there is a cube to pick near to the robot
             if p_success < self.sm_par.fail_pick_probability:
                 self.current[State.HAS_CUBE] = False
                 self.feedback[Feedback.FAILURE_PB] += self.sm_par.fail_pick_probability
-                #self.feedback[Feedback.CUBE] = list(self.poses.cube_spawn_pose)
                 if self.sm_par.verbose:
                     print("ERROR: picking failed!")
             else:
                 success = True
                 self.current[State.HAS_CUBE] = True
                 # the cube to be picked is then the closest to the robot
-                self.current[State.CUBE_ID] = self.feedback[Feedback.ROBOT_CUBE_DISTANCE].index(min(self.feedback[Feedback.ROBOT_CUBE_DISTANCE]))
-                self.current[State.ARM] = "Pick"
+                self.current[State.CUBE_ID] = cube_id
+                self.current[State.ARM] = Arm.PICK
                 if self.sm_par.verbose:
                     print("Cube picked.")
         else:
@@ -381,43 +562,50 @@ class StateMachine:
         self.feedback[Feedback.ELAPSED_TIME] += 12.0
         return success
 
+    def visit(self):
+        """ Marks the pick table at the robot pose as visited """
+        pose = self.current[State.POSE]
+        if Pose.SPAWN < pose < self.place_pose:
+            self.visited[pose - Pose.PICK_TABLE0] = 1
+
     def ready_to_place(self):
         """ State wheter the robot is ready to place """
-        return self.current[State.LOCALISED:State.HAS_CUBE] == [True, "Down", "Tucked", self.poses.pick_table0] or\
-               self.current[State.LOCALISED:State.HAS_CUBE] == [True, "Down", "Tucked", self.poses.pick_table1] or\
-               self.current[State.LOCALISED:State.HAS_CUBE] == [True, "Down", "Tucked", self.poses.pick_table2] or\
-               self.current[State.LOCALISED:State.HAS_CUBE] == [True, "Down", "Pick", self.poses.place_table]
+        if self.current[State.LOCALISED] != 1 or self.current[State.HEAD] != Head.DOWN:
+            return False
+        if self.current[State.ARM] == Arm.TUCKED:
+            return Pose.SPAWN < self.current[State.POSE] < self.place_pose
+        return self.current[State.ARM] == Arm.PICK and self.current[State.POSE] == self.place_pose
 
     def place(self):
         """ Place the cube """
 
         success = False
-        p_success = random.random()
+        p_success = self.rng.transition(Transition.PLACE)
         if self.sm_par.deterministic:
             p_success = 1.0
 
         if self.ready_to_place() and self.current[State.HAS_CUBE]:
             if p_success < self.sm_par.fail_place_probability:
                 self.feedback[Feedback.FAILURE_PB] += self.sm_par.fail_place_probability
-                #self.current[State.ARM] = "Place"
-                #self.feedback[Feedback.CUBE] = list(self.poses.cube_spawn_pose)
                 if self.sm_par.verbose:
                     print("ERROR: placing failed!")
             else:
                 success = True
+                cube_id = self.current[State.CUBE_ID]
                 self.current[State.HAS_CUBE] = False
-                self.current[State.ARM] = "Place"
-                if self.current[State.POSE] == self.poses.pick_table0 or\
-                    self.current[State.POSE] == self.poses.pick_table1 or\
-                    self.current[State.POSE] == self.poses.pick_table2:
-                    self.feedback[Feedback.CUBE][self.current[State.CUBE_ID]] = list(self.poses.cubes_spawn_pose[self.current[State.CUBE_ID]])
+                self.current[State.ARM] = Arm.PLACE
+                if self.current[State.POSE] < self.place_pose:
+                    self.respawn_cube(cube_id)
                     if self.sm_par.verbose:
                         print("Cube placed in the pick table.")
-                elif self.current[State.POSE] == self.poses.place_table:
-                    self.feedback[Feedback.CUBE][self.current[State.CUBE_ID]] = list(self.poses.cube_goal_pose)
+                elif self.current[State.POSE] == self.place_pose:
+                    self.feedback[Feedback.CUBE][3*cube_id:3*cube_id + 3] = self.cube_goal
+                    self.moved_cubes |= 1 << cube_id
+                    self.displaced |= 1 << cube_id
+                    self.spawn_follows &= ~(1 << cube_id)
                     if self.sm_par.verbose:
                         print("Cube placed in the place table.")
-                self.current[State.CUBE_ID] = None
+                self.current[State.CUBE_ID] = -1
         else:
             if self.sm_par.verbose:
                 print("Robot not ready to place.")
@@ -433,7 +621,7 @@ class StateMachine:
 
     def move_head_up(self):
         """ Move the head in Up configuration """
-        self.current[State.HEAD] = "Up"
+        self.current[State.HEAD] = Head.UP
         #print("UP +2s")
         self.feedback[Feedback.ELAPSED_TIME] += 2.0
         if self.sm_par.verbose:
@@ -442,7 +630,7 @@ class StateMachine:
 
     def move_head_down(self):
         """ Move the head in Down configuration """
-        self.current[State.HEAD] = "Down"
+        self.current[State.HEAD] = Head.DOWN
         #print("DOWN +2s")
         self.feedback[Feedback.ELAPSED_TIME] += 2.0
         if self.sm_par.verbose:
@@ -457,3 +645,4 @@ def distance(pose1, pose2):
         argument += (pose1[i]-pose2[i])**2
 
     return math.sqrt(argument)
+
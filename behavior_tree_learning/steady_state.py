@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Asynchronous steady-state genetic programming.
+There are no generations: as soon as a worker returns a fitness, the individual competes
+with the population through tournament replacement and a new offspring is dispatched.
+"""
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+
+import genetic_programming as gp
+from hash_table import HashTable
+import logplot as logplot
+
+@dataclass
+class SteadyStateParameters:
+    """ Data class for parameters for the steady-state mode """
+    n_workers: int = 4                      #Number of worker processes evaluating individuals
+    n_episodes: int = 10000                 #Number of episodes after which the run stops
+    tournament_size: int = 4                #Size of parent and replacement tournaments
+    p_crossover: float = 0.4                #Probability that an offspring comes from crossover instead of mutation
+    log_interval: int = 100                 #Episodes between logged best fitness values
+
+def tournament(population, fitness, size, best):
+    """
+    Returns the index of the best (or worst) individual of a random tournament
+    """
+    contestants = random.sample(range(len(population)), min(size, len(population)))
+    sign = 1 if best else -1
+    return gp.tournament_selection(contestants, [sign * fitness[i] for i in contestants], 1)[0]
+
+def create_offspring(population, fitness, gp_par, ss_par, nodes=None):
+    """
+    Creates new offspring by crossover or mutation of tournament selected parents
+    """
+    if random.random() < ss_par.p_crossover:
+        parents = [tournament(population, fitness, ss_par.tournament_size, True) for _ in range(2)]
+        return gp.crossover(population, parents, gp_par, nodes)
+    return gp.mutation(population, [tournament(population, fitness, ss_par.tournament_size, True)], gp_par, nodes)
+
+def replace(population, fitness, individual, individual_fitness, ss_par):
+    """
+    Tournament replacement: the individual replaces the worst of a random tournament if it is better
+    """
+    if individual in population:
+        fitness[population.index(individual)] = individual_fitness
+        return
+    worst = tournament(population, fitness, ss_par.tournament_size, False)
+    if individual_fitness > fitness[worst]:
+        population[worst] = individual
+        fitness[worst] = individual_fitness
+
+def run_steady_state(environment, gp_par, ss_par, seed=0):
+    """
+    Runs the steady-state genetic programming algorithm with ss_par.n_workers worker processes.
+    Uses the population, mutation, rerun and logging settings of gp_par.
+    Returns population, fitness, best fitness log, best individual and throughput in episodes per second,
+    the best individual is None if no individual was evaluated
+    """
+    gp.set_seeds(seed)
+    namespace = environment.fingerprint() if hasattr(environment, 'fingerprint') else ''
+    hash_table = HashTable(gp_par.hash_table_size, gp_par.log_name, gp_par.fitness_reservoir, namespace)
+    logplot.clear_logs(gp_par.log_name)
+    if gp_par.reuse_cache:
+        hash_table.load_cache()
+
+    population = []
+    fitness = []
+    best_fitness = []
+    n_episodes = []
+    completed = False
+    nodes = getattr(environment, 'nodes', None)
+    to_evaluate = gp.create_population(gp_par.n_population, gp_par.ind_start_length, nodes)
+    in_flight = {}
+    max_attempts = 1000
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(ss_par.n_workers, initializer=gp.init_worker, initargs=(environment,)) as executor:
+        while hash_table.n_values < ss_par.n_episodes:
+            #Keep all workers busy, without dispatching episodes beyond the budget
+            attempts = 0
+            while len(in_flight) < 2 * ss_par.n_workers and attempts < max_attempts and \
+                  hash_table.n_values + len(in_flight) < ss_par.n_episodes:
+                attempts += 1
+                if not to_evaluate:
+                    if len(population) < gp_par.n_population:
+                        if in_flight:
+                            break #Wait for the initial population
+                        to_evaluate = gp.create_population(gp_par.n_population - len(population), gp_par.ind_start_length, nodes)
+                    else:
+                        to_evaluate = create_offspring(population, fitness, gp_par, ss_par, nodes)
+                    continue
+                individual = to_evaluate.pop()
+                if individual in in_flight.values():
+                    continue
+                entry = hash_table.find(individual)
+                if not gp.needs_episode(entry, gp_par.rerun_fitness):
+                    if len(population) >= gp_par.n_population:
+                        replace(population, fitness, individual, entry.mean, ss_par)
+                    continue
+                in_flight[executor.submit(gp.evaluate_episode, individual, random.getrandbits(32), entry)] = individual
+
+            if not in_flight:
+                print("No new individuals to evaluate, stopping.")
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                individual = in_flight.pop(future)
+                episode_fitness, individual_completed, eval_time = future.result()
+                entry = hash_table.insert(individual, episode_fitness, eval_time)
+                completed = completed or individual_completed
+
+                if len(population) < gp_par.n_population and individual not in population:
+                    population.append(individual)
+                    fitness.append(entry.mean)
+                else:
+                    replace(population, fitness, individual, entry.mean, ss_par)
+
+                if hash_table.n_values % ss_par.log_interval == 0 and len(population) > 0:
+                    best_fitness.append(max(fitness))
+                    n_episodes.append(hash_table.n_values)
+                    if gp_par.verbose:
+                        print("Episodes: ", hash_table.n_values, " Best fitness: ", best_fitness[-1])
+
+        for future in in_flight:
+            future.cancel()
+        run_time = time.perf_counter() - start_time
+
+    throughput = hash_table.n_values / run_time
+    best_individual = None
+    if population:
+        best_fitness.append(max(fitness))
+        n_episodes.append(hash_table.n_values)
+        best_individual = gp.best_individual(population, fitness)
+        print("Episodes: ", hash_table.n_values, " Best fitness: ", best_fitness[-1])
+        print("Best individual: " + str(best_individual))
+    else:
+        print("No individual was evaluated.")
+    print("Completed? " + str(completed))
+    print("Throughput: %.1f episodes/s" % throughput)
+
+    hash_table.write_table()
+    if gp_par.reuse_cache:
+        hash_table.write_cache()
+    logplot.log_population(gp_par.log_name, population)
+    logplot.log_fitness(gp_par.log_name, fitness)
+    if best_individual is not None:
+        logplot.log_best_individual(gp_par.log_name, best_individual)
+    logplot.log_best_fitness(gp_par.log_name, best_fitness)
+    logplot.log_n_episodes(gp_par.log_name, n_episodes)
+    logplot.log_settings(gp_par.log_name, gp_par)
+    logplot.log_settings(gp_par.log_name, ss_par)
+
+    if gp_par.plot and best_fitness:
+        logplot.plot_fitness(gp_par.log_name, best_fitness, n_episodes)
+    if gp_par.fig_best and best_individual is not None:
+        environment.plot_individual(logplot.get_log_folder(gp_par.log_name), 'best individual', best_individual)
+
+    return population, fitness, best_fitness, best_individual, throughput
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Surrogate model of the fitness for pre-screening offspring before simulation
+"""
+import math
+import zlib
+import numpy as np
+
+from hash_table import FitnessStats
+
+class Surrogate:
+    """
+    Ridge regression of the fitness on hashed genome features:
+    length, depth, gene counts and counts of (control node, child gene) pairs.
+    Every episode in the hash table namespace is a training sample. The normal equations
+    are accumulated as episodes are inserted, so a refit only solves a small linear system.
+    """
+    def __init__(self, n_features=256, ridge=1.0):
+        self.n_features = n_features
+        self.ridge = ridge
+        self.xtx = np.zeros((n_features, n_features))
+        self.xty = np.zeros(n_features)
+        self.n_samples = 0
+        self.weights = None
+        self.predictions = {}           # genome -> prediction waiting for its first episode
+        self.errors = []                # absolute prediction errors since the last generation_stats
+        self.n_skipped = 0              # offspring not simulated since the last generation_stats
+
+    def feature_index(self, name):
+        """ Returns the feature index of name, hashed with a fixed seed so that runs are reproducible """
+        return 3 + zlib.crc32(name.encode('utf-8')) % (self.n_features - 3)
+
+    def features(self, genome):
+        """
+        Returns the feature vector of genome
+        """
+        x = np.zeros(self.n_features)
+        x[0] = 1.0
+        x[1] = len(genome)
+        parents = []
+        for gene in genome:
+            if gene == ')':
+                if parents:
+                    parents.pop()
+                continue
+            x[self.feature_index(gene)] += 1
+            if parents:
+                x[self.feature_index(parents[-1] + gene)] += 1
+            if gene.endswith('('):
+                parents.append(gene)
+                x[2] = max(x[2], len(parents))
+        return x
+
+    def add(self, genome, value, count=1):
+        """ Adds count episodes of genome with mean fitness value to the training data """
+        x = self.features(genome)
+        self.xtx += count * np.outer(x, x)
+        self.xty += count * value * x
+        self.n_samples += count
+
+    def fit(self):
+        """
+        Solves the ridge regression, the bias is not regularized
+        """
+        if self.n_samples == 0:
+            return
+        regularization = self.ridge * np.eye(self.n_features)
+        regularization[0, 0] = 0.0
+        self.weights = np.linalg.solve(self.xtx + regularization, self.xty)
+
+    def predict(self, genome):
+        """ Returns the predicted fitness of genome """
+        return float(self.features(genome) @ self.weights)
+
+    def select(self, offspring, hash_table, fraction):
+        """
+        Returns the fraction of offspring with highest fitness in their original order.
+        Offspring in the hash table are ranked by their mean fitness, the others by prediction.
+        All offspring are returned before the first fit.
+        """
+        if self.weights is None or not offspring:
+            return offspring
+        scores = []
+        for individual in offspring:
+            entry = hash_table.peek(individual)
+            if entry is not None:
+                scores.append(entry.mean)
+            else:
+                scores.append(self.predict(individual))
+                self.predictions[tuple(individual)] = scores[-1]
+        n_selected = math.ceil(fraction * len(offspring))
+        selected = sorted(sorted(range(len(offspring)), key=lambda i: -scores[i])[:n_selected])
+        for i in set(range(len(offspring))) - set(selected):
+            if self.predictions.pop(tuple(offspring[i]), None) is not None:
+                self.n_skipped += 1
+        return [offspring[i] for i in selected]
+
+    def generation_stats(self):
+        """
+        Returns the number of skipped offspring and the error of the predictions
+        since the last call, as a dict
+        """
+        stats = {'skipped': self.n_skipped,
+                 'n_predicted': len(self.errors),
+                 'mean_absolute_error': float(np.mean(self.errors)) if self.errors else None}
+        self.n_skipped = 0
+        self.errors = []
+        self.predictions = {}
+        return stats
+
+    def hash_table_listener(self, key, value, _entry):
+        """ Listener for HashTable.add_listener adding every episode to the training data """
+        if isinstance(value, FitnessStats):
+            self.add(key, value.mean, value.count)
+            return
+        prediction = self.predictions.pop(tuple(key), None)
+        if prediction is not None:
+            self.errors.append(abs(prediction - value))
+        self.add(key, value)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Finite-state transition table of the deterministic state machine simulator.
+In deterministic mode the outcome of a transition only depends on the discrete state of the
+state machine, so the behavior trees can run as table lookups without py_trees.
+The continuous feedback (AMCL and cube noise, distances, time) is computed afterwards,
+for the fitness only, by replaying the transitions of the episode on the state machine.
+"""
+import math
+
+import py_trees as pt
+import behavior_tree as behavior_tree
+import behaviors as behaviors
+import state_machine as sm
+from episode_rng import EpisodeRng
+
+# Locations of the cubes in a discrete state, the other locations are the closest pose id
+HELD = -2
+ON_GOAL = -3
+
+# Node kinds of a compiled tree
+FALLBACK = 0
+SEQUENCE = 1
+CONDITION = 2
+ACTION = 3
+
+# Genes known to be conditions, so that their behaviors are not created for every compiled tree
+CONDITION_GENES = set()
+
+class TableFull(Exception):
+    """ Raised when an episode reaches a discrete state beyond the size of the table """
+
+def closest_pose(state_machine, x, y):
+    """ Returns the id of the pose closest to x, y """
+    coordinates = state_machine.pose_coordinates
+    return min(range(len(coordinates)), key=lambda i: math.hypot(coordinates[i][0] - x, coordinates[i][1] - y))
+
+def discrete_key(state_machine):
+    """
+    Returns the discrete state of the state machine: the state array, the visited pick tables and where the cubes
+    and their spawn poses are, held, on the goal or else the closest pose, which tells which cubes can be picked
+    """
+    cubes = state_machine.feedback[sm.Feedback.CUBE]
+    current = state_machine.current
+    locations = []
+    for i in range(state_machine.cubes):
+        if current[sm.State.HAS_CUBE] and current[sm.State.CUBE_ID] == i:
+            locations.append(HELD)
+        elif state_machine.cube_on_goal(i):
+            locations.append(ON_GOAL)
+        else:
+            locations.append(closest_pose(state_machine, cubes[3*i], cubes[3*i + 1]))
+        locations.append(closest_pose(state_machine, state_machine.cubes_spawn[3*i], state_machine.cubes_spawn[3*i + 1]))
+    return current.tobytes(), bytes(state_machine.visited), state_machine.spawn_follows, tuple(locations)
+
+class TransitionTable:
+    """
+    Transitions of a deterministic state machine between discrete states, from the start state of the prototype.
+    The reachable discrete states are enumerated once per scenario as the episodes reach them, and shared by
+    all episodes: every state keeps a representative, the state machine where the state was first reached,
+    on which its transitions and conditions are evaluated the first time they are needed.
+    nodes are the node settings of the trees run on the table, see behavior_tree.BT.
+    """
+    def __init__(self, prototype, max_states=100000, nodes=None):
+        if not prototype.sm_par.deterministic:
+            raise ValueError("The transition table needs a deterministic state machine")
+        self.state_machine = prototype.fork()
+        # the noise of the representatives does not change the discrete states, and does not use the random module
+        self.state_machine.rng = EpisodeRng(0, [], 0)
+        self.max_states = max_states
+        self.nodes = nodes
+        self.index = {}                 # discrete key -> state id
+        self.snapshots = []             # representative of every state
+        self.currents = []              # state array of every state
+        self.visited = []               # visited pick tables of every state
+        self.transitions = {}           # (state id, transition) -> (return value, next state id)
+        self.conditions = {}            # (state id, condition gene) -> status
+        self.start = self.add_state()
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def add_state(self):
+        """ Returns the id of the discrete state of the representative state machine, added if new """
+        key = discrete_key(self.state_machine)
+        state = self.index.get(key)
+        if state is None:
+            if len(self.snapshots) >= self.max_states:
+                raise TableFull()
+            state = len(self.snapshots)
+            self.index[key] = state
+            self.snapshots.append(self.state_machine.snapshot())
+            self.currents.append(self.state_machine.current[:])
+            self.visited.append(self.state_machine.visited[:])
+        return state
+
+    def transition(self, state, transition):
+        """
+        Returns the return value and the next state of a transition from state,
+        the transition is the method name of the state machine and its arguments
+        """
+        result = self.transitions.get((state, transition))
+        if result is None:
+            self.state_machine.restore(self.snapshots[state])
+            value = getattr(self.state_machine, transition[0])(*transition[1:])
+            result = (value, self.add_state())
+            self.transitions[(state, transition)] = result
+        return result
+
+    def condition(self, state, gene):
+        """ Returns the status of the condition behavior of the gene in state """
+        status = self.conditions.get((state, gene))
+        if status is None:
+            self.state_machine.restore(self.snapshots[state])
+            node, _ = behaviors.get_node_from_string(gene, self.state_machine)
+            status = node.update()
+            self.conditions[(state, gene)] = status
+        return status
+
+class TableStateMachine:
+    """
+    Stand-in for the state machine in the behaviors of a compiled tree: the transitions
+    are looked up in the transition table and recorded for the replay
+    """
+    def __init__(self, table):
+        self.table = table
+        self.named_poses = table.state_machine.named_poses
+        self.state = table.start
+        self.current = table.currents[self.state]
+        self.visited = table.visited[self.state]
+        self.manipulating = False
+        self.moving = False
+        self.trace = []                 # (transition, return value, next state id)
+
+    def step(self, *transition):
+        """ Looks up the transition from the current state, records it and moves to the next state """
+        value, self.state = self.table.transition(self.state, transition)
+        self.current = self.table.currents[self.state]
+        self.visited = self.table.visited[self.state]
+        self.trace.append((transition, value, self.state))
+        return value
+
+    def localise_robot(self):
+        """ Localise transition """
+        return self.step('localise_robot')
+
+    def move_to(self, pose, safe=False):
+        """ Navigation transition """
+        return self.step('move_to', pose, safe)
+
+    def move_arm(self, configuration):
+        """ Arm transition """
+        return self.step('move_arm', configuration)
+
+    def pick(self):
+        """ Pick transition """
+        return self.step('pick')
+
+    def place(self):
+        """ Place transition """
+        return self.step('place')
+
+    def move_head_up(self):
+        """ Head up transition """
+        return self.step('move_head_up')
+
+    def move_head_down(self):
+        """ Head down transition """
+        return self.step('move_head_down')
+
+    def visit(self):
+        """ Marks the pick table at the robot pose as visited """
+        return self.step('visit')
+
+class CompiledTree:
+    """
+    Behavior tree of a genome ticked without py_trees, with the semantics of the py_trees (0.6) Selector for
+    fallbacks and of behaviors.RSequence for sequences. The actions are the behaviors of the genome acting on
+    a TableStateMachine, the conditions are looked up in the transition table.
+    """
+    def __init__(self, string, state_machine_):
+        bt = behavior_tree.BT(string[:], state_machine_.table.nodes)
+        self.depth = bt.depth()
+        self.length = bt.length()
+        self.state_machine = state_machine_
+        self.kinds = []
+        self.genes = []
+        self.actions = []
+        self.children = []
+        self.status = []
+        self.current_child = []
+
+        # Same parsing as PyTree, genes after the end of the root are ignored
+        self.position = 0
+        self.add_node(string)
+
+    def add_node(self, string):
+        """ Adds the node of the next gene of string and its subtree, returns its index """
+        gene = string[self.position]
+        self.position += 1
+        node = len(self.kinds)
+        self.genes.append(gene)
+        self.children.append([])
+        self.status.append(pt.common.Status.INVALID)
+        self.current_child.append(None)
+        if gene in ('f(', 's('):
+            self.kinds.append(FALLBACK if gene == 'f(' else SEQUENCE)
+            self.actions.append(None)
+            while self.position < len(string):
+                if string[self.position] == ')':
+                    self.position += 1
+                    break
+                self.children[node].append(self.add_node(string))
+        elif gene in CONDITION_GENES:
+            self.kinds.append(CONDITION)
+            self.actions.append(None)
+        else:
+            action, _ = behaviors.get_node_from_string(gene, self.state_machine)
+            if isinstance(action, behaviors.CONDITIONS):
+                CONDITION_GENES.add(gene)
+                self.kinds.append(CONDITION)
+                self.actions.append(None)
+            else:
+                self.kinds.append(ACTION)
+                self.actions.append(action)
+        return node
+
+    def tick(self, node=0):
+        """ Ticks the subtree of node and returns its status """
+        kind = self.kinds[node]
+        if kind == ACTION:
+            action = self.actions[node]
+            if self.status[node] is not pt.common.Status.RUNNING:
+                action.initialise()
+            status = action.update()
+        elif kind == CONDITION:
+            status = self.state_machine.table.condition(self.state_machine.state, self.genes[node])
+        else:
+            # a fallback stops at the first child that is running or succeeds, a sequence at the first that is running or fails
+            stop_status = pt.common.Status.SUCCESS if kind == FALLBACK else pt.common.Status.FAILURE
+            previous = self.current_child[node]
+            children = self.children[node]
+            for i, child in enumerate(children):
+                child_status = self.tick(child)
+                if child_status is pt.common.Status.RUNNING or child_status is stop_status:
+                    self.current_child[node] = child
+                    self.status[node] = child_status
+                    if previous != child:
+                        # interrupted, invalidate everything at a lower priority
+                        for sibling in children[i + 1:]:
+                            if self.status[sibling] is not pt.common.Status.INVALID:
+                                self.stop(sibling)
+                    return child_status
+            status = pt.common.Status.FAILURE if kind == FALLBACK else pt.common.Status.SUCCESS
+            self.current_child[node] = children[-1] if children else None
+        self.status[node] = status
+        return status
+
+    def stop(self, node):
+        """ Invalidates the subtree of node """
+        for child in self.children[node]:
+            self.stop(child)
+        self.current_child[node] = None
+        self.status[node] = pt.common.Status.INVALID
+
+    def tick_bt(self, tick_par):
+        """ Executes the tree with the limits of tick_par as PyTree.tick_bt, returns the number of ticks """
+        fails = 0
+        successes = 0
+        ticks = 0
+        while (self.status[0] is not pt.common.Status.FAILURE or fails < tick_par.max_fails) and \
+              (self.status[0] is not pt.common.Status.SUCCESS or successes < tick_par.requested_successes) and \
+              ticks < tick_par.max_ticks:
+            self.tick()
+            ticks += 1
+            if self.status[0] is pt.common.Status.SUCCESS:
+                successes += 1
+            else:
+                successes = 0
+            if self.status[0] is pt.common.Status.FAILURE:
+                fails += 1
+        return ticks
+
+def run_episode(table, string, tick_par):
+    """
+    Runs the tree of string from the start state of the table.
+    Returns the compiled tree and the number of ticks, None if the table is full
+    """
+    tree = CompiledTree(string, TableStateMachine(table))
+    try:
+        ticks = tree.tick_bt(tick_par)
+    except TableFull:
+        return None
+    return tree, ticks
+
+def replay(state_machine, tree):
+    """
+    Runs the transitions of an episode of the compiled tree on the state machine, which computes the continuous
+    feedback. Returns False, leaving the state machine midway, if a discrete outcome differs from the table,
+    which happens if the noise decides which cube is picked
+    """
+    table = tree.state_machine.table
+    for transition, value, state in tree.state_machine.trace:
+        if getattr(state_machine, transition[0])(*transition[1:]) != value or \
+           state_machine.current != table.currents[state] or state_machine.visited != table.visited[state]:
+            return False
+    state_machine.manipulating = tree.state_machine.manipulating
+    state_machine.moving = tree.state_machine.moving
+    return True
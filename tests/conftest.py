@@ -0,0 +1,21 @@
+"""
+Shared fixtures of the tests
+"""
+import os
+import sys
+
+import pytest
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+import logplot as logplot
+
+@pytest.fixture
+def log_dir(tmpdir, monkeypatch):
+    """ Writes the logs of runs in a temporary folder instead of the logs folder of the repository """
+    monkeypatch.setattr(logplot, 'parent_dir', str(tmpdir))
+    os.mkdir(os.path.join(str(tmpdir), 'logs'))
+    return tmpdir
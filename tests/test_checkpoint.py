@@ -0,0 +1,61 @@
+"""
+Test checkpointing and resuming of the genetic programming algorithm
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+from environment import Environment
+import genetic_programming as gp
+import logplot as logplot
+
+def test_resume(log_dir):
+    """ Tests that a resumed run is identical to an uninterrupted one """
+    gp_par = gp.GpParameters()
+    gp_par.n_population = 8
+    gp_par.n_generations = 7
+    gp_par.hall_of_fame_size = 3
+    gp_par.plot = False
+    gp_par.fig_best = False
+    gp_par.log_name = 'test_checkpoint'
+    environment = Environment(1, False, False)
+
+    gp_par.checkpoint_interval = 4
+    gp.set_seeds(1)
+    uninterrupted = gp.run(environment, gp_par)
+    fitness_log = logplot.get_last_fitness(gp_par.log_name)
+    population_log = logplot.get_last_population(gp_par.log_name)
+    hall_of_fame = logplot.get_hall_of_fame(gp_par.log_name)
+
+    #The last checkpoint is at generation 4, generations 5 and 6 are run again
+    gp.set_seeds(2)
+    resumed = gp.resume(environment, gp_par)
+    assert resumed == uninterrupted
+    assert logplot.get_last_fitness(gp_par.log_name) == fitness_log
+    assert logplot.get_last_population(gp_par.log_name) == population_log
+    assert logplot.get_hall_of_fame(gp_par.log_name) == hall_of_fame
+    with open(logplot.get_log_folder(gp_par.log_name) + '/fitness_log.txt') as f:
+        assert len(f.readlines()) == gp_par.n_generations
+
+def test_resume_stopped(log_dir):
+    """ Tests that a run resumed from a checkpoint of its stopping generation stops there too """
+    gp_par = gp.GpParameters()
+    gp_par.n_population = 8
+    gp_par.n_generations = 7
+    gp_par.plot = False
+    gp_par.fig_best = False
+    gp_par.log_name = 'test_checkpoint_stopped'
+    gp_par.checkpoint_interval = 2
+    gp_par.plateau_generations = 2
+    gp_par.plateau_tolerance = float('inf')
+    environment = Environment(1, False, False)
+
+    gp.set_seeds(1)
+    uninterrupted = gp.run(environment, gp_par)
+    assert len(uninterrupted[2]) == 3
+    gp.set_seeds(2)
+    assert gp.resume(environment, gp_par) == uninterrupted
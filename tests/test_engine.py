@@ -0,0 +1,122 @@
+"""
+Test the generation by generation genetic programming engine
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+from environment import Environment
+import genetic_programming as gp
+import logplot as logplot
+
+def parameters(log_name):
+    """ Returns parameters of a short run """
+    gp_par = gp.GpParameters()
+    gp_par.n_population = 8
+    gp_par.n_generations = 6
+    gp_par.plot = False
+    gp_par.fig_best = False
+    gp_par.log_name = log_name
+    return gp_par
+
+def test_interleaved_engines(log_dir):
+    """ Tests that interleaved engines give the same results as separate runs """
+    environment = Environment(1, False, False)
+    separate = []
+    for seed in [1, 2]:
+        gp.set_seeds(seed)
+        separate.append(gp.run(environment, parameters('test_engine' + str(seed))))
+
+    engines = []
+    for seed in [1, 2]:
+        gp.set_seeds(seed)
+        engines.append(gp.GpEngine(environment, parameters('test_engine' + str(seed))))
+    generations = [engine.generations() for engine in engines]
+    states = [[], []]
+    for _ in range(6):
+        for i in range(2):
+            states[i].append(next(generations[i]))
+    for i in range(2):
+        assert [state.generation for state in states[i]] == list(range(6))
+        assert next(generations[i], None) is None
+        assert engines[i].finish() == separate[i]
+        assert states[i][-1].population == separate[i][0]
+        assert [state.best_fitness for state in states[i]] == separate[i][2]
+
+    #Stopping between generations
+    engine = gp.GpEngine(environment, parameters('test_engine1'))
+    for state in engine.generations():
+        if state.generation == 2:
+            engine.stop()
+    assert len(engine.finish()[2]) == 3
+
+def test_pipelined(log_dir):
+    """ Tests that pipelined runs do not depend on the number of workers """
+    environment = Environment(1, False, False)
+    results = []
+    for n_workers in [1, 2]:
+        gp_par = parameters('test_engine_pipelined')
+        gp_par.pipeline_workers = n_workers
+        gp.set_seeds(1)
+        results.append(gp.run(environment, gp_par))
+        with open(logplot.get_log_folder(gp_par.log_name) + '/fitness_log.txt') as f:
+            assert len(f.readlines()) == gp_par.n_generations
+    assert results[0] == results[1]
+
+    #Abandoned runs stop their workers
+    gp_par = parameters('test_engine_pipelined')
+    gp_par.pipeline_workers = 2
+    with gp.GpEngine(environment, gp_par) as engine:
+        engine.step()
+        engine.step()
+        assert engine.executor is not None
+    assert engine.executor is None and engine.writer is None
+
+def test_scenarios_side_by_side(log_dir):
+    """ Tests that engines of different scenarios only use the nodes of their own scenario """
+    environment1 = Environment(1, False, False)
+    gp.set_seeds(1)
+    separate = gp.run(environment1, parameters('test_engine_scenario1'))
+
+    engines = []
+    for seed, environment in [(1, environment1), (2, Environment(3, False, False))]:
+        gp.set_seeds(seed)
+        engines.append(gp.GpEngine(environment, parameters('test_engine_scenario' + str(seed))))
+    generations = [engine.generations() for engine in engines]
+    for _ in range(6):
+        for engine, generation in zip(engines, generations):
+            state = next(generation)
+            for individual in state.population:
+                assert set(individual) <= set(engine.environment.nodes.all_nodes)
+    assert engines[0].finish() == separate
+    engines[1].finish()
+    assert set(environment1.nodes.all_nodes) != set(engines[1].environment.nodes.all_nodes)
+
+    #Trees created without node settings use the ones of the last environment
+    genome = gp.gp_interface.random_genome(10)
+    assert set(genome) <= set(engines[1].environment.nodes.all_nodes)
+
+def test_nested_engines(log_dir):
+    """ Tests an engine stepped by the migration function of another one """
+    environment = Environment(1, False, False)
+    separate = []
+    for seed in [1, 2]:
+        gp.set_seeds(seed)
+        separate.append(gp.run(environment, parameters('test_engine' + str(seed))))
+
+    gp.set_seeds(2)
+    inner = gp.GpEngine(environment, parameters('test_engine2'))
+    def migration(generation, population, fitness, hash_table, environment, engine):
+        inner.step()
+        return population, fitness
+    gp.set_seeds(1)
+    outer = gp.GpEngine(environment, parameters('test_engine1'), migration=migration)
+    inner.step()
+    while not outer.done():
+        outer.step()
+    assert outer.finish() == separate[0]
+    assert inner.finish() == separate[1]
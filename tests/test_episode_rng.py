@@ -0,0 +1,77 @@
+"""
+Test reproducible per-episode random streams
+"""
+import os
+import sys
+
+import random
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+import genetic_programming as gp
+from episode_rng import EpisodeRng
+from environment import Environment
+from hash_table import HashTable
+
+BT_SCENARIO_1 = ['f(', 'task_done?', 's(', 'localise', 'up', 'f(', 'have_block?', 's(', 'tuck', 'move_pick0', ')', ')', 'down', 'pick', 'move_place', 'place', ')', ')']
+BT_SCENARIO_2 = ['f(', 'task_done?', 's(', 'up', 'f(', 'have_block?', 's(', 'localise', 'table1_visited?', 'move_pick0', ')', 's(', 'tuck', 'table2_visited?', 'f(', 'move_pick1', ')', ')', 'move_pick2', ')', 'down', 'pick', 'move_place', 'place', ')', ')']
+
+def test_episode_rng():
+    """ Tests that the streams only depend on their key """
+    genome = ['a', 'b']
+    values = [EpisodeRng(1, genome, 0, block_size=block_size).random() for block_size in (1, 128)]
+    assert values[0] == values[1]
+
+    rng = EpisodeRng(1, genome, 0, block_size=3)
+    sequence = [rng.random() for _ in range(10)]
+    rng = EpisodeRng(1, genome, 0)
+    assert [rng.random() for _ in range(10)] == sequence
+    for key in [(2, genome, 0), (1, ['a', 'c'], 0), (1, genome, 1)]:
+        rng = EpisodeRng(*key)
+        assert [rng.random() for _ in range(10)] != sequence
+
+    rng = EpisodeRng(1, genome, 0)
+    assert all(1.5 <= rng.uniform(1.5, 2.5) < 2.5 for _ in range(1000))
+
+def test_episode_fitness():
+    """ Tests that the fitness of an episode does not depend on the evaluation order or the run generator """
+    for scenario, genome in [(1, BT_SCENARIO_1), (2, BT_SCENARIO_2)]:
+        environment = Environment(scenario, False, False, episode_seed=3)
+        other = ['s(', 'localise', 'up', 'tuck', 'move_pick0', ')']
+
+        random.seed(0)
+        fitness = [environment.get_fitness(genome, episode=i) for i in range(5)]
+        random.seed(1)
+        environment.get_fitness(other)
+        assert [environment.get_fitness(genome, episode=i) for i in reversed(range(5))] == fitness[::-1]
+        assert len(set(fitness)) > 1
+
+        #Reruns through the hash table use the episode counts
+        hash_table = HashTable()
+        for _ in range(3):
+            gp.get_fitness(genome, hash_table, environment, rerun=2)
+        entry = hash_table.find(genome)
+        assert entry.count == 3
+        assert abs(entry.mean - sum(f for f, _ in fitness[:3]) / 3) < 1e-9
+
+def test_common_random_numbers():
+    """ Tests that genomes share the failures of an episode with common random numbers """
+    safe_place = BT_SCENARIO_1[:]
+    safe_place[safe_place.index('move_place')] = 'move_place_s'
+    #Same behaviors, head and localisation in the other order
+    swapped = BT_SCENARIO_1[:]
+    swapped[3], swapped[4] = swapped[4], swapped[3]
+
+    variance = []
+    for common_random_numbers in (False, True):
+        environment = Environment(1, False, False, episode_seed=1, common_random_numbers=common_random_numbers)
+        differences = [environment.get_fitness(BT_SCENARIO_1, episode=i)[0] - \
+                       environment.get_fitness(safe_place, episode=i)[0] for i in range(60)]
+        variance.append(sum(d**2 for d in differences) / len(differences) - (sum(differences) / len(differences))**2)
+        if common_random_numbers:
+            assert all(environment.get_fitness(BT_SCENARIO_1, episode=i) == \
+                       environment.get_fitness(swapped, episode=i) for i in range(20))
+    assert variance[1] < variance[0]
@@ -15,7 +15,11 @@ sys.path.insert(1, behavior_tree_learning_path)
 
 plot_path = os.path.join(parent_dir, 'plots/')
 
-from environment import Environment
+from environment import Environment, load_sm_parameters
+from py_trees_interface import PyTree
+import state_machine as sm
+import behaviors
+import cost_function
 import behavior_tree as behavior_tree
 
 def test_fitness():
@@ -102,3 +106,45 @@ def test_fitness():
     path = plot_path
     environment.plot_individual(path, 'BT_', bt_seq1)
     """
+
+def test_start_states():
+    """ Tests fitness evaluations starting from the states of a shared opening """
+    bt_seq = ['f(', 'task_done?', 's(', 'up', 'f(', 'have_block?', 's(', 'localise', 'table1_visited?', 'move_pick0', ')', 's(', 'tuck', 'table2_visited?', 'f(', 'move_pick1', ')', ')', 'move_pick2', ')', 'down', 'pick', 'move_place', 'place', ')', ')']
+    environment = Environment(2, True, False)
+
+    #Starting after no ticks is the same as starting from the spawn
+    random.seed(0)
+    fitness = environment.get_fitness(bt_seq)
+    random.seed(0)
+    assert environment.get_fitness(bt_seq, start=environment.start_states(bt_seq, 0)) == fitness
+
+    #The start states are forked, so they can be used for several evaluations
+    start = environment.start_states(bt_seq, 4)
+    assert [ticks for _, ticks in start] == [4, 4, 4]
+    snapshots = [state_machine.snapshot() for state_machine, _ in start]
+    for _ in range(2):
+        _, completed = environment.get_fitness(bt_seq, start=start)
+        assert completed
+    assert [state_machine.snapshot() for state_machine, _ in start] == snapshots
+
+def test_prototypes():
+    """ Tests that episodes start from unmodified prototypes and that settings files can set the parameters """
+    bt_seq = ['f(', 'task_done?', 's(', 'localise', 'up', 'f(', 'have_block?', 's(', 'tuck', 'move_pick0', ')', ')', 'down', 'pick', 'move_place', 'place', ')', ')']
+    environment = Environment(1, False, False)
+    prototype = environment.prototype()
+    snapshot = prototype.snapshot()
+    random.seed(0)
+    fitness = [environment.get_fitness(bt_seq) for _ in range(5)]
+    assert environment.prototype() is prototype
+    assert prototype.snapshot() == snapshot
+
+    random.seed(0)
+    for value in fitness:
+        state_machine = sm.StateMachine(1)
+        tree = PyTree(bt_seq[:], behaviors=behaviors, state_machine=state_machine, nodes=environment.nodes)
+        ticks = tree.tick_bt(environment.tick_par)
+        assert -cost_function.compute_cost(state_machine, tree, ticks)[0] == value[0]
+
+    assert load_sm_parameters(environment.settings_path) == sm.SMParameters()
+    sm_par = load_sm_parameters(os.path.join(parent_dir, 'BT_SCENARIO_1_safe.yml'))
+    assert sm_par.drop_probability == 0.2 and sm_par.lost_probability == 0.4
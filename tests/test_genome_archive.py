@@ -0,0 +1,83 @@
+"""
+Test the archive of evaluated genomes
+"""
+import os
+import sys
+
+import random
+import pytest
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+from genome_archive import GenomeArchive
+from hash_table import HashTable
+from hall_of_fame import HallOfFame
+
+def test_archive():
+    """ Tests that the archive agrees with the hash table """
+    random.seed(0)
+    genes = ['s(', 'f(', 'up', 'down', 'pick', 'place', ')']
+    hash_table = HashTable(size=100)
+    archive = GenomeArchive()
+    hash_table.add_listener(archive.hash_table_listener)
+
+    genomes = []
+    for _ in range(300):
+        if genomes and random.random() < 0.5:
+            genome = random.choice(genomes)[:random.randint(1, 6)] + [random.choice(genes)]
+        else:
+            genome = [random.choice(genes) for _ in range(random.randint(1, 6))]
+        genomes.append(genome)
+        hash_table.insert(genome, random.uniform(-10.0, 0.0))
+
+    assert archive.n_values == hash_table.n_values
+    assert len(archive) == hash_table.n_entries
+    assert archive.n_nodes() < sum(len(genome) for genome in genomes)
+    for genome in genomes:
+        assert genome in archive
+        entry = hash_table.find(genome)
+        archived = archive.find(genome)
+        assert archived.count == entry.count
+        assert archived.mean == entry.mean
+        assert archived.variance == pytest.approx(entry.variance)
+    assert ['s(', 'unknown', ')'] not in archive
+    assert archive.find(['s(', 's(', 's(', 's(', 's(', 's(', 's(']) is None
+
+    best = archive.best(5)
+    means = sorted((hash_table.find(genome).mean for genome in genomes), reverse=True)
+    assert [x for x, _ in best] == sorted(set(means), reverse=True)[:5]
+    for mean, genome in best:
+        assert hash_table.find(genome).mean == mean
+
+def test_archive_replay():
+    """ Tests that entries in the table before the archive, or merged into it, reach the archive """
+    random.seed(1)
+    hash_table = HashTable(size=100)
+    genomes = [['s(', str(i), ')'] for i in range(10)]
+    for _ in range(30):
+        hash_table.insert(random.choice(genomes), random.uniform(-10.0, 0.0))
+
+    archive = GenomeArchive()
+    hall_of_fame = HallOfFame(3)
+    hash_table.add_listener(archive.hash_table_listener)
+    hash_table.add_listener(hall_of_fame.hash_table_listener)
+    for _ in range(30):
+        hash_table.insert(random.choice(genomes), random.uniform(-10.0, 0.0))
+    loaded = HashTable(size=100)
+    for _ in range(30):
+        loaded.insert(random.choice(genomes), random.uniform(-10.0, 0.0))
+    for key, entry in loaded.items():
+        hash_table.insert_stats(key, entry)
+
+    assert archive.n_values == hash_table.n_values == 90
+    for key, entry in hash_table.items():
+        archived = archive.find(key)
+        assert archived.count == entry.count
+        assert archived.mean == pytest.approx(entry.mean)
+        assert archived.variance == pytest.approx(entry.variance)
+        assert (archived.min, archived.max) == (entry.min, entry.max)
+    best = sorted(((entry.mean, key) for key, entry in hash_table.items()), reverse=True)[:3]
+    assert hall_of_fame.best() == [(mean, key) for mean, key in best]
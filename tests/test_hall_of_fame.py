@@ -0,0 +1,38 @@
+"""
+Test the hall of fame
+"""
+import os
+import sys
+
+import random
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+from hall_of_fame import HallOfFame
+
+def test_hall_of_fame():
+    """ Tests that the hall of fame keeps the best genomes with their latest fitness """
+    random.seed(0)
+    hall_of_fame = HallOfFame(5)
+    latest = {}
+    for _ in range(1000):
+        genome = ['s(', str(random.randint(0, 50)), ')']
+        fitness = random.uniform(-100.0, 0.0)
+        hall_of_fame.update(genome, fitness)
+        latest[tuple(genome)] = fitness
+
+    best = hall_of_fame.best()
+    assert len(best) == 5
+    assert [f for f, _ in best] == sorted((f for f, _ in best), reverse=True)
+    for fitness, genome in best:
+        assert genome in hall_of_fame
+        assert latest[tuple(genome)] == fitness
+    assert len(hall_of_fame.heap) <= 2 * 5 + 16
+    assert hall_of_fame.genomes(1) == [best[0][1]]
+
+    hall_of_fame.update(best[0][1], -1000.0)
+    assert hall_of_fame.best()[-1] == (-1000.0, best[0][1])
+    assert hall_of_fame.worst() == -1000.0
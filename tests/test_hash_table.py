@@ -0,0 +1,124 @@
+"""
+Test the fitness hash table
+"""
+import os
+import sys
+
+import random
+import statistics
+import pytest
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+from hash_table import HashTable, FitnessStats
+
+def test_running_statistics():
+    """ Tests that the running statistics match the full list of values """
+    random.seed(0)
+    hash_table = HashTable(size=10)
+    values = {}
+    for _ in range(500):
+        key = ['s(', str(random.randint(0, 20)), ')']
+        value = random.uniform(-100.0, 0.0)
+        hash_table.insert(key, value)
+        values.setdefault(str(key), (key, []))[1].append(value)
+
+    assert hash_table.n_values == 500
+    for key, samples in values.values():
+        entry = hash_table.find(key)
+        assert entry.count == len(samples)
+        assert entry.mean == pytest.approx(statistics.mean(samples))
+        if len(samples) > 1:
+            assert entry.variance == pytest.approx(statistics.variance(samples))
+        assert entry.min == min(samples)
+        assert entry.max == max(samples)
+        assert entry.samples == []
+
+    assert hash_table.find(['f(', 'a', ')']) is None
+
+def test_reservoir():
+    """ Tests that the reservoir of raw samples stays bounded """
+    hash_table = HashTable(size=10, reservoir_size=4)
+    key = ['s(', 'a', ')']
+    for i in range(100):
+        entry = hash_table.insert(key, float(i))
+    assert entry.count == 100
+    assert len(entry.samples) == 4
+    assert all(0.0 <= sample < 100.0 for sample in entry.samples)
+
+def test_merge():
+    """ Tests merging of statistics, as done when loading a table """
+    random.seed(1)
+    samples = [random.gauss(0.0, 1.0) for _ in range(50)]
+    first = FitnessStats()
+    second = FitnessStats()
+    for sample in samples[:20]:
+        first.add(sample)
+    for sample in samples[20:]:
+        second.add(sample)
+    first.merge(second)
+
+    assert first.count == 50
+    assert first.mean == pytest.approx(statistics.mean(samples))
+    assert first.variance == pytest.approx(statistics.variance(samples))
+    assert FitnessStats.from_dict(first.as_dict()) == first
+
+def test_merge_reservoir():
+    """ Tests that merged reservoirs sample both sets of values in proportion to their counts """
+    rng = random.Random(2)
+    fraction = []
+    for _ in range(300):
+        first = FitnessStats(reservoir_size=10)
+        second = FitnessStats(reservoir_size=10)
+        for _ in range(900):
+            first.add(0.0, rng)
+        for _ in range(100):
+            second.add(1.0, rng)
+        first.merge(second, rng)
+        assert len(first.samples) == 10
+        fraction.append(sum(first.samples) / 10)
+    assert statistics.mean(fraction) == pytest.approx(0.1, abs=0.02)
+
+    first = FitnessStats(reservoir_size=10)
+    first.merge(second, rng)
+    first.merge(FitnessStats(reservoir_size=10), rng)
+    assert first.samples == second.samples
+
+    #Reservoirs of different sizes, e.g. of a cache written with a smaller reservoir
+    for own, other, n_samples in [(100, 3, 10), (20, 1000, 10), (3, 100, 5)]:
+        first = FitnessStats(reservoir_size=10)
+        second = FitnessStats(reservoir_size=2)
+        for _ in range(own):
+            first.add(0.0, rng)
+        for _ in range(other):
+            second.add(1.0, rng)
+        first.merge(second, rng)
+        assert len(first.samples) == n_samples
+        assert first.count == own + other
+
+def test_counters():
+    """ Tests the accounting of lookups and evaluations """
+    hash_table = HashTable(size=10)
+    key = ['s(', 'a', ')']
+    assert hash_table.find(key) is None
+    hash_table.insert(key, -1.0, eval_time=0.5)
+    hash_table.new_generation()
+    assert hash_table.find(key) is not None
+    assert hash_table.peek(key) is hash_table.find(key)
+    assert hash_table.peek(['s(', 'c', ')']) is None
+    hash_table.insert(key, -2.0, eval_time=1.5)
+    hash_table.insert(['s(', 'b', ')'], -3.0, eval_time=0.5)
+
+    stats = hash_table.generation_stats()
+    assert stats['lookups'] == 2
+    assert stats['hits'] == 2
+    assert stats['misses'] == 0
+    assert stats['reruns'] == 1
+    assert stats['inserts'] == 2
+    assert stats['eval_time'] == 2.0
+    assert stats['mean_eval_time'] == 1.0
+    assert stats['n_entries'] == 2
+    assert hash_table.counters.misses == 1
@@ -0,0 +1,48 @@
+"""
+Test the island model
+"""
+import os
+import sys
+
+import pytest
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+from environment import Environment
+import island_model
+from tests.test_engine import parameters
+
+def test_islands(log_dir):
+    """ Tests two islands exchanging elites, one of them stopping early """
+    environment = Environment(1, False, False)
+    island_par = island_model.IslandParameters(n_islands=2, migration_interval=2, n_migrants=1,
+                                               migration_timeout=60)
+    gp_pars = [parameters('test_island0'), parameters('test_island1')]
+    gp_pars[0].max_episodes = 1
+    results = island_model.run_islands(environment, gp_pars, [1, 2], island_par)
+    assert len(results[0][2]) == 1
+    assert len(results[1][2]) == gp_pars[1].n_generations
+
+    #A failing island does not leave the others waiting
+    gp_pars[0].max_episodes = 0
+    gp_pars[0].parent_selection = None
+    with pytest.raises(RuntimeError):
+        island_model.run_islands(environment, gp_pars, [1, 2], island_par)
+
+def test_stopped_destination(log_dir):
+    """ Tests that a run ends when an island keeps sending elites to an island that has stopped """
+    environment = Environment(1, False, False)
+    island_par = island_model.IslandParameters(n_islands=2, migration_interval=1, n_migrants=20,
+                                               migration_timeout=60)
+    gp_pars = [parameters('test_island0'), parameters('test_island1')]
+    for gp_par in gp_pars:
+        #Enough elites to fill the pipe of the queue of the stopped island
+        gp_par.n_population = 20
+        gp_par.ind_start_length = 15
+        gp_par.n_generations = 150
+    gp_pars[0].max_episodes = 1
+    results = island_model.run_islands(environment, gp_pars, [1, 2], island_par)
+    assert len(results[1][2]) == gp_pars[1].n_generations
@@ -0,0 +1,64 @@
+"""
+Test racing of stochastic fitness values
+"""
+import os
+import sys
+
+import random
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+import genetic_programming as gp
+from hash_table import HashTable
+
+class NoisyEnvironment:
+    """ Environment where the fitness of a genome is its first gene plus gaussian noise """
+    def __init__(self, noise):
+        self.noise = noise
+
+    def get_fitness(self, individual):
+        """ Returns a noisy fitness value, never completed """
+        return float(individual[0]) + random.gauss(0, self.noise[individual[0]]), False
+
+def test_race():
+    """ Tests that only individuals close to the survival cutoff get extra episodes """
+    random.seed(0)
+    candidates = [['100'], ['90'], ['10.5'], ['10'], ['0'], ['-10']]
+    environment = NoisyEnvironment({'100': 1.0, '90': 1.0, '10.5': 3.0, '10': 3.0, '0': 1.0, '-10': 1.0})
+    hash_table = HashTable()
+    fitness = []
+    for individual in candidates:
+        fitness.append(gp.get_fitness(individual, hash_table, environment))
+        fitness[-1] = gp.get_fitness(individual, hash_table, environment, rerun=2)
+
+    gp_par = gp.GpParameters()
+    gp_par.racing_max_episodes = 20
+    fitness, n_episodes = gp.race(candidates, fitness, 3, hash_table, environment, gp_par)
+    counts = [hash_table.find(individual).count for individual in candidates]
+    assert n_episodes == sum(counts) - 2 * len(candidates)
+    assert counts[0] == counts[1] == counts[4] == counts[5] == 2
+    assert counts[2] > 2 and counts[3] > 2
+    assert fitness == [hash_table.find(individual).mean for individual in candidates]
+
+    #Deterministic fitness is never raced
+    environment.noise = {key: 0.0 for key in environment.noise}
+    hash_table = HashTable()
+    fitness = [gp.get_fitness(individual, hash_table, environment, rerun=2) for individual in candidates * 2]
+    fitness = fitness[:len(candidates)]
+    assert gp.race(candidates, fitness, 3, hash_table, environment, gp_par) == (fitness, 0)
+
+    #With a single episode each, only the two candidates closest to the cutoff run again
+    hash_table = HashTable()
+    fitness = [gp.get_fitness(individual, hash_table, environment) for individual in candidates]
+    assert gp.race(candidates, fitness, 3, hash_table, environment, gp_par) == (fitness, 2)
+    assert [hash_table.find(individual).count for individual in candidates] == [1, 1, 2, 2, 1, 1]
+
+    #Candidates missing from the hash table, e.g. screened out at a lower fidelity, are skipped
+    hash_table = HashTable()
+    fitness = [gp.get_fitness(individual, hash_table, environment) for individual in candidates[:4]]
+    fitness += [0.0, -10.0]
+    assert gp.race(candidates, fitness, 3, hash_table, environment, gp_par)[1] == 2
+    assert hash_table.find(candidates[4]) is None
@@ -0,0 +1,38 @@
+"""
+Test multi-fidelity screening of offspring
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+import genetic_programming as gp
+from hash_table import HashTable
+from environment import Environment, Fidelity
+
+def test_screen():
+    """ Tests that screening promotes the best offspring at the cheap level and records its fidelity """
+    environment = Environment(2, False, False)
+    cheap = environment.reduced(Fidelity(deterministic=True, max_ticks=30, pose_ids=[0]))
+    assert cheap.deterministic and cheap.tick_par.max_ticks == 30 and cheap.pose_ids == [0]
+    assert not environment.deterministic and environment.tick_par.max_ticks == 60
+    assert cheap.fingerprint() != environment.fingerprint()
+
+    offspring = [['localise'], ['s(', 'localise', 'move_pick0', ')'], ['place'], \
+                 ['s(', 'move_pick0', 'down', 'pick', ')']]
+    hash_table = HashTable(namespace=environment.fingerprint())
+    gp_par = gp.GpParameters()
+    gp_par.f_promoted = 0.5
+    promoted = gp.screen(offspring, hash_table, [cheap], gp_par)
+
+    assert len(promoted) == 2
+    assert promoted == [individual for individual in offspring if individual in promoted]
+    cheap_fitness = [hash_table.find(individual, cheap.fingerprint()).mean for individual in offspring]
+    assert min(cheap_fitness[offspring.index(individual)] for individual in promoted) == sorted(cheap_fitness)[-2]
+    for individual in offspring:
+        assert hash_table.find(individual) is None
+        assert hash_table.find(individual, cheap.fingerprint()).count == 1
+    assert gp.screen(offspring, hash_table, [], gp_par) == offspring
@@ -0,0 +1,50 @@
+"""
+Test the selection operators of the genetic programming algorithm
+"""
+import os
+import sys
+
+import numpy as np
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+import genetic_programming as gp
+
+def test_elite_selection():
+    """ Tests that elite selection returns the best individuals in order, ties by lowest index """
+    assert gp.elite_selection(range(5), [1, 3, 3, 0, 2], 3) == [1, 2, 4]
+    assert gp.elite_selection(['a', 'b', 'c'], [0, 2, 1], 5) == ['b', 'c', 'a']
+    assert gp.elite_selection(range(3), [0, 2, 1], 0) == []
+
+def test_best_individual():
+    """ Tests that the best individual of tied fitness is the first one, without comparing genomes """
+    population = [['s(', 'a', ')'], ['f(', 'b', ')'], ['s(', 'c', ')']]
+    assert gp.best_individual(population, [-1.0, -2.0, -1.0]) == population[0]
+    assert gp.best_individual([['a'], [0]], [0.0, 0.0]) == ['a']
+
+def test_tournament_selection():
+    """ Tests tournament selection on brackets padded with dummies """
+    gp.set_seeds(0)
+    fitness = list(np.random.random(1000))
+    for n_winners in [1, 3, 100, 999, 1000]:
+        winners = gp.tournament_selection(range(1000), fitness, n_winners)
+        assert len(winners) == n_winners
+        assert len(set(winners)) == n_winners
+    assert gp.tournament_selection(range(1000), fitness, 1) == [int(np.argmax(fitness))]
+    #The best of every bracket of 8 is better than at least 7 others
+    winners = gp.tournament_selection(range(1000), fitness, 125)
+    assert min(np.argsort(np.argsort(fitness))[winners]) >= 7
+
+def test_rank_selection():
+    """ Tests that rank selection follows the linear rank weights """
+    gp.set_seeds(0)
+    n_trials = 20000
+    counts = np.zeros(4)
+    for _ in range(n_trials):
+        counts[gp.rank_selection(range(4), [0.0, 3.0, 1.0, 2.0], 1)] += 1
+    assert np.allclose(counts / n_trials, [0.1, 0.4, 0.2, 0.3], atol=0.02)
+    assert sorted(gp.rank_selection(range(4), [0.0, 3.0, 1.0, 2.0], 4)) == [0, 1, 2, 3]
+    assert sorted(gp.random_selection(range(10), 10)) == list(range(10))
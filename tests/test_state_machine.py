@@ -0,0 +1,277 @@
+"""
+Test the state machine simulator
+"""
+import os
+import sys
+import math
+import random
+from array import array
+import pytest
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+import behaviors
+import state_machine as sm
+
+PICK_TABLES = [sm.Pose.PICK_TABLE0, sm.Pose.PICK_TABLE1, sm.Pose.PICK_TABLE2]
+
+def run_transitions(state_machine):
+    """ A fixed sequence of transitions picking and placing a cube """
+    state_machine.move_head_up()
+    state_machine.localise_robot()
+    state_machine.move_arm(sm.Arm.TUCKED)
+    state_machine.move_to(sm.Pose.PICK_TABLE0)
+    state_machine.move_head_down()
+    state_machine.pick()
+    state_machine.move_head_up()
+    state_machine.move_to(sm.Pose.PLACE_TABLE)
+    state_machine.move_head_down()
+    state_machine.place()
+
+def test_transitions():
+    """ Tests that the deterministic transitions complete the task """
+    state_machine = sm.StateMachine(1, deterministic=True)
+    run_transitions(state_machine)
+    assert state_machine.current[sm.State.POSE] == sm.Pose.PLACE_TABLE
+    assert state_machine.current[sm.State.ARM] == sm.Arm.PLACE
+    assert not state_machine.current[sm.State.HAS_CUBE]
+    assert state_machine.cube_on_goal(0)
+    assert sum(state_machine.feedback[sm.Feedback.CUBE_DISTANCE]) == 0.0
+
+def test_snapshot_restore():
+    """ Tests that restoring a snapshot gives the same episode again """
+    for scenario in (1, 2, 3):
+        state_machine = sm.StateMachine(scenario)
+        random.seed(0)
+        state_machine.localise_robot()
+        snapshot = state_machine.snapshot()
+
+        feedback = []
+        for _ in range(2):
+            state_machine.restore(snapshot)
+            random.seed(1)
+            run_transitions(state_machine)
+            feedback.append((list(state_machine.current), list(state_machine.robot_pose),
+                             [list(x) if isinstance(x, array) else x for x in state_machine.feedback]))
+        assert feedback[0] == feedback[1]
+
+        state_machine.restore(snapshot)
+        assert state_machine.snapshot() == snapshot
+
+def test_fork():
+    """ Tests that forks are independent of the original state machine """
+    state_machine = sm.StateMachine(3)
+    state_machine.move_head_up()
+    fork = state_machine.fork()
+    assert fork.snapshot() == state_machine.snapshot()
+
+    random.seed(0)
+    run_transitions(fork)
+    assert fork.snapshot() != state_machine.snapshot()
+    assert state_machine.current[sm.State.HEAD] == sm.Head.UP
+    assert state_machine.feedback[sm.Feedback.ELAPSED_TIME] == 2.0
+    assert fork.layout is state_machine.layout
+
+def test_distance_tables():
+    """ Tests the precomputed distances against the feedback distances after random moves """
+    random.seed(0)
+    state_machine = sm.StateMachine(3)
+    assert state_machine.pose_coordinates[sm.Pose.PLACE_TABLE] == tuple(state_machine.layout.place_table)
+    for pose in sm.Pose:
+        if pose != sm.Pose.HALF_WAY:
+            assert state_machine.layout.pose_names()[pose] == pose.name.lower().replace('_', '') \
+                .replace('picktable', 'pick_table').replace('placetable', 'place_table')
+            assert state_machine.place_distances[pose] == sm.distance(state_machine.pose_coordinates[pose],
+                                                                      state_machine.layout.place_table)
+
+    state_machine.move_head_up()
+    state_machine.move_arm(sm.Arm.TUCKED)
+    for _ in range(50):
+        state_machine.localise_robot()
+        state_machine.move_to(random.choice(PICK_TABLES))
+        state_machine.move_head_down()
+        state_machine.pick()
+        state_machine.move_head_up()
+        state_machine.move_to(sm.Pose.PLACE_TABLE)
+        feedback = state_machine.feedback
+        cubes = feedback[sm.Feedback.CUBE]
+        for i in range(state_machine.cubes):
+            assert feedback[sm.Feedback.CUBE_DISTANCE][i] == sm.distance(cubes[3*i:3*i + 3], state_machine.cube_goal)
+            assert feedback[sm.Feedback.ROBOT_CUBE_DISTANCE][i] == sm.distance(state_machine.robot_pose, cubes[3*i:3*i + 2])
+        assert feedback[sm.Feedback.ROBOT_DISTANCE] == sm.distance(state_machine.robot_pose, state_machine.layout.place_table)
+
+class FullUpdateStateMachine(sm.StateMachine):
+    """
+    State machine recomputing all the feedback at every update.
+    update_feedback is the one from before the change tracking, with only the renames of the later layout
+    and random stream changes, and the displaced cubes of the proximity index
+    """
+    __slots__ = ()
+
+    def update_feedback(self):
+        """ Update the Feedback state """
+        feedback = self.feedback
+        # Update AMCL
+        if self.current[sm.State.LOCALISED]:
+            self.amcl_near_pose()
+        else:
+            # big error around last known pose
+            noise = [self.rng.uniform(1.5, 2.5), self.rng.uniform(1.5, 2.5)]
+            feedback[sm.Feedback.AMCL][0] += noise[0]
+            feedback[sm.Feedback.AMCL][1] += noise[1]
+
+        feedback[sm.Feedback.LOCALIZATION_ERROR] = sm.distance(feedback[sm.Feedback.AMCL], self.robot_pose)
+
+        pose = self.current[sm.State.POSE]
+        cubes = feedback[sm.Feedback.CUBE]
+        cube_id = self.current[sm.State.CUBE_ID]
+        if self.current[sm.State.HAS_CUBE] and cube_id >= 0:
+            angle = self.angles[pose] if pose != sm.Pose.HALF_WAY else sm.DEFAULT_ANGLE
+            # x coordinate + 50cm (accounting to the robot in picking pose)
+            cubes[3*cube_id] = float(self.robot_pose[0] + 0.3*angle[0]) + self.rng.uniform(-0.1, 0.1)
+            # y coordinate + 50cm (accounting to the robot in picking pose)
+            cubes[3*cube_id + 1] = float(self.robot_pose[1] + 0.3*angle[1]) + self.rng.uniform(-0.1, 0.1)
+            # z coordinate
+            cubes[3*cube_id + 2] = float(self.rng.uniform(1.3, 1.4))
+            if self.spawn_follows >> cube_id & 1:
+                self.cubes_spawn[3*cube_id:3*cube_id + 3] = cubes[3*cube_id:3*cube_id + 3]
+            self.displaced |= 1 << cube_id
+
+        # same operations as distance, with the goal and robot coordinates unpacked once
+        goal_x, goal_y, goal_z = self.cube_goal
+        robot_x, robot_y = self.robot_pose
+        cube_distance = feedback[sm.Feedback.CUBE_DISTANCE]
+        min_cube_distance = feedback[sm.Feedback.MIN_CUBE_DISTANCE]
+        robot_cube_distance = feedback[sm.Feedback.ROBOT_CUBE_DISTANCE]
+        min_rc_distance = feedback[sm.Feedback.MIN_RC_DISTANCE]
+        for i in range(self.cubes):
+            x, y, z = cubes[3*i:3*i + 3]
+            cube_distance[i] = math.sqrt((x - goal_x)**2 + (y - goal_y)**2 + (z - goal_z)**2)
+            # update min distance (cube from goal)
+            if cube_distance[i] < min_cube_distance[i]:
+                min_cube_distance[i] = cube_distance[i]
+
+            robot_cube_distance[i] = math.sqrt((robot_x - x)**2 + (robot_y - y)**2)
+            # update min distance (robot from cube)
+            if robot_cube_distance[i] < min_rc_distance[i]:
+                min_rc_distance[i] = robot_cube_distance[i]
+
+        if pose == sm.Pose.HALF_WAY:
+            feedback[sm.Feedback.ROBOT_DISTANCE] = sm.distance(self.robot_pose, self.layout.place_table)
+        else:
+            feedback[sm.Feedback.ROBOT_DISTANCE] = self.place_distances[pose]
+
+def random_episode(state_machine, actions, seed):
+    """ Runs the given transitions and returns the snapshots after each of them """
+    random.seed(seed)
+    snapshots = []
+    for action, argument in actions:
+        if argument is None:
+            getattr(state_machine, action)()
+        else:
+            getattr(state_machine, action)(*argument)
+        snapshots.append(state_machine.snapshot())
+    return snapshots
+
+def test_incremental_feedback():
+    """ Tests on random transition sequences that the incremental feedback matches a full update """
+    sampler = random.Random(0)
+    for seed in range(200):
+        scenario = sampler.choice([1, 2, 3])
+        deterministic = sampler.random() < 0.3
+        pose_id = sampler.randrange(3)
+        actions = []
+        for _ in range(sampler.randint(1, 60)):
+            action = sampler.choice(['localise_robot', 'move_to', 'move_arm', 'pick', 'place',
+                                     'move_head_up', 'move_head_down'])
+            argument = None
+            if action == 'move_to':
+                argument = (sampler.choice([p for p in sm.Pose if p != sm.Pose.HALF_WAY]), sampler.random() < 0.2)
+            elif action == 'move_arm':
+                argument = (sampler.choice(list(sm.Arm)),)
+            #Bias towards the sequences that pick and carry cubes
+            if sampler.random() < 0.5:
+                actions += [('move_head_up', None), ('move_arm', (sm.Arm.TUCKED,)),
+                            ('move_to', (sampler.choice(PICK_TABLES), False)), ('move_head_down', None), ('pick', None)]
+            actions.append((action, argument))
+
+        #Frequent drops, so that cubes also respawn away from where they were held
+        drop_probability = sampler.choice([0.05, 0.5])
+
+        snapshots = []
+        for state_machine_class in (sm.StateMachine, FullUpdateStateMachine):
+            state_machine = state_machine_class(scenario, deterministic, pose_id=pose_id)
+            state_machine.sm_par.drop_probability = drop_probability
+            snapshots.append(random_episode(state_machine, actions, seed))
+        assert snapshots[0] == snapshots[1]
+
+class FullScanStateMachine(sm.StateMachine):
+    """ State machine looking for the cube to pick among all cubes, as before the proximity index """
+    __slots__ = ()
+
+    def nearest_cube(self):
+        robot_cube_distance = self.feedback[sm.Feedback.ROBOT_CUBE_DISTANCE]
+        if min(robot_cube_distance) < sm.PICK_RANGE:
+            return robot_cube_distance.index(min(robot_cube_distance))
+        return -1
+
+def random_layout(sampler, n_tables, n_cubes):
+    """ A layout with pick tables on a grid and cubes spawning next to random tables, some on the same table """
+    tables = [[2.0*(i % 6), 2.0*(i // 6)] for i in range(n_tables)]
+    cubes = []
+    for _ in range(n_cubes):
+        x, y = sampler.choice(tables)
+        cubes.append([x + sampler.uniform(-0.5, 0.5), y + sampler.uniform(-0.5, 0.5), 0.86])
+    return sm.Layout(pick_tables=tables, place_table=[14.0, 0.0], cubes_spawn_pose=cubes, cube_goal_pose=[14.5, 0.0, 0.86],
+                     random_poses=[[-2.0, 3.0]], angles={})
+
+def test_large_layout():
+    """ Tests on a layout with many tables and cubes that picking only the cubes near the robot is exact """
+    sampler = random.Random(1)
+    layout = random_layout(sampler, 30, 40)
+    state_machine = sm.StateMachine(3, True, layout=layout)
+    assert state_machine.cubes == 40
+    assert state_machine.named_poses['pick_table29'] == 30
+    assert state_machine.named_poses['place_table'] == state_machine.place_pose == 31
+    assert state_machine.named_poses['origin'] == 33
+
+    tables = [state_machine.named_poses['pick_table' + str(i)] for i in range(30)]
+    placed = 0
+    for seed in range(50):
+        deterministic = sampler.random() < 0.3
+        actions = [('move_head_up', None), ('localise_robot', None), ('move_arm', (sm.Arm.TUCKED,))]
+        for _ in range(sampler.randint(1, 20)):
+            table = sampler.choice(tables)
+            actions += [('move_head_up', None), ('move_arm', (sampler.choice([sm.Arm.TUCKED, sm.Arm.PICK]),)),
+                        ('move_to', (table, False)), ('move_head_down', None), ('pick', None), ('place', None),
+                        ('move_head_up', None), ('move_to', (state_machine.place_pose, False)), ('move_head_down', None),
+                        (sampler.choice(['place', 'pick', 'localise_robot']), None)]
+
+        snapshots = []
+        for state_machine_class in (sm.StateMachine, FullScanStateMachine):
+            state_machine = state_machine_class(3, deterministic, layout=layout)
+            state_machine.sm_par.drop_probability = 0.3
+            snapshots.append(random_episode(state_machine, actions, seed))
+        assert snapshots[0] == snapshots[1]
+        placed += sum(state_machine.cube_on_goal(i) for i in range(state_machine.cubes))
+    assert placed > 0
+
+def test_numbered_behaviors():
+    """ Tests the behaviors of numbered tables, cubes and random poses beyond those of the default layout """
+    state_machine = sm.StateMachine(3, layout=random_layout(random.Random(2), 30, 40))
+    node, _ = behaviors.get_node_from_string('move_pick25', state_machine)
+    assert node.sm_pose == state_machine.named_poses['pick_table25'] == 26
+    node, _ = behaviors.get_node_from_string('move_rand_1', state_machine)
+    assert node.sm_pose == state_machine.place_pose + 1
+    node, _ = behaviors.get_node_from_string('cube39_placed?', state_machine)
+    assert node.cube_ID == 39
+    node, _ = behaviors.get_node_from_string('table29_visited?', state_machine)
+    assert node.update() == behaviors.pt.common.Status.FAILURE
+    state_machine.visited[29] = 1
+    assert node.update() == behaviors.pt.common.Status.SUCCESS
+    for string in ['move_pick01', 'move_rand_0', 'table3_placed?', 'cube1']:
+        with pytest.raises(Exception, match="Unexpected character"):
+            behaviors.get_node_from_string(string, state_machine)
@@ -0,0 +1,37 @@
+"""
+Test the asynchronous steady-state genetic programming
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+from environment import Environment
+import steady_state
+import logplot as logplot
+from tests.test_engine import parameters
+
+def test_steady_state(log_dir):
+    """ Tests a short steady-state run with a single worker """
+    environment = Environment(1, False, False)
+    gp_par = parameters('test_steady_state')
+    ss_par = steady_state.SteadyStateParameters(n_workers=1, n_episodes=40, log_interval=10)
+    population, fitness, best_fitness, best_individual, _ = \
+        steady_state.run_steady_state(environment, gp_par, ss_par, seed=1)
+    assert len(population) == gp_par.n_population
+    assert best_fitness[-1] == max(fitness)
+    assert best_individual == population[fitness.index(max(fitness))]
+
+    #Episodes are not dispatched beyond the budget
+    ss_par = steady_state.SteadyStateParameters(n_workers=2, n_episodes=37, log_interval=10)
+    steady_state.run_steady_state(environment, gp_par, ss_par, seed=1)
+    assert logplot.get_n_episodes(gp_par.log_name)[-1] == 37
+
+    #Nothing evaluated
+    ss_par.n_episodes = 0
+    population, fitness, best_fitness, best_individual, _ = \
+        steady_state.run_steady_state(environment, gp_par, ss_par, seed=1)
+    assert population == [] and best_fitness == [] and best_individual is None
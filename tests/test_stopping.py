@@ -0,0 +1,50 @@
+"""
+Test the stopping criteria of the genetic programming algorithm
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+from environment import Environment
+import genetic_programming as gp
+from tests.test_engine import parameters
+
+def test_stopping_criterion():
+    """ Tests each stopping criterion on its own """
+    gp_par = gp.GpParameters()
+    best_fitness = [-10, -5, -5, -4.9, -4.9]
+    n_episodes = [10, 20, 30, 40, 50]
+    assert gp.stopping_criterion(gp_par, 4, best_fitness, n_episodes, 100.0, 2) is None
+
+    gp_par.max_episodes = 50
+    assert gp.stopping_criterion(gp_par, 4, best_fitness, n_episodes, 0.0, None) is not None
+    gp_par.max_episodes = 60
+    assert gp.stopping_criterion(gp_par, 4, best_fitness, n_episodes, 0.0, None) is None
+
+    gp_par.max_time = 10.0
+    assert gp.stopping_criterion(gp_par, 4, best_fitness, n_episodes, 10.0, None) is not None
+    assert gp.stopping_criterion(gp_par, 4, best_fitness, n_episodes, 9.0, None) is None
+
+    gp_par.plateau_generations = 3
+    assert gp.stopping_criterion(gp_par, 4, best_fitness, n_episodes, 0.0, None) is None
+    gp_par.plateau_tolerance = 0.2
+    assert gp.stopping_criterion(gp_par, 4, best_fitness, n_episodes, 0.0, None) is not None
+    gp_par.plateau_generations = 5
+    assert gp.stopping_criterion(gp_par, 4, best_fitness, n_episodes, 0.0, None) is None
+
+    gp_par.completed_grace = 2
+    assert gp.stopping_criterion(gp_par, 4, best_fitness, n_episodes, 0.0, 3) is None
+    assert gp.stopping_criterion(gp_par, 5, best_fitness, n_episodes, 0.0, 3) is not None
+    gp_par.completed_grace = 0
+    assert gp.stopping_criterion(gp_par, 3, best_fitness, n_episodes, 0.0, 3) is not None
+
+def test_initial_budget(log_dir):
+    """ Tests that a budget used up by the initial population stops the run after generation 0 """
+    gp_par = parameters('test_stopping')
+    gp_par.max_episodes = gp_par.n_population
+    gp.set_seeds(1)
+    assert len(gp.run(Environment(1, False, False), gp_par)[2]) == 1
@@ -0,0 +1,46 @@
+"""
+Test the surrogate fitness model
+"""
+import os
+import sys
+
+import random
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+from surrogate import Surrogate
+from hash_table import HashTable
+
+GENES = ['s(', 'f(', ')', 'pick', 'place', 'localise', 'up', 'down']
+
+def fitness(genome):
+    """ Synthetic fitness linear in the features """
+    return 10 * genome.count('pick') - 0.5 * len(genome)
+
+def test_surrogate():
+    """ Tests that the surrogate learns a linear fitness and skips the worst offspring """
+    random.seed(0)
+    surrogate = Surrogate(ridge=0.01)
+    hash_table = HashTable()
+    hash_table.add_listener(surrogate.hash_table_listener)
+    for _ in range(300):
+        genome = [random.choice(GENES) for _ in range(random.randint(1, 10))]
+        hash_table.insert(genome, fitness(genome))
+
+    offspring = [['pick', 'pick'], ['place'], ['s(', 'pick', ')'], ['up', 'down', 'up', 'down', 'up']]
+    assert surrogate.select(offspring, hash_table, 0.5) == offspring
+    surrogate.fit()
+    for genome in offspring:
+        assert abs(surrogate.predict(genome) - fitness(genome)) < 0.1
+
+    selected = surrogate.select(offspring, hash_table, 0.5)
+    assert selected == [genome for genome in offspring if genome.count('pick') > 0]
+    for genome in selected:
+        hash_table.insert(genome, fitness(genome))
+    stats = surrogate.generation_stats()
+    assert stats['skipped'] == sum(hash_table.find(genome) is None for genome in offspring)
+    assert stats['n_predicted'] + stats['skipped'] <= len(offspring)
+    assert stats['mean_absolute_error'] is None or stats['mean_absolute_error'] < 0.1
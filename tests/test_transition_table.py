@@ -0,0 +1,78 @@
+"""
+Test deterministic episodes run as lookups in the transition table
+"""
+import os
+import sys
+
+import random
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+behavior_tree_learning_path = os.path.join(parent_dir, 'behavior_tree_learning')
+sys.path.insert(1, behavior_tree_learning_path)
+
+import behaviors
+import gp_bt_interface as gp_interface
+import transition_table
+from environment import Environment
+from py_trees_interface import PyTree
+
+BT_SCENARIO_3 = ['f(', 'task_done?', 's(', 'up', 'localise', 'f(', 'have_block?', 's(', 'tuck', 'cube0_placed?', 'move_pick2', ')',
+                 's(', 'cube1_placed?', 'move_pick0', ')', 'move_pick1', ')', 'down', 'pick', 'move_place', 'place', ')', ')']
+
+def random_genomes(n, seed):
+    """ Random genomes and mutations of a solution of scenario 3 """
+    nodes = Environment(3, True, False).nodes
+    random.seed(seed)
+    genomes = []
+    for _ in range(n):
+        genome = gp_interface.random_genome(random.randint(3, 10), nodes) if random.random() < 0.5 else BT_SCENARIO_3[:]
+        for _ in range(random.randint(0, 4)):
+            genome = gp_interface.mutate_gene(genome, 0.4, 0.3, nodes) or genome
+        genomes.append(genome)
+    return genomes
+
+def test_compiled_tree():
+    """ Tests that the episodes of the table end in the same state as the episodes of py_trees """
+    for scenario in (1, 2, 3):
+        environment = Environment(scenario, True, False)
+        table = environment.transition_table()
+        for i, genome in enumerate(random_genomes(100, scenario) + [BT_SCENARIO_3]):
+            reference = environment.prototype().fork()
+            behavior_tree = PyTree(genome[:], behaviors=behaviors, state_machine=reference, nodes=environment.nodes)
+            random.seed(i)
+            ticks = behavior_tree.tick_bt(environment.tick_par)
+
+            tree, table_ticks = transition_table.run_episode(table, genome, environment.tick_par)
+            state_machine = environment.prototype().fork()
+            random.seed(i)
+            assert transition_table.replay(state_machine, tree)
+            assert (table_ticks, tree.depth, tree.length) == (ticks, behavior_tree.depth, behavior_tree.length)
+            assert state_machine.snapshot() == reference.snapshot()
+        assert len(table) > 1
+
+def test_table_fitness():
+    """ Tests that the fitness does not change with the transition table, also when it falls back to py_trees """
+    genomes = random_genomes(60, 0)
+    for scenario in (2, 3):
+        fitness = []
+        for use_transition_table in (False, True):
+            environment = Environment(scenario, True, False, use_transition_table=use_transition_table)
+            random.seed(1)
+            fitness.append([environment.get_fitness(genome) for genome in genomes])
+        assert fitness[0] == fitness[1]
+
+        #Wrong picks in the table are found by the replay, the episodes run again from the same random state
+        for table in environment.transition_tables.values():
+            for key, (value, state) in table.transitions.items():
+                if key[1] == ('pick',):
+                    table.transitions[key] = (not value, state)
+        random.seed(1)
+        assert [environment.get_fitness(genome) for genome in genomes] == fitness[0]
+
+        #Episodes reaching new states when the table is full run with py_trees
+        environment = Environment(scenario, True, False, episode_seed=2, use_transition_table=True)
+        environment.transition_table().max_states = 3
+        reference = Environment(scenario, True, False, episode_seed=2)
+        assert [environment.get_fitness(genome, episode=1) for genome in genomes] == \
+               [reference.get_fitness(genome, episode=1) for genome in genomes]